@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+A minimal in-process stand-in for the GCS JSON and media APIs (listing, downloads, multipart and
+resumable uploads, compose, rewrite, delete and batches of those), good enough to drive google-cloud-storage (and so
+myutil) against synthetic buckets without a network.
+
+Point a client at it with FakeGCS.client(), or a separate process with
+STORAGE_EMULATOR_HOST=<FakeGCS.url>.
+"""
+import base64
+import bisect
+import hashlib
+import http.client
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+import google_crc32c
+
+BLOCK_SIZE = 1 << 16
+# Bytes copied per rewrite call before handing back a rewrite token, like GCS does for large objects
+REWRITE_CHUNK = 1 << 24
+
+
+class FakeObject(object):
+    """An object whose content is either given or generated deterministically from its name"""
+
+    def __init__(self, name, size=None, data=None, generation=1, content_type='application/octet-stream', seed=None):
+        self.name = name
+        # Copies keep generating the content of the object they were copied from
+        self.seed = seed or name
+        self.content_type = content_type
+        self.data = data
+        self.size = len(data) if data is not None else size
+        self.generation = generation
+        self.updated = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        self._hashes = None
+
+    def _block(self):
+        seed = hashlib.sha256(self.seed.encode('utf-8')).digest()
+        return (seed * (BLOCK_SIZE // len(seed)))[:BLOCK_SIZE]
+
+    def read(self, start=0, end=None):
+        """Return bytes [start, end) of the content"""
+        end = self.size if end is None else min(end, self.size)
+        if self.data is not None:
+            return self.data[start:end]
+        block = self._block()
+        chunks = []
+        while start < end:
+            offset = start % BLOCK_SIZE
+            length = min(BLOCK_SIZE - offset, end - start)
+            chunks.append(block[offset:offset + length])
+            start += length
+        return b''.join(chunks)
+
+    def hashes(self):
+        if self._hashes is None:
+            crc = google_crc32c.Checksum()
+            md5 = hashlib.md5()
+            for start in range(0, self.size, 1 << 22):
+                chunk = self.read(start, start + (1 << 22))
+                crc.update(chunk)
+                md5.update(chunk)
+            self._hashes = (base64.b64encode(crc.digest()).decode('ascii'),
+                            base64.b64encode(md5.digest()).decode('ascii'))
+        return self._hashes
+
+    def resource(self, bucket, base_url, fields=None):
+        (crc32c, md5) = self.hashes() if fields is None or 'crc32c' in fields or 'md5Hash' in fields else (None, None)
+        quoted = quote(self.name, safe='')
+        resource = {
+            'kind': 'storage#object',
+            'id': '{}/{}/{}'.format(bucket, self.name, self.generation),
+            'name': self.name,
+            'bucket': bucket,
+            'generation': str(self.generation),
+            'metageneration': '1',
+            'size': str(self.size),
+            'contentType': self.content_type,
+            'updated': self.updated,
+            'timeCreated': self.updated,
+            'crc32c': crc32c,
+            'md5Hash': md5,
+            'selfLink': '{}/storage/v1/b/{}/o/{}'.format(base_url, bucket, quoted),
+            'mediaLink': '{}/download/storage/v1/b/{}/o/{}?generation={}&alt=media'.format(
+                base_url, bucket, quoted, self.generation),
+        }
+        if fields is not None:
+            resource = dict((key, value) for (key, value) in resource.items() if key in fields)
+        return resource
+
+
+class FakeGCS(object):
+    """Holds buckets of FakeObjects and serves them over HTTP on a background thread"""
+
+    def __init__(self, page_size=1000, rewrite_chunk=REWRITE_CHUNK):
+        self.buckets = {}
+        self.page_size = page_size
+        self.rewrite_chunk = rewrite_chunk
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._generation = 1
+        self._sorted = None
+        self.uploads = {}
+        self.server = None
+
+    def add(self, bucket, name, size=None, data=None, content_type='application/octet-stream', seed=None):
+        with self._lock:
+            self._generation += 1
+            obj = FakeObject(name, size=size, data=data, generation=self._generation, content_type=content_type,
+                             seed=seed)
+            self.buckets.setdefault(bucket, {})[name] = obj
+            self._sorted = None
+        return obj
+
+    def delete(self, bucket, name):
+        with self._lock:
+            obj = self.buckets.get(bucket, {}).pop(name, None)
+            self._sorted = None
+        return obj
+
+    def names(self, bucket):
+        if self._sorted is None:
+            self._sorted = dict((name, sorted(objects)) for (name, objects) in self.buckets.items())
+        return self._sorted.get(bucket, [])
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server.server_address)
+
+    def start(self):
+        fake = self
+
+        class Handler(_Handler):
+            gcs = fake
+
+        self.server = _ThreadingServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, **kwargs):
+        """Build a google-cloud-storage client pointed at this server"""
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import storage
+        return storage.Client(project='fake', credentials=AnonymousCredentials(),
+                              client_options={'api_endpoint': self.url}, **kwargs)
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Short-lived clients (ex: startup cases) exit with keep-alive connections still open
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super(_ThreadingServer, self).handle_error(request, client_address)
+
+
+def _parse_fields(value):
+    if not value:
+        return None
+    match = re.search(r'items\(([^)]*)\)', value)
+    return set((match.group(1) if match else value).split(','))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    gcs = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+
+    def _object(self, bucket, name):
+        return self.gcs.buckets.get(bucket, {}).get(name)
+
+    def do_GET(self):
+        with self.gcs._lock:
+            self.gcs.requests += 1
+        url = urlparse(self.path)
+        query = dict((key, values[0]) for (key, values) in parse_qs(url.query).items())
+        match = re.match(r'^/download/storage/v1/b/([^/]+)/o/(.+)$', url.path)
+        if match:
+            return self._media(unquote(match.group(1)), unquote(match.group(2)))
+        match = re.match(r'^/storage/v1/b/([^/]+)/o/(.+)$', url.path)
+        if match:
+            (bucket, name) = (unquote(match.group(1)), unquote(match.group(2)))
+            if query.get('alt') == 'media':
+                return self._media(bucket, name)
+            obj = self._object(bucket, name)
+            if obj is None:
+                return self._not_found()
+            return self._send_json(200, obj.resource(bucket, self.gcs.url, _parse_fields(query.get('fields'))))
+        match = re.match(r'^/storage/v1/b/([^/]+)/o/?$', url.path)
+        if match:
+            return self._list(unquote(match.group(1)), query)
+        match = re.match(r'^/storage/v1/b/([^/]+)/?$', url.path)
+        if match:
+            if match.group(1) not in self.gcs.buckets:
+                return self._not_found()
+            return self._send_json(200, {'kind': 'storage#bucket', 'name': match.group(1), 'id': match.group(1)})
+        self._not_found()
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _created(self, bucket, obj):
+        self._send_json(200, obj.resource(bucket, self.gcs.url))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = dict((key, values[0]) for (key, values) in parse_qs(url.query).items())
+        body = self._body()
+        if url.path == '/batch/storage/v1':
+            return self._batch(body)
+        match = re.match(r'^/upload/storage/v1/b/([^/]+)/o$', url.path)
+        if match:
+            bucket = unquote(match.group(1))
+            if query.get('uploadType') == 'multipart':
+                return self._multipart(bucket, body)
+            # Resumable: remember the metadata and hand out a session URL to PUT chunks to
+            metadata = json.loads(body.decode('utf-8')) if body else {}
+            with self.gcs._lock:
+                upload_id = str(len(self.gcs.uploads) + 1)
+                self.gcs.uploads[upload_id] = (bucket, metadata.get('name') or query.get('name'),
+                                               metadata.get('contentType') or self.headers.get('X-Upload-Content-Type')
+                                               or 'application/octet-stream', [])
+            self.send_response(200)
+            self.send_header('Location', '{}/upload/storage/v1/b/{}/o?uploadType=resumable&upload_id={}'.format(
+                self.gcs.url, quote(bucket, safe=''), upload_id))
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        match = re.match(r'^/storage/v1/b/([^/]+)/o/(.+)/compose$', url.path)
+        if match:
+            return self._compose(unquote(match.group(1)), unquote(match.group(2)), json.loads(body.decode('utf-8')))
+        match = re.match(r'^/storage/v1/b/([^/]+)/o/(.+)/rewriteTo/b/([^/]+)/o/(.+)$', url.path)
+        if match:
+            return self._rewrite([unquote(group) for group in match.groups()], query)
+        self._not_found()
+
+    def _multipart(self, bucket, body):
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type')).group(1).encode('ascii')
+        parts = [part.split(b'\r\n\r\n', 1) for part in body.split(b'--' + boundary)[1:-1]]
+        metadata = json.loads(parts[0][1][:-2].decode('utf-8'))
+        media_type = re.search(br'content-type:\s*([^\r\n]+)', parts[1][0], re.IGNORECASE)
+        obj = self.gcs.add(bucket, metadata['name'], data=parts[1][1][:-2],
+                           content_type=metadata.get('contentType') or
+                           (media_type.group(1).decode('ascii') if media_type else 'application/octet-stream'))
+        self._created(bucket, obj)
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        query = dict((key, values[0]) for (key, values) in parse_qs(url.query).items())
+        body = self._body()
+        upload = self.gcs.uploads.get(query.get('upload_id'))
+        if upload is None:
+            return self._not_found()
+        (bucket, name, content_type, chunks) = upload
+        chunks.append(body)
+        received = sum(len(chunk) for chunk in chunks)
+        total = (self.headers.get('Content-Range') or '').rsplit('/', 1)[-1]
+        if total.isdigit() and received >= int(total):
+            del self.gcs.uploads[query['upload_id']]
+            return self._created(bucket, self.gcs.add(bucket, name, data=b''.join(chunks), content_type=content_type))
+        self.send_response(308)
+        if received:
+            self.send_header('Range', 'bytes=0-{}'.format(received - 1))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _compose(self, bucket, name, body):
+        sources = [self._object(bucket, source['name']) for source in body['sourceObjects']]
+        if None in sources:
+            return self._not_found()
+        content_type = body.get('destination', {}).get('contentType') or sources[0].content_type
+        obj = self.gcs.add(bucket, name, data=b''.join(source.read() for source in sources), content_type=content_type)
+        self._created(bucket, obj)
+
+    def _rewrite(self, names, query):
+        (bucket, name, destination_bucket, destination) = names
+        source = self._object(bucket, name)
+        if source is None or query.get('sourceGeneration', str(source.generation)) != str(source.generation):
+            return self._not_found()
+        # The token is how far the copy has got
+        rewritten = min(int(query.get('rewriteToken') or 0) + self.gcs.rewrite_chunk, source.size)
+        body = {'kind': 'storage#rewriteResponse', 'totalBytesRewritten': str(rewritten),
+                'objectSize': str(source.size), 'done': rewritten >= source.size}
+        if rewritten < source.size:
+            body['rewriteToken'] = str(rewritten)
+        else:
+            obj = self.gcs.add(destination_bucket, destination, size=source.size, data=source.data,
+                               content_type=source.content_type, seed=source.seed)
+            body['resource'] = obj.resource(destination_bucket, self.gcs.url)
+        self._send_json(200, body)
+
+    def _batch(self, body):
+        """Run each part of a multipart/mixed batch as its own request against this server"""
+        message = Parser().parsestr('Content-Type: {}\n\n{}'.format(self.headers.get('Content-Type'),
+                                                                    body.decode('utf-8')))
+        boundary = 'batch_{}'.format(uuid.uuid4().hex)
+        parts = []
+        connection = http.client.HTTPConnection(*self.gcs.server.server_address)
+        try:
+            for part in message.get_payload():
+                (request_line, rest) = part.get_payload().replace('\r\n', '\n').split('\n', 1)
+                (method, uri, _) = request_line.split(' ', 2)
+                (headers, sub_body) = rest.split('\n\n', 1) if '\n\n' in rest else (rest, '')
+                connection.request(method, urlparse(uri)._replace(scheme='', netloc='').geturl(),
+                                   body=sub_body.encode('utf-8') or None)
+                response = connection.getresponse()
+                data = response.read().decode('utf-8')
+                parts.append('--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n'
+                             'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n\r\n{}\r\n'.format(
+                                 boundary, part.get('Content-ID', '').strip('<>'), response.status,
+                                 response.reason, data))
+        finally:
+            connection.close()
+        payload = ''.join(parts + ['--{}--\r\n'.format(boundary)]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/mixed; boundary={}'.format(boundary))
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_DELETE(self):
+        match = re.match(r'^/storage/v1/b/([^/]+)/o/(.+)$', urlparse(self.path).path)
+        if not match or self.gcs.delete(unquote(match.group(1)), unquote(match.group(2))) is None:
+            return self._not_found()
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _list(self, bucket, query):
+        names = self.gcs.names(bucket)
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter')
+        page_size = min(int(query.get('maxResults', self.gcs.page_size)), self.gcs.page_size)
+        fields = _parse_fields(query.get('fields'))
+        start = query.get('pageToken') or prefix
+        index = bisect.bisect_left(names, start)
+        items = []
+        prefixes = []
+        next_token = None
+        while index < len(names):
+            name = names[index]
+            if not name.startswith(prefix):
+                break
+            if len(items) + len(prefixes) >= page_size:
+                next_token = name
+                break
+            if delimiter:
+                position = name.find(delimiter, len(prefix))
+                if position >= 0:
+                    common = name[:position + len(delimiter)]
+                    prefixes.append(common)
+                    # Skip everything under the common prefix
+                    index = bisect.bisect_left(names, common[:-1] + chr(ord(common[-1]) + 1))
+                    continue
+            items.append(self._object(bucket, name).resource(bucket, self.gcs.url, fields))
+            index += 1
+        body = {'kind': 'storage#objects', 'items': items}
+        if prefixes:
+            body['prefixes'] = prefixes
+        if next_token:
+            body['nextPageToken'] = next_token
+        self._send_json(200, body)
+
+    def _media(self, bucket, name):
+        obj = self._object(bucket, name)
+        if obj is None:
+            return self._not_found()
+        (start, end) = (0, obj.size)
+        status = 200
+        header = self.headers.get('Range')
+        if header:
+            match = re.match(r'bytes=(\d*)-(\d*)', header)
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) + 1 if match.group(2) else obj.size
+            else:
+                start = max(obj.size - int(match.group(2)), 0)
+            end = min(end, obj.size)
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('X-Goog-Generation', str(obj.generation))
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, obj.size))
+        else:
+            (crc32c, md5) = obj.hashes()
+            self.send_header('X-Goog-Hash', 'crc32c={},md5={}'.format(crc32c, md5))
+        self.end_headers()
+        while start < end:
+            chunk = obj.read(start, min(start + (1 << 20), end))
+            self.wfile.write(chunk)
+            start += len(chunk)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for myutil against a local fake GCS server (see fake_gcs.py)
+
+    python benchmarks/run.py                          # every case, full size
+    python benchmarks/run.py --scale 0.01 ls cp       # cases named like ls or cp, at 1% of the size
+    python benchmarks/run.py --compare benchmarks/results/before.json
+
+Each case runs in a process of its own, so the peak RSS reported is that case's. Results are
+saved as JSON (benchmarks/results/<time>.json by default) to compare later runs against.
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_gcs import FakeGCS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BUCKET = 'bench'
+KIB = 1024
+MIB = 1024 * KIB
+GIB = 1024 * MIB
+
+Case = collections.namedtuple('Case', ['name', 'kind', 'prefix', 'args', 'status'])
+Case.__new__.__defaults__ = (0,)
+
+# Startup cases are quick and noisy, so they're run this many times and the median is reported
+STARTUP_RUNS = 7
+
+# kind is 'python' (a function below, run in a child process), 'cli' (myutil arguments, where {dir}
+# is a fresh empty directory) or 'startup' (a cli case timed STARTUP_RUNS times). prefix is the
+# dataset the case reads, and status the exit status it's expected to have.
+CASES = [
+    Case('startup_help', 'startup', 'one/', ['--help']),
+    Case('startup_usage_error', 'startup', 'one/', ['cp'], 2),
+    Case('startup_ls', 'startup', 'one/', ['ls', 'gs://bench/one/']),
+    Case('startup_cp', 'startup', 'one/', ['cp', 'gs://bench/one/1.txt', '{dir}']),
+    Case('tree_from_list', 'python', 'wide/', None),
+    Case('render_tree', 'python', 'wide/', None),
+    Case('download_blobs_small', 'python', 'files/', None),
+    Case('download_blobs_large', 'python', 'large/', None),
+    Case('cli_ls', 'cli', 'wide/', ['ls', 'gs://bench/wide/']),
+    Case('cli_ls_r_wide', 'cli', 'wide/', ['ls', '-r', 'gs://bench/wide/']),
+    Case('cli_ls_r_deep', 'cli', 'deep/', ['ls', '-r', 'gs://bench/deep/']),
+    Case('cli_du_deep', 'cli', 'deep/', ['du', 'gs://bench/deep/']),
+    Case('cli_cp_small', 'cli', 'files/', ['cp', '-r', '-m', '16', 'gs://bench/files', '{dir}']),
+    Case('cli_cp_large', 'cli', 'large/', ['cp', '-r', 'gs://bench/large', '{dir}']),
+]
+
+
+def datasets(scale):
+    """Return {prefix: [(name, size)]} of the synthetic bucket at a scale (1 is full size)
+
+    wide/  -- 100k 1KiB objects, 100 in each of 1000 directories
+    deep/  -- 16k 1KiB objects, 7 directories deep with 4 subdirectories each
+    files/ -- 10k 64KiB objects in 100 directories
+    large/ -- 3 2GiB objects
+    one/   -- a single 1KiB object, whatever the scale
+    """
+    def count(n):
+        return max(1, int(n * scale))
+
+    def digits(number, base, length):
+        return [str(number // base ** power % base) for power in range(length - 1, -1, -1)]
+
+    return {
+        'wide/': [('wide/d{:04d}/f{:03d}.txt'.format(d, f), KIB) for d in range(count(1000)) for f in range(100)],
+        'deep/': [('deep/{}/f.txt'.format('/'.join(digits(n, 4, 7))), KIB) for n in range(count(4 ** 7))],
+        'files/': [('files/d{:03d}/f{:05d}.bin'.format(n % 100, n), 64 * KIB) for n in range(count(10000))],
+        'large/': [('large/{}.bin'.format(n), max(MIB, int(2 * GIB * scale))) for n in range(3)],
+        'one/': [('one/1.txt', KIB)],
+    }
+
+
+def _blobs(bucket, prefix):
+    """List a prefix of the fake bucket (untimed)"""
+    return list(bucket.list_blobs(prefix=prefix))
+
+
+def bench_tree_from_list(case, bucket, dir):
+    from myutil.gcp import tree_from_list
+    blobs = _blobs(bucket, case.prefix)
+    start = time.time()
+    tree_from_list(blobs, prefix=case.prefix)
+    return (time.time() - start, len(blobs), 0)
+
+
+def bench_render_tree(case, bucket, dir):
+    from myutil.gcp import render_tree, tree_from_list
+    blobs = _blobs(bucket, case.prefix)
+    tree = tree_from_list(blobs, prefix=case.prefix)
+    start = time.time()
+    with _quiet():
+        render_tree(tree)
+    return (time.time() - start, len(blobs), 0)
+
+
+def bench_download_blobs_small(case, bucket, dir):
+    return _bench_download_blobs(case, bucket, dir, jobs=16)
+
+
+def bench_download_blobs_large(case, bucket, dir):
+    return _bench_download_blobs(case, bucket, dir, jobs=1)
+
+
+def _bench_download_blobs(case, bucket, dir, jobs):
+    from myutil.gcp import download_blobs
+    blobs = _blobs(bucket, case.prefix)
+    start = time.time()
+    with _quiet():
+        download_blobs(blobs=blobs, dir=dir, prefix=case.prefix.rstrip('/'), recursive=True, jobs=jobs)
+    return (time.time() - start, len(blobs), sum(blob.size for blob in blobs))
+
+
+class _quiet(object):
+    """Send stdout to /dev/null, as printing isn't what's being measured"""
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc_info):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def run_child(case_name, dir):
+    """Run a python case in this (child) process, printing its result as JSON"""
+    sys.path.insert(0, ROOT)
+    from myutil.client import get_bucket
+    case = dict((each.name, each) for each in CASES)[case_name]
+    (seconds, objects, size) = globals()['bench_' + case.name](case, get_bucket(BUCKET), dir)
+    print(json.dumps({'seconds': seconds, 'objects': objects, 'bytes': size}))
+
+
+def measure(command, env, expected=0):
+    """Run a command, returning (wall seconds, seconds to first output, stdout lines, rusage, stdout tail)
+
+    It's an error for the command to exit with a status other than `expected`.
+    """
+    with tempfile.TemporaryFile() as stderr:
+        start = time.time()
+        proc = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=stderr)
+        first = proc.stdout.read(1)
+        first_output = time.time() - start if first else None
+        (lines, tail) = (first.count(b'\n'), first)
+        for chunk in iter(lambda: proc.stdout.read(64 * KIB), b''):
+            lines += chunk.count(b'\n')
+            tail = (tail + chunk)[-4096:]
+        (_, status, rusage) = os.wait4(proc.pid, 0)
+        seconds = time.time() - start
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        if proc.returncode != expected:
+            stderr.seek(0)
+            raise RuntimeError('{} failed:\n{}'.format(' '.join(command), stderr.read().decode('utf-8', 'replace')))
+    return (seconds, first_output, lines, rusage, tail)
+
+
+def run_case(case, objects, env):
+    """Run a case in a child process, returning its result dict"""
+    dir = tempfile.mkdtemp(prefix='myutil-bench-')
+    try:
+        if case.kind == 'python':
+            command = [sys.executable, os.path.abspath(__file__), '--child', case.name, '--dir', dir]
+            (_, _, _, rusage, tail) = measure(command, env)
+            result = json.loads(tail.decode('utf-8').strip().splitlines()[-1])
+            result['first_output'] = None
+        elif case.kind == 'startup':
+            command = [sys.executable, '-m', 'myutil.cli'] + [arg.format(dir=dir) for arg in case.args]
+            runs = sorted((measure(command, env, case.status) for _ in range(STARTUP_RUNS)), key=lambda run: run[0])
+            (seconds, first_output, _, rusage, _) = runs[len(runs) // 2]
+            result = {'seconds': seconds, 'objects': 0, 'bytes': 0, 'first_output': first_output}
+        else:
+            command = [sys.executable, '-m', 'myutil.cli'] + [arg.format(dir=dir) for arg in case.args]
+            (seconds, first_output, lines, rusage, _) = measure(command, env)
+            if case.args[0] == 'ls':
+                (count, size) = (lines, 0)
+            elif case.args[0] == 'du':
+                # Nothing is transferred, so only the objects listed count
+                (count, size) = (len(objects), 0)
+            else:
+                (count, size) = (len(objects), sum(size for (_, size) in objects))
+            result = {'seconds': seconds, 'objects': count, 'bytes': size, 'first_output': first_output}
+    finally:
+        shutil.rmtree(dir, ignore_errors=True)
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    result['peak_rss_mib'] = rusage.ru_maxrss / (MIB if sys.platform == 'darwin' else KIB)
+    result['cpu_seconds'] = rusage.ru_utime + rusage.ru_stime
+    result['objects_per_sec'] = result['objects'] / result['seconds'] if result['seconds'] else None
+    result['bytes_per_sec'] = result['bytes'] / result['seconds'] if result['seconds'] else None
+    return result
+
+
+def serve(scale, prefixes, conn):
+    """Seed and run the fake server until told to stop, in a process of its own
+
+    Children forked from a process holding the seeded bucket would start out with its memory
+    counted in their peak RSS, so the runner itself never holds it.
+    """
+    data = datasets(scale)
+    gcs = FakeGCS()
+    for prefix in prefixes:
+        for (name, size) in data[prefix]:
+            # Hashed up front so listings aren't slowed by it
+            gcs.add(BUCKET, name, size=size).hashes()
+    gcs.start()
+    conn.send(gcs.url)
+    conn.recv()
+    gcs.stop()
+
+
+def _format(value, unit=''):
+    if not value:
+        return '-'
+    for (factor, prefix) in ((GIB, 'G'), (MIB, 'M'), (KIB, 'K')):
+        if unit and value >= factor:
+            return '{:.1f}{}{}'.format(value / factor, prefix, unit)
+    return '{:,.0f}{}'.format(value, unit) if value >= 100 else '{:.3g}{}'.format(value, unit)
+
+
+def report(results, baseline=None):
+    print('{:22} {:>9} {:>11} {:>11} {:>10} {:>10}'.format(
+        'case', 'seconds', 'objects/s', 'bytes/s', 'first out', 'peak RSS'))
+    for (name, result) in results.items():
+        print('{:22} {:>9} {:>11} {:>11} {:>10} {:>10}'.format(
+            name, _format(result['seconds']), _format(result['objects_per_sec']),
+            _format(result['bytes_per_sec'], 'B'), _format(result['first_output']),
+            _format(result['peak_rss_mib'] * MIB, 'B')))
+        previous = (baseline or {}).get(name)
+        if previous:
+            print('{:22} {:>9} {:>11} {:>11} {:>10} {:>10}'.format('  vs baseline', *[
+                _ratio(result.get(key), previous.get(key))
+                for key in ('seconds', 'objects_per_sec', 'bytes_per_sec', 'first_output', 'peak_rss_mib')]))
+
+
+def _ratio(value, previous):
+    if not value or not previous:
+        return '-'
+    return '{:.2f}x'.format(value / previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cases', nargs='*', help='only run cases whose name contains one of these')
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the full dataset sizes')
+    parser.add_argument('--output', help='file to save results to')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.child, args.dir)
+
+    cases = [case for case in CASES if not args.cases or any(word in case.name for word in args.cases)]
+    data = datasets(args.scale)
+    prefixes = sorted(set(case.prefix for case in cases))
+    print('Seeding {} objects...'.format(sum(len(data[prefix]) for prefix in prefixes)))
+    context = multiprocessing.get_context('spawn')
+    (conn, server_conn) = context.Pipe()
+    server = context.Process(target=serve, args=(args.scale, prefixes, server_conn))
+    server.start()
+    env = dict(os.environ, STORAGE_EMULATOR_HOST=conn.recv(), PYTHONPATH=os.pathsep.join(
+        [ROOT] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+    env['MYUTIL_CACHE_DIR'] = tempfile.mkdtemp(prefix='myutil-bench-cache-')
+
+    results = collections.OrderedDict()
+    try:
+        for case in cases:
+            results[case.name] = run_case(case, data[case.prefix], env)
+    finally:
+        conn.send('stop')
+        server.join()
+        shutil.rmtree(env['MYUTIL_CACHE_DIR'], ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+
+    output = args.output or os.path.join(HERE, 'results', time.strftime('%Y%m%dT%H%M%S.json', time.gmtime()))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as f:
+        json.dump({'meta': _meta(args.scale), 'results': results}, f, indent=2)
+    print('Saved {}'.format(output))
+
+
+def _meta(scale):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'scale': scale, 'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from contextlib import closing
+from functools import partial
+
+import myutil.exceptions
+from myutil.gcp import map_tasks
+
+# Most calls the JSON API accepts in one batch request
+BATCH_SIZE = 100
+
+STAT_TIME_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+
+def run_batches(function, blobs, jobs=1):
+    """Call function(blob) for every blob inside batch requests, yielding (blob, error or None) in order
+
+    Each batch request carries up to BATCH_SIZE calls in a single round trip, and calls in a
+    batch fail on their own, so every blob gets its own outcome.
+
+    Keyword arguments:
+    function -- called with each blob while its batch is open (ex: lambda blob: blob.delete())
+    blobs -- list of GCP blob objects, all of the same client
+    jobs -- number of batch requests in flight at once
+    """
+    if not blobs:
+        return
+    batches = [blobs[start:start + BATCH_SIZE] for start in range(0, len(blobs), BATCH_SIZE)]
+    # Batches stack per thread on the client, so threads can each fill and send their own
+    with closing(map_tasks(partial(_run_batch, function), batches, blobs[0].bucket, jobs)) as results:
+        for (batch, errors) in zip(batches, results):
+            for (blob, error) in zip(batch, errors):
+                yield (blob, error)
+
+
+def _run_batch(function, blobs, bucket):
+    """Send one batch request, returning an error message (or None) per blob"""
+    from google.api_core.exceptions import from_http_status
+    batch = bucket.client.batch(raise_exception=False)
+    # Leaving the with block sends the batch with finish(), which returns a response per call in
+    # order, failed ones included, but the block drops it. The futures calls get back hold no status
+    responses = []
+    finish = batch.finish
+
+    def keep_responses(raise_exception=True):
+        responses.extend(finish(raise_exception=raise_exception))
+        return responses
+
+    batch.finish = keep_responses
+    try:
+        with batch:
+            for blob in blobs:
+                function(blob)
+    except Exception as exc:
+        return ['{}: {}'.format(type(exc).__name__, exc)] * len(blobs)
+    errors = []
+    for response in responses:
+        if 200 <= response.status_code < 300:
+            errors.append(None)
+            continue
+        try:
+            message = response.json()['error']['message']
+        except (ValueError, KeyError, TypeError):
+            message = response.text
+        exc = from_http_status(response.status_code, message)
+        errors.append('{}: {}'.format(type(exc).__name__, exc))
+    return errors
+
+
+def select_blobs(blobs, prefix):
+    """Yield the listed GCP blob objects that are the prefix itself, or under prefix/
+
+    Keyword arguments:
+    blobs -- GCP blob objects returned by the listing
+    prefix -- string prefix that was listed
+    """
+    prefix = prefix.rstrip('/')
+    for blob in blobs:
+        # A listing of gs://foo/a also returns gs://foo/ab/..., which isn't under a/
+        if not prefix or blob.name == prefix or blob.name.startswith(prefix + '/'):
+            yield blob
+
+
+def remove_blobs(blobs, jobs=1):
+    """Delete GCP blob objects in batches, reporting every failure once all have been attempted
+
+    Keyword arguments:
+    blobs -- list of GCP blob objects to delete
+    jobs -- number of batch requests in flight at once
+    """
+    errors = []
+    for (blob, error) in run_batches(lambda blob: blob.delete(), blobs, jobs=jobs):
+        url = 'gs://{}/{}'.format(blob.bucket.name, blob.name)
+        print('Removing {}...'.format(url))
+        if error is not None:
+            errors.append((url, error))
+    if len(blobs) > 1:
+        print('Removed {} of {} objects.'.format(len(blobs) - len(errors), len(blobs)))
+    _report_failures(errors, 'remove')
+
+
+def stat_blobs(blobs, jobs=1, listed=()):
+    """Print the metadata of GCP blob objects in order, fetching the ones that need it in batches
+
+    Keyword arguments:
+    blobs -- list of GCP blob objects to describe
+    jobs -- number of batch requests in flight at once
+    listed -- those of the blobs whose metadata came from a listing, so they aren't fetched again
+    """
+    listed = set(id(blob) for blob in listed)
+    fetched = iter(run_batches(lambda blob: blob.reload(), [blob for blob in blobs if id(blob) not in listed],
+                               jobs=jobs))
+    errors = []
+    for blob in blobs:
+        # Fetches come back in the same order, so each one is ready in its turn
+        error = None if id(blob) in listed else next(fetched)[1]
+        if error is not None:
+            errors.append(('gs://{}/{}'.format(blob.bucket.name, blob.name), error))
+        else:
+            print(format_stat(blob))
+    _report_failures(errors, 'stat')
+
+
+def format_stat(blob):
+    """Describe a GCP blob object's metadata the way gsutil stat does
+
+    Keyword arguments:
+    blob -- GCP blob object with its metadata loaded (from a listing or a reload)
+    """
+    fields = [
+        ('Creation time', blob.time_created.strftime(STAT_TIME_FORMAT) if blob.time_created else None),
+        ('Update time', blob.updated.strftime(STAT_TIME_FORMAT) if blob.updated else None),
+        ('Storage class', blob.storage_class),
+        ('Content-Length', blob.size),
+        ('Content-Type', blob.content_type),
+        ('Hash (crc32c)', blob.crc32c),
+        ('Hash (md5)', blob.md5_hash),
+        ('ETag', blob.etag),
+        ('Generation', blob.generation),
+        ('Metageneration', blob.metageneration),
+    ]
+    lines = ['gs://{}/{}:'.format(blob.bucket.name, blob.name)]
+    for (label, value) in fields:
+        if value is not None:
+            lines.append('    {:<24}{}'.format(label + ':', value))
+    return '\n'.join(lines)
+
+
+def _report_failures(errors, action):
+    if errors:
+        for (url, error) in errors:
+            print('Failed {}: {}'.format(url, error))
+        raise myutil.exceptions.CommandException('{} object(s) failed to {}'.format(len(errors), action))
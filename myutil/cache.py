@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import collections
+import os
+import sqlite3
+import time
+
+from myutil.client import get_bucket
+from myutil.helpers import mkdir_p
+from myutil.listing import list_pages
+
+# Cached listings older than this are ignored and evicted
+DEFAULT_TTL = 60 * 60
+# Least recently used listings are evicted once the cache holds more objects than this
+DEFAULT_MAX_OBJECTS = 5 * 1000 * 1000
+PAGE_SIZE = 1000
+# The listing fields the cache keeps. Asking for only these shrinks listing responses
+LISTING_FIELDS = 'items(name,size,generation,crc32c,md5Hash,updated),prefixes,nextPageToken'
+
+CachedBlob = collections.namedtuple('CachedBlob', ['name', 'size', 'generation', 'crc32c', 'md5_hash', 'updated'])
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS listings (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    listed_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    objects INTEGER NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+);
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    listing TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    generation INTEGER,
+    crc32c TEXT,
+    md5_hash TEXT,
+    updated TEXT,
+    PRIMARY KEY (bucket, listing, name)
+);
+'''
+
+
+def default_path():
+    """Path of the cache database: $MYUTIL_CACHE_DIR, or myutil/ under $XDG_CACHE_HOME (~/.cache)"""
+    cache_dir = os.environ.get('MYUTIL_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'myutil')
+    return os.path.join(cache_dir, 'listings.sqlite')
+
+
+class ListingCache(object):
+    """On-disk cache of recursive bucket listings, keyed by bucket and prefix
+
+    Keyword arguments:
+    path -- string filename of the SQLite database. Defaults to default_path()
+    ttl -- seconds a listing stays fresh
+    max_objects -- number of cached objects above which least recently used listings are evicted
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_objects=DEFAULT_MAX_OBJECTS):
+        self.path = path or default_path()
+        self.ttl = ttl
+        self.max_objects = max_objects
+        mkdir_p(os.path.dirname(self.path))
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def find(self, bucket_name, prefix):
+        """Return the prefix of a fresh cached listing covering `prefix`, or None"""
+        row = self.db.execute(
+            'SELECT prefix FROM listings WHERE bucket = ? AND substr(?, 1, length(prefix)) = prefix '
+            'AND listed_at >= ? ORDER BY length(prefix) DESC LIMIT 1',
+            (bucket_name, prefix, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute('UPDATE listings SET used_at = ? WHERE bucket = ? AND prefix = ?',
+                            (time.time(), bucket_name, row[0]))
+        return row[0]
+
+    def refresh(self, bucket_name, prefix, pages):
+        """Bring the cached listing of a prefix up to date, returning the added/updated/removed counts
+
+        Listings come back in name order, so each page is compared with the cached names in
+        the same range, as it arrives, and only new, changed (by generation) or removed objects
+        are written.
+
+        Keyword arguments:
+        bucket_name -- string bucket name
+        prefix -- string prefix that was listed
+        pages -- iterable of pages of GCP blob objects (ex: HTTPIterator.pages)
+        """
+        counts = {'added': 0, 'updated': 0, 'removed': 0}
+        after = None  # Names up to and including this one have been reconciled
+        for page in pages:
+            blobs = list(page)
+            if blobs:
+                with self.db:
+                    self._reconcile(bucket_name, prefix, after, blobs[-1].name, blobs, counts)
+                after = blobs[-1].name
+        with self.db:
+            self._reconcile(bucket_name, prefix, after, None, [], counts)
+            (objects,) = self.db.execute('SELECT count(*) FROM objects WHERE bucket = ? AND listing = ?',
+                                         (bucket_name, prefix)).fetchone()
+            now = time.time()
+            self.db.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)',
+                            (bucket_name, prefix, now, now, objects))
+        self.evict()
+        return counts
+
+    def _reconcile(self, bucket_name, prefix, after, last, blobs, counts):
+        """Apply listed blobs to the cached names in (after, last] (unbounded when None)"""
+        query = 'SELECT name, generation FROM objects WHERE bucket = ? AND listing = ?'
+        params = [bucket_name, prefix]
+        if after is not None:
+            query += ' AND name > ?'
+            params.append(after)
+        if last is not None:
+            query += ' AND name <= ?'
+            params.append(last)
+        cached = dict(self.db.execute(query, params).fetchall())
+        rows = []
+        for blob in blobs:
+            generation = cached.pop(blob.name, None)
+            if generation == blob.generation:
+                continue
+            counts['added' if generation is None else 'updated'] += 1
+            rows.append((bucket_name, prefix, blob.name, blob.size, blob.generation, blob.crc32c, blob.md5_hash,
+                         blob.updated.isoformat() if blob.updated is not None else None))
+        self.db.executemany('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.db.executemany('DELETE FROM objects WHERE bucket = ? AND listing = ? AND name = ?',
+                            [(bucket_name, prefix, name) for name in cached])
+        counts['removed'] += len(cached)
+
+    def list(self, bucket_name, listing, prefix='', delimiter=None):
+        """Yield pages of (CachedBlob list, prefix list) under a prefix of a cached listing
+
+        With a delimiter, only one level is returned, skipping over each common prefix.
+
+        Keyword arguments:
+        bucket_name -- string bucket name
+        listing -- prefix of the cached listing to read (see find)
+        prefix -- string prefix to list under
+        delimiter -- string delimiter, usually '/'
+        """
+        (start, operator) = (prefix, '>=')
+        blobs = []
+        prefixes = []
+        while True:
+            rows = self.db.execute(
+                'SELECT name, size, generation, crc32c, md5_hash, updated FROM objects '
+                'WHERE bucket = ? AND listing = ? AND name {} ? ORDER BY name LIMIT ?'.format(operator),
+                (bucket_name, listing, start, PAGE_SIZE)).fetchall()
+            if not rows or not rows[0][0].startswith(prefix):
+                break
+            for row in rows:
+                if not row[0].startswith(prefix):
+                    break
+                position = row[0].find(delimiter, len(prefix)) if delimiter else -1
+                if position >= 0:
+                    # Seek past everything under the common prefix
+                    common = row[0][:position + len(delimiter)]
+                    prefixes.append(common)
+                    (start, operator) = (common[:-1] + chr(ord(common[-1]) + 1), '>=')
+                    break
+                blobs.append(CachedBlob(*row))
+                (start, operator) = (row[0], '>')
+            if len(blobs) + len(prefixes) >= PAGE_SIZE:
+                yield (blobs, prefixes)
+                (blobs, prefixes) = ([], [])
+        if blobs or prefixes:
+            yield (blobs, prefixes)
+
+    def evict(self):
+        """Drop expired listings, then least recently used ones while over max_objects"""
+        with self.db:
+            expired = self.db.execute('SELECT bucket, prefix FROM listings WHERE listed_at < ?',
+                                      (time.time() - self.ttl,)).fetchall()
+            for (bucket_name, prefix) in expired:
+                self._delete(bucket_name, prefix)
+            listings = self.db.execute('SELECT bucket, prefix, objects FROM listings ORDER BY used_at').fetchall()
+            total = sum(objects for (_, _, objects) in listings)
+            for (bucket_name, prefix, objects) in listings:
+                if total <= self.max_objects:
+                    break
+                self._delete(bucket_name, prefix)
+                total -= objects
+
+    def clear(self, bucket_name=None, prefix=''):
+        """Drop cached listings, all of them or those of a bucket under a prefix"""
+        with self.db:
+            if bucket_name is None:
+                self.db.execute('DELETE FROM objects')
+                self.db.execute('DELETE FROM listings')
+                return
+            listings = self.db.execute('SELECT prefix FROM listings WHERE bucket = ? AND substr(prefix, 1, ?) = ?',
+                                       (bucket_name, len(prefix), prefix)).fetchall()
+            for (listing,) in listings:
+                self._delete(bucket_name, listing)
+
+    def _delete(self, bucket_name, prefix):
+        self.db.execute('DELETE FROM objects WHERE bucket = ? AND listing = ?', (bucket_name, prefix))
+        self.db.execute('DELETE FROM listings WHERE bucket = ? AND prefix = ?', (bucket_name, prefix))
+
+
+def cached_bucket(cache, bucket_name, prefix, refresh=False):
+    """Return a CachedBucket for a prefix, listing it into the cache first if nothing fresh covers it
+
+    A cache hit needs no client at all, so it doesn't pay for importing or authenticating one.
+
+    Keyword arguments:
+    cache -- ListingCache to read and fill
+    bucket_name -- string name of the bucket to list on a cache miss
+    prefix -- string prefix to list
+    refresh -- re-list and update the cached listing even if it's fresh
+    """
+    listing = None if refresh else cache.find(bucket_name, prefix)
+    if listing is None:
+        bucket = get_bucket(bucket_name)
+        cache.refresh(bucket_name, prefix, list_pages(bucket, prefix, fields=LISTING_FIELDS))
+        listing = prefix
+    return CachedBucket(cache, bucket_name, listing)
+
+
+class CachedBucket(object):
+    """Stand-in for a bucket whose list_blobs reads a cached listing
+
+    It has the same name/list_blobs/pages/prefixes shape as the real thing, so listing
+    consumers such as list_level and render_pages work on it unchanged.
+    """
+
+    def __init__(self, cache, name, listing):
+        self.cache = cache
+        self.name = name
+        self.listing = listing
+
+    def list_blobs(self, prefix='', delimiter=None, **kwargs):
+        return _CachedIterator(self.cache.list(self.name, self.listing, prefix or '', delimiter))
+
+
+class _CachedIterator(object):
+
+    def __init__(self, pages):
+        self._pages = pages
+
+    @property
+    def pages(self):
+        for (blobs, prefixes) in self._pages:
+            yield _CachedPage(blobs, prefixes)
+
+    def __iter__(self):
+        for page in self.pages:
+            for blob in page:
+                yield blob
+
+
+class _CachedPage(list):
+
+    def __init__(self, blobs, prefixes):
+        super(_CachedPage, self).__init__(blobs)
+        self.prefixes = tuple(prefixes)
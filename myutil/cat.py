@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import myutil.exceptions
+
+# Objects are streamed in range requests of this many bytes, with up to CAT_READ_AHEAD of them in
+# flight while the previous one is written out, so memory stays at (CAT_READ_AHEAD + 1) chunks
+CAT_CHUNK_SIZE = 8 * 1024 * 1024
+CAT_READ_AHEAD = 2
+
+
+def cat_blobs(blobs, stream, byte_range=None, chunk_size=CAT_CHUNK_SIZE, read_ahead=CAT_READ_AHEAD):
+    """Write the content of GCP blob objects to a stream, one after the other
+
+    Keyword arguments:
+    blobs -- GCP blob objects with their metadata loaded (from a listing or get_blob)
+    stream -- binary file-like object to write to (ex: stdout's buffer)
+    byte_range -- (start, end) from helpers.parse_byte_range to write only part of every object, or None
+    chunk_size -- bytes per range request
+    read_ahead -- range requests kept in flight ahead of the one being written
+    """
+    pool = ThreadPool(read_ahead) if read_ahead > 0 else None
+    try:
+        for blob in blobs:
+            if blob.content_encoding:
+                write_decoded(blob, stream, byte_range)
+            else:
+                for chunk in read_chunks(blob, byte_range, chunk_size, pool, read_ahead):
+                    stream.write(chunk)
+            stream.flush()
+    except BaseException:
+        if pool is not None:
+            # Don't wait for chunks nobody will write
+            pool.terminate()
+            pool = None
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def read_chunks(blob, byte_range=None, chunk_size=CAT_CHUNK_SIZE, pool=None, read_ahead=CAT_READ_AHEAD):
+    """Yield the content of a GCP blob object (or a byte range of it) in order, chunk_size bytes at a time
+
+    Every chunk is its own range request of the listed generation, so a long stream can't
+    mix two versions of the object.
+
+    Keyword arguments:
+    blob -- GCP blob object with its size loaded
+    byte_range -- (start, end) from helpers.parse_byte_range, or None for all of it
+    chunk_size -- bytes per range request
+    pool -- ThreadPool to fetch up to read_ahead chunks ahead in, or None to fetch each one when it's wanted
+    read_ahead -- range requests kept in flight ahead of the chunk being consumed
+    """
+    (start, end) = resolve_range(byte_range, blob.size)
+    ranges = ((offset, min(offset + chunk_size, end)) for offset in range(start, end, chunk_size))
+    if pool is None:
+        for (offset, limit) in ranges:
+            yield _read_chunk(blob, offset, limit)
+        return
+    pending = deque()
+    for (offset, limit) in ranges:
+        pending.append(pool.apply_async(_read_chunk, (blob, offset, limit)))
+        if len(pending) > read_ahead:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def write_decoded(blob, stream, byte_range=None):
+    """Write a GCP blob object stored with a Content-Encoding (ex: gzip) to a stream, as one request
+
+    The client decompresses these as they arrive, and GCS ignores Range when it does, so
+    the whole object is streamed and byte_range is cut out of the decompressed content here.
+    The download stops once the range has been written. A range from the end keeps only
+    that many bytes in memory.
+
+    Keyword arguments:
+    blob -- GCP blob object
+    stream -- binary file-like object to write to
+    byte_range -- (start, end) from helpers.parse_byte_range, or None for all of it
+    """
+    writer = _DecodedRange(stream, byte_range)
+    try:
+        blob.download_to_file(writer, checksum=None)
+    except _DecodedRange.Done:
+        return
+    writer.close()
+
+
+class _DecodedRange(object):
+    """File-like wrapper writing only a byte range of what's written to it to a stream
+
+    The size of decompressed content isn't known up front, so a range from the end is
+    held back until it's closed.
+    """
+
+    class Done(Exception):
+        """The range is complete, so the download can stop"""
+
+    def __init__(self, stream, byte_range=None):
+        (self.start, self.end) = byte_range or (0, None)
+        self.stream = stream
+        self.position = 0
+        self.tail = bytearray()
+
+    def write(self, data):
+        (offset, self.position) = (self.position, self.position + len(data))
+        if self.start < 0:
+            self.tail.extend(data)
+            del self.tail[:self.start]
+            return
+        if self.end is not None and offset >= self.end:
+            raise self.Done()
+        part = data[max(self.start - offset, 0):len(data) if self.end is None else self.end - offset]
+        if part:
+            self.stream.write(part)
+
+    def close(self):
+        if self.start < 0:
+            self.stream.write(bytes(self.tail))
+
+
+def resolve_range(byte_range, size):
+    """Turn a parsed byte range into [start, end) offsets within an object of `size` bytes"""
+    if byte_range is None:
+        return (0, size)
+    (start, end) = byte_range
+    if start < 0:
+        start = max(size + start, 0)
+    end = size if end is None else min(end, size)
+    return (min(start, end), end)
+
+
+def _read_chunk(blob, start, end):
+    data = blob.download_as_bytes(start=start, end=end - 1, checksum=None)
+    if len(data) != end - start:
+        raise myutil.exceptions.CommandException('Expected {} bytes for range {}-{} of gs://{}/{}, got {}'.format(
+            end - start, start, end - 1, blob.bucket.name, blob.name, len(data)))
+    return data
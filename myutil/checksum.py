@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import struct
+
+try:
+    import google_crc32c
+except ImportError:  # Optional. Installed alongside google-cloud-storage
+    google_crc32c = None
+
+# Ways to validate a download: auto picks crc32c or md5 (see download_algorithm), none skips it
+CHECKSUM_CHOICES = ('auto', 'crc32c', 'md5', 'none')
+# Reversed Castagnoli polynomial
+_CRC32C_POLY = 0x82F63B78
+
+
+def new_hasher(algorithm):
+    """Create an incremental hasher with update() and digest()
+
+    Keyword arguments:
+    algorithm -- 'crc32c' or 'md5'
+    """
+    if algorithm == 'crc32c':
+        if google_crc32c is None:
+            raise ValueError('crc32c checksums need the google-crc32c package')
+        return google_crc32c.Checksum()
+    if algorithm == 'md5':
+        return hashlib.md5()
+    raise ValueError('unknown checksum algorithm {}'.format(algorithm))
+
+
+def encode(hasher):
+    """Base64-encode a hasher's digest the way GCS reports crc32c and md5Hash"""
+    return base64.b64encode(hasher.digest()).decode('ascii')
+
+
+def blob_algorithm(blob):
+    """Pick the checksum algorithm to compare a GCP blob object with, or None
+
+    crc32c is preferred as composite objects have no md5.
+
+    Keyword arguments:
+    blob -- GCP blob object, with the metadata a listing returns
+    """
+    if blob.crc32c and google_crc32c is not None:
+        return 'crc32c'
+    if blob.md5_hash:
+        return 'md5'
+    return None
+
+
+def download_algorithm(blob, checksum='auto', sliced=False):
+    """Pick the checksum algorithm to validate a download of a GCP blob object with, or None to skip it
+
+    auto uses crc32c when there's a compiled implementation of it, or when the download is
+    sliced (the md5s of slices can't be combined), and md5 otherwise. An algorithm the object
+    has no checksum for falls back to the other one.
+
+    Keyword arguments:
+    blob -- GCP blob object, with the metadata a listing returns
+    checksum -- one of CHECKSUM_CHOICES
+    sliced -- whether the object is downloaded as more than one byte range
+    """
+    if checksum == 'none':
+        return None
+    if checksum == 'auto':
+        fast = google_crc32c is not None and getattr(google_crc32c, 'implementation', 'c') == 'c'
+        checksum = 'crc32c' if fast or sliced else 'md5'
+    for algorithm in (checksum, 'md5' if checksum == 'crc32c' else 'crc32c'):
+        if blob_checksum(blob, algorithm) and (algorithm == 'md5' or google_crc32c is not None):
+            return algorithm
+    return None
+
+
+def combine(parts, algorithm):
+    """Encode the checksum of consecutive byte ranges as if they had been hashed in one piece
+
+    Keyword arguments:
+    parts -- list of (hasher, length) for each byte range, in order
+    algorithm -- 'crc32c' or 'md5'. md5s can only be "combined" when there's one part
+    """
+    if not parts:
+        return encode(new_hasher(algorithm))
+    if len(parts) == 1:
+        return encode(parts[0][0])
+    if algorithm != 'crc32c':
+        raise ValueError('{} checksums of byte ranges can\'t be combined'.format(algorithm))
+    crc = None
+    for (hasher, length) in parts:
+        value = struct.unpack('>I', hasher.digest())[0]
+        crc = value if crc is None else crc32c_combine(crc, value, length)
+    return base64.b64encode(struct.pack('>I', crc)).decode('ascii')
+
+
+def crc32c_combine(crc1, crc2, length2):
+    """Return the crc32c of two byte strings joined, from their crc32cs and the second's length
+
+    This is zlib's crc32_combine with the crc32c polynomial: crc1 is run through length2 zero
+    bytes by squaring a GF(2) matrix, so it takes O(log length2) steps rather than re-reading.
+    """
+    if length2 <= 0:
+        return crc1
+    odd = [_CRC32C_POLY] + [1 << bit for bit in range(31)]  # One zero bit
+    even = _gf2_square(odd)  # Two zero bits
+    odd = _gf2_square(even)  # Four zero bits
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+def _gf2_times(matrix, vector):
+    total = 0
+    index = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def blob_checksum(blob, algorithm):
+    """Return the GCS-reported checksum of a GCP blob object for an algorithm"""
+    return blob.crc32c if algorithm == 'crc32c' else blob.md5_hash
+
+
+def file_checksum(path, algorithm, chunk_size=1024 * 1024):
+    """Checksum a local file, encoded the way GCS reports it
+
+    Keyword arguments:
+    path -- string filename to read
+    algorithm -- 'crc32c' or 'md5'
+    chunk_size -- bytes read at a time
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return encode(hasher)
@@ -1,58 +1,396 @@
 # -*- coding: utf-8 -*-
+import errno
+import os
+import sys
+
 import click
-from google.cloud import storage
 
 import myutil.exceptions
-from myutil.gcp import download_blobs, render_tree, tree_from_list
-from myutil.helpers import bucket_path_from_url
+from myutil.batch import remove_blobs, select_blobs, stat_blobs
+from myutil.cache import DEFAULT_TTL, CachedBucket, ListingCache, cached_bucket
+from myutil.cat import cat_blobs
+from myutil.checksum import CHECKSUM_CHOICES
+from myutil.client import (DEFAULT_BACKOFF, DEFAULT_RETRIES, DEFAULT_TIMEOUT,
+                           configure, get_bucket)
+from myutil.gcp import (SLICED_DOWNLOAD_COMPONENTS, SLICED_DOWNLOAD_THRESHOLD,
+                        SMALL_OBJECT_THRESHOLD, disk_usage, download_blobs,
+                        list_level, list_matches, match_pages, render_pages)
+from myutil.helpers import (bucket_path_from_url, has_wildcard, mkdir_p,
+                            parse_byte_range, parse_size, wildcard_listing,
+                            write_pages)
+from myutil.listing import configure_listing, list_pages
+from myutil.manifest import copy_manifest
+from myutil.rewrite import copy_blobs
+from myutil.rsync import rsync_blobs
+from myutil.stats import recording, timed_pages
+from myutil.upload import upload_files
+
+# Listing fields du needs
+DU_FIELDS = 'items(name,size),nextPageToken'
+
+
+def _size_option(ctx, param, value):
+    """click callback turning a size option such as 150M into bytes"""
+    try:
+        return parse_size(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
 
-storage_client = storage.Client()
+def _range_option(ctx, param, value):
+    """click callback turning a byte range such as 256-5939 into (start, end)"""
+    if value is None:
+        return None
+    try:
+        return parse_byte_range(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+
+def _list_blobs(bucket, prefix, recursive=False):
+    """List the blobs a URL path names: everything under a prefix, or what a wildcard matches
+
+    Only a wildcard's literal prefix is listed (see helpers.wildcard_listing) and the rest is matched here.
+    """
+    if not has_wildcard(prefix):
+        return [blob for page in timed_pages(list_pages(bucket, prefix)) for blob in page]
+    (listing, delimiter) = wildcard_listing(prefix, recursive)
+    pages = timed_pages(list_pages(bucket, listing, delimiter=delimiter))
+    return [blob for page in match_pages(pages, prefix, recursive) for blob in page]
+
+
+def _listing_pages(bucket, prefix, **kwargs):
+    """Pages of a listing, sharded (see listing.list_pages) unless it's read from the local cache"""
+    if isinstance(bucket, CachedBucket):
+        return bucket.list_blobs(prefix=prefix, **kwargs).pages
+    return list_pages(bucket, prefix, **kwargs)
 
 
 @click.group()
-def cli():
-    """ Grouping mechanism """
-    pass
+@click.option('--timeout', default=DEFAULT_TIMEOUT, type=float)
+@click.option('--retries', default=DEFAULT_RETRIES, type=click.IntRange(0, None))
+@click.option('--retry-backoff', default=DEFAULT_BACKOFF, type=float)
+@click.option('--pool-size', default=None, type=click.IntRange(1, None))
+@click.option('--list-jobs', default=1, type=click.IntRange(1, None))
+@click.option('--list-depth', default=1, type=click.IntRange(1, None))
+def cli(timeout, retries, retry_backoff, pool_size, list_jobs, list_depth):
+    """ Grouping mechanism
+
+    Keyword arguments:
+    timeout -- Seconds to wait to connect to GCS, and between bytes of a response
+    retries -- Times to retry a request after a connection error, timeout, 429 or 5xx
+    retry_backoff -- Exponential backoff factor (seconds) between retries
+    pool_size -- Connections to keep alive. Defaults to enough for every concurrent transfer
+    list_jobs -- Recursive listings are split into shards by "directory", and this many listed at once
+    list_depth -- Levels of "directories" to split recursive listings by
+    """
+    configure(timeout=timeout, retries=retries, backoff=retry_backoff, pool_size=pool_size)
+    configure_listing(jobs=list_jobs, depth=list_depth)
 
 
 @cli.command()
+@click.option('--recursive', '-r', default=False, is_flag=True)
+@click.option('--cached', default=False, is_flag=True)
+@click.option('--refresh', default=False, is_flag=True)
+@click.option('--cache-ttl', default=DEFAULT_TTL, type=click.IntRange(0, None))
+@click.option('--stats', 'show_stats', default=False, is_flag=True)
+@click.option('--trace', default=None, type=click.Path(dir_okay=False, writable=True))
 @click.argument('url')
-def ls(url):
+def ls(recursive, cached, refresh, cache_ttl, show_stats, trace, url):
     """List objects in a bucket
 
     Keyword arguments:
-    url -- The URL in the format gs://bucket/subdir
+    url -- The URL in the format gs://bucket/subdir, which may have wildcards (*, **, ? and [...])
+    recursive -- List everything under the URL as a tree, printing each page as it arrives
+    cached -- Serve the listing from the local cache, listing into it first if it has nothing fresh
+    refresh -- With --cached, re-list and update the cached listing
+    cache_ttl -- Seconds a cached listing stays fresh
+    show_stats -- Print a JSON summary of listing page latencies to stderr when done
+    trace -- Write a JSON line for every listing page, and the summary, to this file
     """
 
     (bucket_name, prefix) = bucket_path_from_url(url)
-    bucket = storage_client.get_bucket(bucket_name)
-    blob_tree = tree_from_list(bucket.list_blobs(prefix=prefix), prefix)
-    render_tree(blob_tree)
+    (listing, delimiter) = wildcard_listing(prefix, recursive)
+    with recording('ls', trace=trace, summary=sys.stderr if show_stats else None):
+        cache = None
+        if cached:
+            cache = ListingCache(ttl=cache_ttl)
+            bucket = cached_bucket(cache, bucket_name, listing, refresh=refresh)
+        else:
+            bucket = get_bucket(bucket_name)
+        try:
+            if has_wildcard(prefix):
+                pages = _listing_pages(bucket, listing, delimiter=delimiter)
+                if recursive:
+                    write_pages(timed_pages(render_pages(match_pages(pages, prefix, recursive=True), listing)))
+                else:
+                    write_pages(timed_pages(list_matches(pages, bucket.name, prefix)))
+            elif recursive:
+                # A listing of gs://foo/a also returns gs://foo/ab/..., which isn't under a/
+                pages = (list(select_blobs(page, prefix)) for page in _listing_pages(bucket, prefix))
+                write_pages(timed_pages(render_pages(pages, prefix)))
+            else:
+                write_pages(timed_pages(list_level(bucket, prefix)))
+        finally:
+            if cache is not None:
+                cache.close()
+
+
+@cli.command()
+@click.option('--summarize', '-s', default=False, is_flag=True)
+@click.option('--stats', 'show_stats', default=False, is_flag=True)
+@click.option('--trace', default=None, type=click.Path(dir_okay=False, writable=True))
+@click.argument('url')
+def du(summarize, show_stats, trace, url):
+    """Print the bytes and number of objects under a URL, and under each "directory" below it
+
+    Keyword arguments:
+    url -- The URL in the format gs://bucket/subdir, which may have wildcards
+    summarize -- Only print the total for the URL
+    show_stats -- Print a JSON summary of listing page latencies to stderr when done
+    trace -- Write a JSON line for every listing page, and the summary, to this file
+    """
+
+    (bucket_name, prefix) = bucket_path_from_url(url)
+    (listing, delimiter) = wildcard_listing(prefix, recursive=True)
+    bucket = get_bucket(bucket_name)
+    with recording('du', trace=trace, summary=sys.stderr if show_stats else None):
+        # Only names and sizes, which keeps listing responses a fraction of their full size
+        pages = timed_pages(list_pages(bucket, listing, fields=DU_FIELDS))
+        if has_wildcard(prefix):
+            pages = match_pages(pages, prefix, recursive=True)
+            # Matches are reported from the directory the wildcard is in
+            prefix = listing[:listing.rfind('/') + 1]
+        else:
+            pages = (list(select_blobs(page, prefix)) for page in pages)
+        write_pages([u'{:<14}{:<10}gs://{}/{}'.format(size, objects, bucket.name, name)
+                     for (size, objects, name) in totals] for totals in disk_usage(pages, prefix, summarize))
+
+
+@cli.group()
+def cache():
+    """Manage the local listing cache"""
+    pass
+
+
+@cache.command()
+@click.argument('url', required=False)
+def clear(url):
+    """Clear cached listings
+
+    Keyword arguments:
+    url -- Only clear listings under this URL (gs://bucket/subdir). Clears everything if omitted
+    """
+
+    listing_cache = ListingCache()
+    if url is None:
+        listing_cache.clear()
+    else:
+        listing_cache.clear(*bucket_path_from_url(url))
+    listing_cache.close()
 
 
 @cli.command()
 @click.option('--recursive', '-r', default=False, is_flag=True)
+@click.option('--jobs', '-m', default=1, type=click.IntRange(1, None))
+@click.option('--processes', default=False, is_flag=True)
+@click.option('--slice-threshold', default=str(SLICED_DOWNLOAD_THRESHOLD), callback=_size_option)
+@click.option('--slices', default=SLICED_DOWNLOAD_COMPONENTS, type=click.IntRange(1, None))
+@click.option('--checksum', default='auto', type=click.Choice(CHECKSUM_CHOICES))
+@click.option('--small-threshold', default=str(SMALL_OBJECT_THRESHOLD), callback=_size_option)
+@click.option('--stats', 'show_stats', default=False, is_flag=True)
+@click.option('--trace', default=None, type=click.Path(dir_okay=False, writable=True))
+@click.option('-I', 'read_manifest', default=False, is_flag=True)
+@click.option('--manifest', default=None, type=click.File('r'))
+@click.argument('url')
+@click.argument('dir', required=False)
+def cp(recursive, jobs, processes, slice_threshold, slices, checksum, small_threshold, show_stats, trace,
+       read_manifest, manifest, url, dir):
+    """Copy blobs from a bucket, or local files to a bucket
+
+    Keyword arguments:
+    url -- The URL in the format gs://bucket/subdir (wildcards copy each match), or a local file or dir to upload
+    dir -- The dir to copy to (if recursive, it will create it), or a gs://bucket/name URL to upload or
+           copy to. Copies between gs:// URLs happen server-side
+    jobs -- Number of objects to transfer concurrently (-m N)
+    processes -- Use worker processes instead of threads for -m
+    slice_threshold -- Transfer objects at least this big (ex: 150M) in concurrent slices. 0 disables
+    slices -- Number of concurrent slices per large object. Uploads are composed from as many components
+    checksum -- Validate downloads with crc32c, md5 or auto (crc32c if it's fast here), or none to skip it
+    small_threshold -- Download objects smaller than this (ex: 1M) whole into memory, with less overhead. 0 disables
+    show_stats -- Print a JSON summary of listing and transfer timings to stderr when done
+    trace -- Write a JSON line for every listing page and object transferred, and the summary, to this file
+    read_manifest -- Download the gs:// object URLs read from stdin, one per line, to their names under the one
+                     URL given, a local directory (-I)
+    manifest -- Read the URLs for -I from this file instead
+    """
+
+    configure(workers=jobs * slices)
+    if read_manifest or manifest:
+        if dir is not None or url.startswith('gs://'):
+            raise click.UsageError('cp -I takes just the local directory to download into')
+        with recording('cp', trace=trace, summary=sys.stderr if show_stats else None):
+            copy_manifest(manifest or sys.stdin, url, jobs=jobs, processes=processes,
+                          slice_threshold=slice_threshold, slices=slices, checksum=checksum,
+                          small_threshold=small_threshold)
+        return
+    if dir is None:
+        raise click.UsageError('Missing argument "DIR".')
+    if dir.startswith('gs://') and not url.startswith('gs://'):
+        (bucket_name, prefix) = bucket_path_from_url(dir)
+        bucket = get_bucket(bucket_name)
+        with recording('cp', trace=trace, summary=sys.stderr if show_stats else None):
+            upload_files(url, bucket, prefix=prefix, recursive=recursive, jobs=jobs, processes=processes,
+                         slice_threshold=slice_threshold, slices=slices)
+        return
+
+    (bucket_name, prefix) = bucket_path_from_url(url)
+    bucket = get_bucket(bucket_name)
+    with recording('cp', trace=trace, summary=sys.stderr if show_stats else None):
+        blobs = _list_blobs(bucket, prefix, recursive)
+
+        if len(blobs) == 0:
+            raise myutil.exceptions.CommandException('No URLs matched: {}'.format(url))
+        if not recursive and len(blobs) > 1 and not has_wildcard(prefix):
+            print('Omitting prefix "gs://{}/{}/". (Did you mean to do cp -r?)'.format(bucket.name, prefix))
+            raise myutil.exceptions.CommandException('No URLs matched')
+
+        if dir.startswith('gs://'):
+            (destination_bucket_name, destination) = bucket_path_from_url(dir)
+            return copy_blobs(blobs, get_bucket(destination_bucket_name), prefix, destination=destination,
+                              recursive=recursive, jobs=jobs, processes=processes)
+        download_blobs(blobs=blobs, dir=dir, prefix=prefix, recursive=recursive, jobs=jobs,
+                       processes=processes, slice_threshold=slice_threshold, slices=slices, checksum=checksum,
+                       small_threshold=small_threshold)
+
+
+@cli.command()
+@click.option('--delete', '-d', default=False, is_flag=True)
+@click.option('--jobs', '-m', default=1, type=click.IntRange(1, None))
+@click.option('--processes', default=False, is_flag=True)
+@click.option('--slice-threshold', default=str(SLICED_DOWNLOAD_THRESHOLD), callback=_size_option)
+@click.option('--slices', default=SLICED_DOWNLOAD_COMPONENTS, type=click.IntRange(1, None))
+@click.option('--checksum', default='auto', type=click.Choice(CHECKSUM_CHOICES))
+@click.option('--small-threshold', default=str(SMALL_OBJECT_THRESHOLD), callback=_size_option)
+@click.option('--stats', 'show_stats', default=False, is_flag=True)
+@click.option('--trace', default=None, type=click.Path(dir_okay=False, writable=True))
 @click.argument('url')
 @click.argument('dir')
-def cp(recursive, url, dir):
-    """Copy blobs from a bucket
+def rsync(delete, jobs, processes, slice_threshold, slices, checksum, small_threshold, show_stats, trace, url,
+          dir):
+    """Mirror blobs under a bucket prefix into a directory
 
     Keyword arguments:
     url -- The URL in the format gs://bucket/subdir
-    dir -- The dir to copy to. If recursive, it will create
+    dir -- The dir to mirror into. Only missing or changed objects are copied
+    delete -- Delete local files that aren't under the URL
+    jobs -- Number of objects to download concurrently (-m N)
+    processes -- Use worker processes instead of threads for -m
+    slice_threshold -- Download objects at least this big (ex: 150M) in concurrent slices. 0 disables
+    slices -- Number of concurrent slices per large object
+    checksum -- Validate downloads with crc32c, md5 or auto (crc32c if it's fast here), or none to skip it
+    small_threshold -- Download objects smaller than this (ex: 1M) whole into memory, with less overhead. 0 disables
+    show_stats -- Print a JSON summary of listing and transfer timings to stderr when done
+    trace -- Write a JSON line for every listing page and object transferred, and the summary, to this file
     """
 
     (bucket_name, prefix) = bucket_path_from_url(url)
-    bucket = storage_client.get_bucket(bucket_name)
-    blobs = [blob for blob in bucket.list_blobs(prefix=prefix)]  # HTTPIterator to list
+    configure(workers=jobs * slices)
+    bucket = get_bucket(bucket_name)
+    mkdir_p(dir)
+    with recording('rsync', trace=trace, summary=sys.stderr if show_stats else None):
+        blobs = (blob for page in timed_pages(list_pages(bucket, prefix)) for blob in page)
+        rsync_blobs(blobs, dir, prefix=prefix, jobs=jobs, processes=processes, delete=delete,
+                    slice_threshold=slice_threshold, slices=slices, checksum=checksum, small_threshold=small_threshold)
+
+
+@cli.command()
+@click.option('--recursive', '-r', default=False, is_flag=True)
+@click.option('--jobs', '-m', default=1, type=click.IntRange(1, None))
+@click.argument('urls', nargs=-1, required=True)
+def rm(recursive, jobs, urls):
+    """Remove objects from a bucket
 
-    if len(blobs) == 0:
-        raise myutil.exceptions.CommandException('No URLs matched: {}'.format(url))
-    if not recursive and len(blobs) > 1:
-        print('Omitting prefix "gs://{}/{}/". (Did you mean to do cp -r?)'.format(bucket.name, prefix))
-        raise myutil.exceptions.CommandException('No URLs matched')
+    Keyword arguments:
+    urls -- URLs of objects in the format gs://bucket/name, which may have wildcards. If recursive, every object
+            under them is removed
+    jobs -- Number of batch requests (of up to 100 objects each) to send concurrently (-m N)
+    """
+
+    configure(workers=jobs)
+    blobs = []
+    for url in urls:
+        (bucket_name, prefix) = bucket_path_from_url(url)
+        bucket = get_bucket(bucket_name)
+        if not recursive and not has_wildcard(prefix):
+            blobs.append(bucket.blob(prefix))
+            continue
+        matched = _list_blobs(bucket, prefix, recursive)
+        if not has_wildcard(prefix):
+            matched = list(select_blobs(matched, prefix))
+        if not matched:
+            raise myutil.exceptions.CommandException('No URLs matched: {}'.format(url))
+        blobs.extend(matched)
+    remove_blobs(blobs, jobs=jobs)
+
+
+@cli.command()
+@click.option('--jobs', '-m', default=1, type=click.IntRange(1, None))
+@click.argument('urls', nargs=-1, required=True)
+def stat(jobs, urls):
+    """Print the metadata of objects
+
+    Keyword arguments:
+    urls -- URLs of objects in the format gs://bucket/name, which may have wildcards
+    jobs -- Number of batch requests (of up to 100 objects each) to send concurrently (-m N)
+    """
+
+    configure(workers=jobs)
+    (blobs, listed) = ([], [])
+    for url in urls:
+        (bucket_name, name) = bucket_path_from_url(url)
+        bucket = get_bucket(bucket_name)
+        if not has_wildcard(name):
+            blobs.append(bucket.blob(name))
+            continue
+        # Wildcard matches come with their metadata from the listing, so they need no requests of their own
+        matched = _list_blobs(bucket, name)
+        if not matched:
+            raise myutil.exceptions.CommandException('No URLs matched: {}'.format(url))
+        blobs.extend(matched)
+        listed.extend(matched)
+    stat_blobs(blobs, jobs=jobs, listed=listed)
+
+
+@cli.command()
+@click.option('--range', '-r', 'byte_range', default=None, callback=_range_option)
+@click.argument('urls', nargs=-1, required=True)
+def cat(byte_range, urls):
+    """Write the content of objects to stdout
+
+    Keyword arguments:
+    urls -- URLs of objects in the format gs://bucket/name, which may have wildcards. They are written in order
+    byte_range -- Only write these bytes of each object: START-END (inclusive), START- or -N for the last N bytes
+    """
 
-    download_blobs(blobs=blobs, dir=dir, prefix=prefix, recursive=recursive)
+    blobs = []
+    for url in urls:
+        (bucket_name, name) = bucket_path_from_url(url)
+        bucket = get_bucket(bucket_name)
+        if has_wildcard(name):
+            matched = _list_blobs(bucket, name)
+        else:
+            matched = [blob for blob in [bucket.get_blob(name)] if blob is not None]
+        if not matched:
+            raise myutil.exceptions.CommandException('No URLs matched: {}'.format(url))
+        blobs.extend(matched)
+    try:
+        cat_blobs(blobs, getattr(sys.stdout, 'buffer', sys.stdout), byte_range=byte_range)
+    except IOError as exc:
+        if exc.errno != errno.EPIPE:
+            raise
+        # The reader went away (ex: | head). Point stdout at nothing so exiting doesn't fail to flush it
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
 
 
 if __name__ == '__main__':
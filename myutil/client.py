@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import threading
+
+# google.cloud.storage takes a few hundred milliseconds to import and finding credentials can mean
+# a metadata server round trip, so neither happens until a command actually talks to GCS
+
+# Connections kept alive per host when there are fewer workers than this (requests' default)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+_client = None
+_lock = threading.Lock()
+_settings = {
+    'pool_size': None,
+    'workers': 1,
+    'timeout': DEFAULT_TIMEOUT,
+    'retries': DEFAULT_RETRIES,
+    'backoff': DEFAULT_BACKOFF,
+}
+
+
+def configure(**settings):
+    """Change the transport settings of clients, including the shared one if it already exists
+
+    Keyword arguments:
+    pool_size -- connections kept alive per host. None sizes the pool to the workers
+    workers -- number of requests that may be in flight at once
+    timeout -- seconds to wait to connect, and between bytes of a response
+    retries -- attempts after the first for connection errors and transient statuses
+    backoff -- exponential backoff factor between retries
+    """
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise TypeError('unknown transport settings: {}'.format(', '.join(sorted(unknown))))
+    _settings.update(settings)
+    if _client is not None:
+        _mount(_client)
+
+
+def get_settings():
+    """Return a copy of the transport settings (ex: to configure a worker process the same way)"""
+    return dict(_settings)
+
+
+def _mount(client):
+    from myutil.transport import mount, resolve_environment
+    mount(client._http, pool_size=_settings['pool_size'] or max(DEFAULT_POOL_SIZE, _settings['workers']),
+          timeout=_settings['timeout'], retries=_settings['retries'], backoff=_settings['backoff'])
+    resolve_environment(client._http, client._connection.API_BASE_URL)
+
+
+def new_client():
+    """Create a new storage client using the transport settings
+
+    Worker processes need their own, as clients (and their HTTP sessions) can't be shared.
+    """
+    from google.cloud import storage
+    client = storage.Client()
+    _mount(client)
+    return client
+
+
+def get_client():
+    """Return the shared storage client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = new_client()
+    return _client
+
+
+def get_bucket(bucket_name):
+    """Return a bucket of the shared client, without the request get_bucket would make
+
+    A missing bucket is still reported (as NotFound) by the first request against it.
+
+    Keyword arguments:
+    bucket_name -- string bucket name
+    """
+    return get_client().bucket(bucket_name)
@@ -1,104 +1,640 @@
 # -*- coding: utf-8 -*-
+import calendar
+import json
 import os
-import re
-from urllib import unquote
-
-from anytree import Node, RenderTree
-from google.cloud.storage.blob import Blob
+import threading
+import time
+from contextlib import closing
+from functools import partial
+from multiprocessing.pool import Pool, ThreadPool
 
 import myutil.exceptions
-from myutil.helpers import mkdir_p
+from myutil import stats
+from myutil.checksum import (blob_checksum, combine, download_algorithm,
+                             encode, file_checksum, new_hasher)
+from myutil.client import configure, get_settings, new_client
+from myutil.helpers import (compile_wildcard, has_wildcard, mkdir_p,
+                            wildcard_match)
+
+# Objects at least this big are downloaded as concurrent byte-range slices (same as gsutil)
+SLICED_DOWNLOAD_THRESHOLD = 150 * 1024 * 1024
+SLICED_DOWNLOAD_COMPONENTS = 4
+# Objects at least this big are downloaded through a temporary file and tracker so they can resume
+RESUMABLE_DOWNLOAD_THRESHOLD = 8 * 1024 * 1024
+TEMP_SUFFIX = '.part'
+TRACKER_SUFFIX = '.part.tracker'
+TRACKER_CHECKPOINT_BYTES = 8 * 1024 * 1024
+# Times to download an object again when what arrived doesn't match its checksum
+CHECKSUM_RETRIES = 1
+# Objects smaller than this are downloaded whole into memory by multi-object copies (see run_small_downloads)
+SMALL_OBJECT_THRESHOLD = 1024 * 1024
+# Small objects get a progress line at most this often (seconds) rather than one each
+PROGRESS_INTERVAL = 1.0
+
+
+class Node(object):
+    """A node in a path trie built from blob names
+
+    Children are kept in a dict keyed by path segment, so building a tree is linear in
+    the total length of the names. Leaves (most of the tree) don't allocate a dict at all.
+    """
+    __slots__ = ('name', 'depth', '_children')
+
+    def __init__(self, name, depth=0):
+        self.name = name
+        self.depth = depth
+        self._children = None
+
+    @property
+    def children(self):
+        return list(self._children.values()) if self._children else []
+
+    @property
+    def is_leaf(self):
+        return not self._children
 
 
 def tree_from_list(blobs, prefix='/'):
-    """Build an anytree Tree from GCP blob objects
+    """Build a path trie from GCP blob objects
 
     Keyword arguments:
     blobs -- GCP blob objects to render
     prefix -- Initial prefix used to help with render (top-level root-node name)
     """
     root_node = Node(prefix)
-    parent = root_node
     for blob in blobs:
-        blob_path = unquote(blob.path.rsplit('/', 1)[-1])
+        blob_path = blob.name
         if blob_path.startswith(prefix):
             blob_path = blob_path[len(prefix):]
+        parent = root_node
         for part in blob_path.split('/'):
-            if len(part) == 0 or parent.name == part:
-                continue
-            if part in [child.name for child in parent.children]:
-                parent = parent.children[0]
+            if not part:
                 continue
-            last = Node(part, parent=parent)
-            parent = last
-        parent = root_node
+            children = parent._children
+            if children is None:
+                children = parent._children = {}
+            node = children.get(part)
+            if node is None:
+                node = children[part] = Node(part, parent.depth + 1)
+            parent = node
     return root_node
 
 
+def render_lines(tree):
+    """Yield the lines of a rendered path trie, `tree`-command style
+
+    Keyword arguments:
+    tree -- Node with children
+    """
+    stack = [(tree, u'', u'')]
+    while stack:
+        (node, pre, fill) = stack.pop()
+        yield pre + node.name
+        children = node.children
+        for index in range(len(children) - 1, -1, -1):
+            if index == len(children) - 1:
+                stack.append((children[index], fill + u'\u2514\u2500\u2500 ', fill + u'    '))
+            else:
+                stack.append((children[index], fill + u'\u251c\u2500\u2500 ', fill + u'\u2502   '))
+
+
 def render_tree(tree=None):
-    """Render an anytree Tree
+    """Render a path trie
 
     Keyword arguments:
-    tree -- anytree Node with children
+    tree -- Node with children
     """
-    for pre, fill, node in RenderTree(tree):
-        print("%s%s" % (pre, node.name))
+    for line in render_lines(tree):
+        print(line)
+
+
+def list_level(bucket, prefix=''):
+    """Yield pages of gs:// URLs for the objects and prefixes one level under a prefix
+
+    The listing uses the API's delimiter so only a single level is fetched. Like gsutil, a
+    prefix without a trailing slash names either an object or a "directory" to list.
+
+    Keyword arguments:
+    bucket -- bucket to list
+    prefix -- string prefix to list under
+    """
+    if prefix and not prefix.endswith('/'):
+        is_dir = False
+        for page in bucket.list_blobs(prefix=prefix, delimiter='/').pages:
+            urls = ['gs://{}/{}'.format(bucket.name, blob.name) for blob in page if blob.name == prefix]
+            if urls:
+                yield urls
+            is_dir = is_dir or prefix + '/' in page.prefixes
+        if not is_dir:
+            return
+        prefix += '/'
+
+    for page in bucket.list_blobs(prefix=prefix, delimiter='/').pages:
+        names = [blob.name for blob in page if blob.name != prefix] + list(page.prefixes)
+        yield ['gs://{}/{}'.format(bucket.name, name) for name in sorted(names)]
+
+
+def list_matches(pages, bucket_name, pattern):
+    """Yield pages of gs:// URLs for the listed objects and "directories" that match a wildcard
+
+    A "directory" matches if its name without the trailing slash does, whether the listing
+    returned it as a prefix or only returned objects under it.
+
+    Keyword arguments:
+    pages -- iterable of pages of GCP blob objects, listed with helpers.wildcard_listing
+    bucket_name -- string bucket name
+    pattern -- string wildcard pattern
+    """
+    matcher = compile_wildcard(pattern)
+    previous = None
+    for page in pages:
+        names = []
+        for blob in page:
+            name = wildcard_match(matcher, blob.name, recursive=True)
+            if name is not None and name != blob.name:
+                # Objects under a matched directory come together, so it only has to be shown once
+                name += '/'
+                if name == previous:
+                    continue
+                previous = name
+            if name is not None:
+                names.append(name)
+        names += [prefix for prefix in getattr(page, 'prefixes', ()) if matcher.match(prefix.rstrip('/'))]
+        yield ['gs://{}/{}'.format(bucket_name, name) for name in sorted(names)]
+
+
+def match_pages(pages, pattern, recursive=False):
+    """Yield each page of listed GCP blob objects with only the ones a wildcard matches
+
+    Keyword arguments:
+    pages -- iterable of pages of GCP blob objects, listed with helpers.wildcard_listing
+    pattern -- string wildcard pattern
+    recursive -- also keep objects under matching "directories"
+    """
+    matcher = compile_wildcard(pattern)
+    for page in pages:
+        yield [blob for blob in page if wildcard_match(matcher, blob.name, recursive) is not None]
+
+
+def match_blobs(blobs, pattern, recursive=False):
+    """Group listed GCP blob objects by the name a wildcard matched them through, in listing order
+
+    Returns a list of (matched name, blobs) where the matched name is an object's own, or with
+    recursive the "directory" above it that matched (see helpers.wildcard_match). Blobs that
+    don't match are dropped.
+
+    Keyword arguments:
+    blobs -- GCP blob objects returned by the listing
+    pattern -- string wildcard pattern
+    recursive -- match whole "directories" too
+    """
+    matcher = compile_wildcard(pattern)
+    groups = []
+    for blob in blobs:
+        name = wildcard_match(matcher, blob.name, recursive)
+        if name is None:
+            continue
+        # A listing returns everything under a "directory" together
+        if groups and groups[-1][0] == name:
+            groups[-1][1].append(blob)
+        else:
+            groups.append((name, [blob]))
+    return groups
+
 
+def render_pages(pages, prefix=''):
+    """Yield pages of rendered lines for a recursive listing as each page arrives
 
-def download_blobs(blobs=[], dir=None, prefix=None, recursive=False):
+    Listings come back in name order, so every "directory" is contiguous and only the
+    path of the previous object has to be kept to know which directories are new.
+
+    Keyword arguments:
+    pages -- iterable of pages of GCP blob objects (ex: HTTPIterator.pages)
+    prefix -- string prefix that was listed. Names are rendered relative to its directory
+    """
+    base = prefix[:prefix.rfind('/') + 1]
+    previous = []
+    for page in pages:
+        lines = []
+        for blob in page:
+            parts = [part for part in blob.name[len(base):].split('/') if part]
+            # Directories keep their slash so a dir/ never collides with an object of the same name
+            parts = [part + '/' for part in parts[:-1]] + parts[-1:]
+            if blob.name.endswith('/') and parts:
+                parts[-1] += '/'
+            common = 0
+            while common < min(len(previous), len(parts)) and previous[common] == parts[common]:
+                common += 1
+            for depth in range(common, len(parts)):
+                lines.append('    ' * depth + parts[depth])
+            previous = parts
+        yield lines
+
+
+def disk_usage(pages, prefix='', summarize=False):
+    """Yield pages of (bytes, objects, name) totals for the "directories" under a prefix as the listing streams
+
+    Listings come back in name order, so a directory is finished as soon as a name outside
+    it arrives. Only the directories above the current object are kept, and each is reported
+    after everything under it, like du. The prefix itself comes last.
+
+    Keyword arguments:
+    pages -- iterable of pages of GCP blob objects (only name and size are needed)
+    prefix -- string prefix that was listed. Directories are reported relative to it
+    summarize -- only report the total for the prefix
+    """
+    root = prefix.rstrip('/') + '/' if prefix.rstrip('/') else ''
+    # [segment, bytes, objects] of the prefix and the open directories under it
+    stack = [[None, 0, 0]]
+    for page in pages:
+        totals = []
+        for blob in page:
+            dirs = blob.name[len(root):].split('/')[:-1] if blob.name.startswith(root) else []
+            common = 0
+            while common < min(len(stack) - 1, len(dirs)) and stack[common + 1][0] == dirs[common]:
+                common += 1
+            while len(stack) > common + 1:
+                _close_directory(stack, root, totals, summarize)
+            stack.extend([segment, 0, 0] for segment in dirs[common:])
+            stack[-1][1] += blob.size or 0
+            stack[-1][2] += 1
+        yield totals
+    totals = []
+    while len(stack) > 1:
+        _close_directory(stack, root, totals, summarize)
+    yield totals + [(stack[0][1], stack[0][2], prefix)]
+
+
+def _close_directory(stack, root, totals, summarize):
+    if not summarize:
+        path = root + ''.join(segment + '/' for (segment, _, _) in stack[1:])
+        totals.append((stack[-1][1], stack[-1][2], path))
+    (_, size, objects) = stack.pop()
+    stack[-1][1] += size
+    stack[-1][2] += objects
+
+
+def download_blobs(blobs=[], dir=None, prefix=None, recursive=False, jobs=1, processes=False, **options):
     """Download an array of GCP blob objects
 
     Keyword arguments:
     blobs -- GCP blob objects to download
     dir -- string directory to download into
+    jobs -- number of objects to download concurrently
+    processes -- use worker processes instead of threads when jobs > 1
+    options -- passed on to run_downloads (ex: small_threshold) and download_blob (ex: slice_threshold, slices)
     """
+    small_threshold = options.pop('small_threshold', SMALL_OBJECT_THRESHOLD)
     if not recursive and len(blobs) == 1:
-        return download_blob(blobs[0], dir)
+        (blob, error) = (blobs[0], None)
+        transfer = stats.begin(blob.name)
+        try:
+            return download_blob(blob, dir, **options)
+        except Exception as exc:
+            error = '{}: {}'.format(type(exc).__name__, exc)
+            raise
+        finally:
+            stats.record_transfer(blob.bucket.name, stats.end(transfer, blob.size, error))
     if len(blobs) > 1 and not os.path.isdir(dir):
         raise myutil.exceptions.CommandException('Destination URL must name a directory, bucket, or bucket '
                 'subdirectory for the multiple source form of the cp command.')  # noqa: E128
 
-    # First job is to shorten the tree so that the root node is where the prefix ends on
-    # the URL. Ex: gs://foo/a/b should have root node 'b'
-    _fixed_prefix = re.sub('/$', '', prefix)
     bucket = blobs[0].bucket
-    blob_prefix = None
-    root_node = Node(dir.replace('/', ''))
-    for pre, fill, node in RenderTree(tree_from_list(blobs)):
-        if node.name == _fixed_prefix.rsplit('/', 1)[-1]:
-            # Found the first node matching the last part of our URL. Set it as the root child
-            blob_prefix = os.sep.join([_node.name for _node in node.ancestors])  # preserve to use it on name rebuild
-            root_node.children = [node]
+    tasks = list(plan_downloads(blobs, dir, prefix, recursive=recursive))
+    if not tasks:
+        raise myutil.exceptions.CommandException('No URLs matched: gs://{}/{}'.format(bucket.name, prefix))
+
+    run_downloads(tasks, bucket, jobs=jobs, processes=processes, small_threshold=small_threshold, **options)
+
+
+def plan_downloads(blobs, dir, prefix, recursive=False):
+    """Map listed GCP blob objects straight to their destination filenames
+
+    The last part of the prefix becomes the top-level directory of the copy, so
+    gs://foo/a/b/1.txt copied from gs://foo/a/b lands in dir/b/1.txt. Each directory
+    is created once, and directory placeholder objects only create their directory.
+    With a wildcard, each match is copied as if it had been named: a matched object
+    lands in dir/, a matched "directory" (with recursive) in dir/<its name>/.
+
+    Keyword arguments:
+    blobs -- GCP blob objects returned by the listing
+    dir -- string directory to download into
+    prefix -- string prefix that was listed, or wildcard pattern the blobs were listed for
+    recursive -- whether wildcards match whole "directories"
+    """
+    if has_wildcard(prefix):
+        return (task for (name, group) in match_blobs(blobs, prefix, recursive)
+                for task in _plan_prefix(group, dir, name))
+    return _plan_prefix(blobs, dir, prefix)
+
+
+def _plan_prefix(blobs, dir, prefix):
+    prefix = prefix.rstrip('/')
+    base = prefix[:prefix.rfind('/') + 1]
+    created = set()
+    exact = None
+    for blob in blobs:
+        # An object named exactly like the prefix is only copied when nothing is under prefix/
+        if blob.name == prefix:
+            exact = blob
+            continue
+        # A listing of gs://foo/a also returns gs://foo/ab/..., which isn't under a/
+        if prefix and not blob.name.startswith(prefix + '/'):
+            continue
+        exact = False
+        parts = [part for part in blob.name[len(base):].split('/') if part]
+        if not parts:
+            continue
+        filename = os.path.join(dir, *parts)
+        dirname = filename if blob.name.endswith('/') else os.path.dirname(filename)
+        if dirname not in created:
+            mkdir_p(dirname)
+            created.add(dirname)
+        if not blob.name.endswith('/'):
+            yield (blob, filename)
+    if exact:
+        yield (exact, os.path.join(dir, prefix[len(base):]))
+
+
+def run_downloads(tasks, bucket, jobs=1, processes=False, downloaded=None, **options):
+    """Download (blob, filename) pairs with download_tasks, then report how it went (see report_copied)
+
+    Keyword arguments:
+    tasks -- list of (GCP blob object, filename) tuples
+    bucket -- bucket the blobs belong to
+    jobs -- number of concurrent workers. 1 downloads in the calling thread
+    processes -- use worker processes (each with its own client) instead of threads
+    downloaded -- called with (blob, filename) for each successful download, in task order
+    options -- passed on to download_tasks (ex: small_threshold)
+    """
+    errors = download_tasks(tasks, bucket, jobs=jobs, processes=processes, downloaded=downloaded, **options)
+    report_copied(len(tasks), errors)
+
+
+def download_tasks(tasks, bucket, jobs=1, processes=False, downloaded=None, small_threshold=SMALL_OBJECT_THRESHOLD,
+                   **options):
+    """Download (blob, filename) pairs through a bounded worker pool, returning [(URL, error)] for those that failed
+
+    Progress is printed in task order as results come back. Failures are collected
+    rather than aborting the run, so every task is attempted. Small objects are
+    downloaded first, by run_small_downloads.
+
+    Keyword arguments:
+    tasks -- list of (GCP blob object, filename) tuples
+    bucket -- bucket the blobs belong to
+    jobs -- number of concurrent workers. 1 downloads in the calling thread
+    processes -- use worker processes (each with its own client) instead of threads
+    downloaded -- called with (blob, filename) for each successful download, in task order
+    small_threshold -- objects smaller than this many bytes are downloaded whole into memory. 0 disables
+    options -- passed on to download_blob for every object
+    """
+    small = [task for task in tasks if _is_small(task[0], small_threshold)]
+    errors = []
+    if small:
+        errors = run_small_downloads(small, bucket, jobs=jobs, processes=processes, downloaded=downloaded,
+                                     checksum=options.get('checksum', 'auto'))
+        tasks = [task for task in tasks if not _is_small(task[0], small_threshold)]
+
+    items = _process_items(tasks) if jobs > 1 and processes else tasks
+
+    with closing(map_tasks(partial(_download_task, options=options), items, bucket, jobs, processes)) as results:
+        for ((blob, filename), (name, _, error, record)) in zip(tasks, results):
+            print('Copying gs://{}/{}...'.format(bucket.name, name))
+            stats.record_transfer(bucket.name, record)
+            if error is not None:
+                errors.append(('gs://{}/{}'.format(bucket.name, name), error))
+            elif downloaded is not None:
+                downloaded(blob, filename)
+    return errors
+
+
+def run_small_downloads(tasks, bucket, jobs=1, processes=False, downloaded=None, checksum='auto'):
+    """Download small (blob, filename) pairs whole into memory, returning [(URL, error)] for those that failed
+
+    With millions of few-KB objects, the per-object overhead of a regular download outweighs
+    the data. Here each object is a single GET of its listed mediaLink, checked against its
+    listed size and checksum in memory and written in one go (see download_small). Directories
+    were already created while planning, and progress is printed every PROGRESS_INTERVAL
+    seconds rather than per object. What's left is mostly the HTTP client's own CPU time, so
+    processes get past what one interpreter can do.
+
+    Keyword arguments:
+    tasks -- list of (GCP blob object, filename) tuples of objects _is_small accepts
+    bucket -- bucket the blobs belong to
+    jobs -- number of concurrent downloads. 1 downloads in the calling thread
+    processes -- use worker processes (each with its own client) instead of threads
+    downloaded -- called with (blob, filename) for each successful download, in task order
+    checksum -- 'auto', 'crc32c', 'md5' or 'none' (see checksum.download_algorithm)
+    """
+    items = _process_items(tasks) if jobs > 1 and processes else tasks
+    errors = []
+    printed = 0
+    task = partial(_small_download_task, checksum=checksum)
+    with closing(map_tasks(task, items, bucket, jobs, processes)) as results:
+        for (count, ((blob, filename), (error, record))) in enumerate(zip(tasks, results), 1):
+            stats.record_transfer(bucket.name, record)
+            if error is not None:
+                errors.append(('gs://{}/{}'.format(bucket.name, blob.name), error))
+            elif downloaded is not None:
+                downloaded(blob, filename)
+            now = time.time()
+            if now - printed >= PROGRESS_INTERVAL or count == len(tasks):
+                print('Copying gs://{}/{}... ({} of {} small objects)'.format(bucket.name, blob.name, count,
+                                                                              len(tasks)))
+                printed = now
+    return errors
+
+
+def _is_small(blob, threshold):
+    """Whether download_small can download a listed GCP blob object
+
+    It needs the listing's size and mediaLink. Objects stored gzipped (which the client decompresses),
+    encrypted with a customer key and requester-pays buckets are left to download_blob.
+    """
+    return bool(threshold and blob.size is not None and blob.size < threshold and blob.media_link and
+                not blob.content_encoding and blob._encryption_key is None and blob.bucket.user_project is None)
+
+
+def _small_download_task(task, bucket, checksum='auto'):
+    """Download a single task (see _task_blob) with download_small, returning (error, transfer record)"""
+    (blob, filename) = _task_blob(task, bucket)
+    transfer = stats.begin(blob.name)
+    try:
+        download_small(blob, filename, checksum=checksum)
+    except Exception as exc:
+        error = '{}: {}'.format(type(exc).__name__, exc)
+        return (error, stats.end(transfer, blob.size, error))
+    return (None, stats.end(transfer, blob.size))
+
+
+def download_small(blob, filename, checksum='auto'):
+    """Download a small GCP blob object with a single GET, checking it in memory before writing the file
+
+    Keyword arguments:
+    blob -- listed GCP blob object (see _is_small)
+    filename -- string filename to download into
+    checksum -- 'auto', 'crc32c', 'md5' or 'none' (see checksum.download_algorithm)
+    """
+    algorithm = download_algorithm(blob, checksum)
+    for _ in range(CHECKSUM_RETRIES + 1):
+        response = blob.bucket.client._http.get(blob.media_link)
+        if response.status_code != 200:
+            from google.api_core.exceptions import from_http_response
+            raise from_http_response(response)
+        data = response.content
+        error = _check_small(blob, data, algorithm)
+        if error is None:
             break
+    else:
+        raise myutil.exceptions.CommandException(error)
+    with open(filename, 'wb') as f:
+        f.write(data)
+    set_mtime(blob, filename)
+
+
+def _check_small(blob, data, algorithm):
+    """Return why a small download doesn't match its listing, or None if it does"""
+    if len(data) != blob.size:
+        return 'gs://{}/{}: expected {} bytes, got {}'.format(blob.bucket.name, blob.name, blob.size, len(data))
+    if algorithm is None:
+        return None
+    hasher = new_hasher(algorithm)
+    hasher.update(data)
+    if encode(hasher) != blob_checksum(blob, algorithm):
+        return 'gs://{}/{}: {} checksum of the download is {}, expected {}'.format(
+            blob.bucket.name, blob.name, algorithm, encode(hasher), blob_checksum(blob, algorithm))
+    return None
+
+
+def map_tasks(function, items, bucket, jobs=1, processes=False):
+    """Yield function(item, bucket) for each item, in order, running up to `jobs` at once
+
+    Keyword arguments:
+    function -- module-level function (or partial of one), as worker processes get it pickled
+    items -- list of items. They must be picklable for worker processes
+    bucket -- bucket to pass to function. Worker processes pass their own, as clients can't be pickled
+    jobs -- number of concurrent workers. 1 runs everything in the calling thread
+    processes -- use worker processes (each with its own client) instead of threads
+    """
+    pool = None
+    if jobs > 1 and processes:
+        pool = Pool(jobs, initializer=_init_worker_process, initargs=(bucket.name, get_settings()))
+        results = pool.imap(partial(_call_with_process_bucket, function), items)
+    elif jobs > 1:
+        pool = ThreadPool(jobs)
+        results = pool.imap(lambda item: function(item, bucket), items)
+    else:
+        results = (function(item, bucket) for item in items)
+    try:
+        for result in results:
+            yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-    # Walk the tree and rebuild filenames based on node path, cleaning up data along the way
-    for pre, fill, node in RenderTree(root_node):
-        if node.is_leaf:
-            blob_name = re.sub('^[/]*', '', blob_prefix + os.sep + os.sep.join([_node.name for _node in node.ancestors][1:]) + os.sep + node.name).replace('//', '/')  # noqa
-            filename = os.sep.join([_node.name for _node in node.ancestors]) + os.sep + node.name
-            mkdir_p(os.path.dirname(filename))
-            download_from_bucket(name=blob_name, bucket=bucket, filename=filename)
+
+def report_copied(total, errors):
+    """Print how a multi-object copy went, raising if anything failed
+
+    Keyword arguments:
+    total -- number of objects attempted
+    errors -- list of (URL, error message) of the ones that failed
+    """
+    if total > 1:
+        print('Copied {} of {} objects.'.format(total - len(errors), total))
+    if errors:
+        for (url, error) in errors:
+            print('Failed {}: {}'.format(url, error))
+        raise myutil.exceptions.CommandException('{} object(s) failed to copy'.format(len(errors)))
+
+
+_process_bucket = None
+
+
+def _init_worker_process(bucket_name, settings):
+    """Give a worker process its own client (with the parent's transport settings), as clients can't be pickled"""
+    global _process_bucket
+    configure(**settings)
+    _process_bucket = new_client().bucket(bucket_name)
+
+
+def _call_with_process_bucket(function, item):
+    return function(item, _process_bucket)
+
+
+def _process_items(tasks):
+    """Turn (blob, filename) tasks into items for worker processes, as blobs hold a client and can't be pickled"""
+    return [(blob.name, blob.generation, _listed_properties(blob), filename) for (blob, filename) in tasks]
+
+
+def _listed_properties(blob):
+    """The listing metadata a worker process needs to slice, resume, validate and date a download"""
+    keys = ('size', 'crc32c', 'md5Hash', 'mediaLink', 'updated', 'contentEncoding')
+    return dict((key, blob._properties[key]) for key in keys if key in blob._properties)
+
+
+def _task_blob(task, bucket):
+    """Return (blob, filename) for a task: (blob, filename), or (name, generation, properties, filename)"""
+    if len(task) == 2:
+        return task
+    from google.cloud.storage.blob import Blob
+    (name, generation, properties, filename) = task
+    blob = Blob(name=name, bucket=bucket, generation=generation)
+    blob._properties.update(properties)
+    return (blob, filename)
+
+
+def _download_task(task, bucket, options={}):
+    """Download a single task, returning (name, filename, error, transfer record)
+
+    A task is either (blob, filename), or (name, generation, properties, filename) in a worker process.
+    """
+    (blob, filename) = _task_blob(task, bucket)
+    (name, size) = (blob.name, blob.size)
+    transfer = stats.begin(name)
+    try:
+        download_blob(blob, filename, quiet=True, **options)
+    except Exception as exc:
+        error = '{}: {}'.format(type(exc).__name__, exc)
+        return (name, filename, error, stats.end(transfer, size, error))
+    return (name, filename, None, stats.end(transfer, size))
 
 
-def download_from_bucket(name, bucket, filename):
+def download_from_bucket(name, bucket, filename, quiet=False, generation=None):
     """Download a GCP blob object given a string filename and a bucket
 
     Keyword arguments:
     name -- full key name of  the GCP blob object to download
     bucket -- bucket to download from
     filename -- string filename to download into
+    quiet -- don't print progress (the caller reports it)
+    generation -- pin the download to this generation of the object
     """
-    return download_blob(blob=Blob(name=name, bucket=bucket), filename=filename)
+    from google.cloud.storage.blob import Blob
+    blob = Blob(name=name, bucket=bucket, generation=generation)
+    return download_blob(blob=blob, filename=filename, quiet=quiet)
 
 
-def download_blob(blob, filename, recursive=False):
+def download_blob(blob, filename, recursive=False, quiet=False, slice_threshold=SLICED_DOWNLOAD_THRESHOLD,
+                  slices=SLICED_DOWNLOAD_COMPONENTS, resumable_threshold=RESUMABLE_DOWNLOAD_THRESHOLD,
+                  checksum='auto'):
     """Download a GCP blob object
 
+    What arrives is checksummed as it's written and compared with the object's crc32c or md5.
+    A mismatch removes the file and downloads it again, up to CHECKSUM_RETRIES times.
+
     Keyword arguments:
     blob -- GCP blob object to download
     filename -- string filename to download into
+    quiet -- don't print progress (the caller reports it)
+    slice_threshold -- objects of at least this many bytes are downloaded in slices. 0 disables
+    slices -- number of byte-range slices to download concurrently
+    resumable_threshold -- objects of at least this many bytes can be resumed if interrupted. 0 disables
+    checksum -- 'auto', 'crc32c', 'md5' or 'none' to skip validation (see checksum.download_algorithm)
     """
-    print('Copying gs://{}/{}...'.format(blob.bucket.name, blob.name))
+    if not quiet:
+        print('Copying gs://{}/{}...'.format(blob.bucket.name, blob.name))
     if filename.endswith('/'):
         if not os.path.isdir(filename):
             raise myutil.exceptions.CommandException('Skipping attempt to download to filename ending with slash '
@@ -106,10 +642,233 @@ def download_blob(blob, filename, recursive=False):
                                                      'from a\nsubdirectory created by the Cloud Console\n'
                                                      '(https://cloud.google.com/console)'.format(filename))
     if os.path.isdir(filename):
-        filename = os.path.join(filename, blob.name.rsplit('/', 1)[1])
+        filename = os.path.join(filename, blob.name.rsplit('/', 1)[-1])
+
+    for _ in range(CHECKSUM_RETRIES + 1):
+        try:
+            return _download_blob(blob, filename, slice_threshold, slices, resumable_threshold, checksum)
+        except _ChecksumMismatch as exc:
+            error = str(exc)
+    raise myutil.exceptions.CommandException(error)
+
 
+def _download_blob(blob, filename, slice_threshold, slices, resumable_threshold, checksum):
+    from google.cloud.storage.exceptions import DataCorruption
+
+    # Slicing and resuming need the size and generation a listing returns. Objects stored gzipped are
+    # decompressed as they arrive, and GCS ignores Range when it does that, so they're a single stream
+    if blob.size is not None and blob.generation is not None and not blob.content_encoding:
+        if slice_threshold and slices > 1 and blob.size >= slice_threshold:
+            return download_sliced(blob, filename, slices=slices, checksum=checksum)
+        if resumable_threshold and blob.size >= resumable_threshold:
+            return download_sliced(blob, filename, slices=1, checksum=checksum)
+
+    error = None
     try:
-        blob.download_to_filename(filename)
+        # The client checksums a whole-object download itself, against the response's hashes
+        blob.download_to_filename(filename, checksum=download_algorithm(blob, checksum))
     except AttributeError:
         # https://github.com/GoogleCloudPlatform/google-cloud-python/issues/3736
         pass
+    except DataCorruption as exc:
+        error = 'gs://{}/{}: {}'.format(blob.bucket.name, blob.name, exc)
+    if error is not None:
+        # Raised out here so the client's exception isn't printed along with it
+        raise _ChecksumMismatch(error)
+
+
+def download_sliced(blob, filename, slices=SLICED_DOWNLOAD_COMPONENTS, checksum='auto'):
+    """Download a GCP blob object as concurrent, resumable byte-range slices
+
+    The slices are written at their offsets into a preallocated temporary file, which is
+    renamed over `filename` once every slice has arrived. Progress is checkpointed to a
+    tracker file next to it, so an interrupted download picks up where it stopped when run
+    again, unless the object's generation has changed since.
+
+    Each slice is checksummed as it's written and the crc32cs of the slices are combined into
+    the object's, so validating it doesn't read the file back. md5 can't be combined, so an
+    md5-validated download is a single stream.
+
+    Keyword arguments:
+    blob -- GCP blob object to download. Its size and generation must be known (ex: from a listing)
+    filename -- string filename to download into
+    slices -- number of byte-range slices to download concurrently. 1 is a single resumable stream
+    checksum -- 'auto', 'crc32c', 'md5' or 'none' (see checksum.download_algorithm)
+    """
+    algorithm = download_algorithm(blob, checksum, sliced=slices > 1)
+    if algorithm == 'md5':
+        slices = 1
+    temp_filename = filename + TEMP_SUFFIX
+    tracker = None
+    if os.path.exists(temp_filename):
+        tracker = _Tracker.load(filename + TRACKER_SUFFIX, blob)
+    if tracker is None:
+        size = blob.size
+        slice_size = max(-(-size // slices), 1)
+        ranges = [[start, min(start + slice_size, size), 0] for start in range(0, size, slice_size)]
+        tracker = _Tracker(filename + TRACKER_SUFFIX, blob.generation, size, ranges)
+        with open(temp_filename, 'wb') as f:
+            _preallocate(f, size)
+        tracker.save()
+
+    # An md5 can't be combined, so one resumed from a sliced download checks the whole file instead
+    range_algorithm = algorithm if algorithm == 'crc32c' or len(tracker.ranges) == 1 else None
+    hashers = {}
+    pending = [byte_range for byte_range in tracker.ranges if byte_range[2] < byte_range[1] - byte_range[0]]
+    if len(pending) > 1:
+        pool = ThreadPool(len(pending))
+        try:
+            download_range = stats.bind(lambda byte_range: (byte_range[0], _download_range(
+                blob, temp_filename, byte_range, tracker, range_algorithm)))
+            hashers.update(pool.imap_unordered(download_range, pending))
+        except BaseException:
+            # Stop the other slices (keeping their progress) rather than waiting for them to finish
+            tracker.cancelled.set()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for byte_range in pending:
+            hashers[byte_range[0]] = _download_range(blob, temp_filename, byte_range, tracker, range_algorithm)
+
+    if algorithm is not None:
+        _verify_download(blob, temp_filename, tracker, hashers, algorithm, range_algorithm)
+    os.rename(temp_filename, filename)
+    os.remove(tracker.path)
+    set_mtime(blob, filename)
+
+
+def set_mtime(blob, filename):
+    """Set a file's mtime to a GCP blob object's updated time, as download_to_filename does"""
+    updated = blob.updated  # Parsed on every access
+    if updated is not None:
+        mtime = calendar.timegm(updated.utctimetuple()) + updated.microsecond / 1e6
+        os.utime(filename, (mtime, mtime))
+
+
+def _preallocate(f, size):
+    """Size an open file up front, reserving its blocks where the platform allows it"""
+    f.truncate(size)
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        pass  # Not available here (ex: Python 2, or a filesystem without fallocate); sparse is fine
+
+
+def _verify_download(blob, filename, tracker, hashers, algorithm, range_algorithm):
+    """Compare a finished download with its object's checksum, removing it if they differ"""
+    if range_algorithm is None:
+        actual = file_checksum(filename, algorithm)
+    else:
+        # Ranges finished by an earlier, interrupted run are hashed from the file
+        for (start, end, _) in tracker.ranges:
+            if start not in hashers:
+                hashers[start] = _hash_file_range(filename, start, end - start, new_hasher(algorithm))
+        actual = combine([(hashers[start], end - start) for (start, end, _) in tracker.ranges], algorithm)
+    expected = blob_checksum(blob, algorithm)
+    if actual != expected:
+        os.remove(filename)
+        os.remove(tracker.path)
+        raise _ChecksumMismatch('gs://{}/{}: {} checksum of the download is {}, expected {}'.format(
+            blob.bucket.name, blob.name, algorithm, actual, expected))
+
+
+def _hash_file_range(filename, start, length, hasher, chunk_size=1024 * 1024):
+    """Feed `length` bytes of a file from `start` into a hasher, returning it"""
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            length -= len(chunk)
+    return hasher
+
+
+def _download_range(blob, filename, byte_range, tracker, algorithm=None):
+    """Download the rest of a [start, end, done] byte range of a GCP blob object into the same offsets of a file
+
+    Returns a hasher of the whole range when an algorithm is given (the part already done is read back), or None.
+    """
+    (start, end, done) = byte_range
+    hasher = None
+    if algorithm is not None:
+        hasher = _hash_file_range(filename, start, done, new_hasher(algorithm))
+    with open(filename, 'r+b') as f:
+        f.seek(start + done)
+        writer = _RangeWriter(f, byte_range, tracker, hasher)
+        try:
+            # Checksummed here (the client can't check a range against the object's hashes anyway)
+            blob.download_to_file(writer, start=start + done, end=end - 1, checksum=None)
+        finally:
+            writer.checkpoint()
+    if byte_range[2] != end - start:
+        raise myutil.exceptions.CommandException('Expected {} bytes for range {}-{} of gs://{}/{}, got {}'.format(
+            end - start - done, start + done, end - 1, blob.bucket.name, blob.name, byte_range[2] - done))
+    return hasher
+
+
+class _ChecksumMismatch(myutil.exceptions.CommandException):
+    """A download doesn't match its object's checksum"""
+
+
+class _RangeWriter(object):
+    """File-like wrapper that records the bytes written for a byte range in its tracker
+
+    The tracker is only updated after the data has been flushed, so it never claims more
+    than what made it to the file. Written data is also fed to a hasher, if there is one.
+    """
+
+    def __init__(self, f, byte_range, tracker, hasher=None):
+        self.f = f
+        self.byte_range = byte_range
+        self.tracker = tracker
+        self.hasher = hasher
+        self.done = byte_range[2]
+
+    def write(self, data):
+        if self.tracker.cancelled.is_set():
+            raise myutil.exceptions.CommandException('Download cancelled')
+        self.f.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self.done += len(data)
+        if self.done - self.byte_range[2] >= TRACKER_CHECKPOINT_BYTES:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.f.flush()
+        self.byte_range[2] = self.done
+        self.tracker.save()
+
+
+class _Tracker(object):
+    """The byte ranges of a partial download and how much of each is done, saved as JSON"""
+
+    def __init__(self, path, generation, size, ranges):
+        self.path = path
+        self.generation = generation
+        self.size = size
+        self.ranges = ranges
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, blob):
+        """Load a tracker for a GCP blob object, or None if it's missing, unreadable or stale"""
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('generation') != blob.generation or state.get('size') != blob.size:
+            return None
+        return cls(path, state['generation'], state['size'], state['ranges'])
+
+    def save(self):
+        with self._lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'generation': self.generation, 'size': self.size, 'ranges': self.ranges}, f)
+            os.rename(self.path + '.tmp', self.path)
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 import errno
 import os
+import re
+import sys
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+_WILDCARD = re.compile(r'[*?\[]')
 
 
 def bucket_path_from_url(url=None):
@@ -15,6 +20,117 @@ def bucket_path_from_url(url=None):
     return (url_parts[0], url_parts[1])
 
 
+def has_wildcard(path):
+    """Return whether an object path has gsutil-style wildcards (*, **, ? or [...])"""
+    return _WILDCARD.search(path) is not None
+
+
+def wildcard_listing(pattern, recursive=False):
+    """Work out the narrowest listing that covers a wildcard pattern, as (prefix, delimiter)
+
+    Everything before the first wildcard is a literal prefix the server can list under. When
+    the wildcards are all in the last path segment and can't cross a '/', a '/' delimiter
+    keeps the listing to that one level too.
+
+    Keyword arguments:
+    pattern -- string object path, possibly with wildcards
+    recursive -- whether matched "directories" will be copied whole, so their contents must be listed
+    """
+    match = _WILDCARD.search(pattern)
+    if match is None:
+        return (pattern, None)
+    rest = pattern[match.start():]
+    if recursive or '**' in rest or '/' in rest:
+        return (pattern[:match.start()], None)
+    return (pattern[:match.start()], '/')
+
+
+def compile_wildcard(pattern):
+    """Compile a wildcard pattern into a regex matching whole object names
+
+    * and ? match within a path segment, ** matches across them (and **/ matches no
+    directory at all), and [...] or [!...] matches a set of characters.
+
+    Keyword arguments:
+    pattern -- string object path with wildcards
+    """
+    parts = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        end = pattern.find(']', index + 2) if char == '[' else -1
+        if pattern.startswith('**/', index):
+            (part, index) = ('(?:.*/)?', index + 3)
+        elif pattern.startswith('**', index):
+            (part, index) = ('.*', index + 2)
+        elif char == '*':
+            (part, index) = ('[^/]*', index + 1)
+        elif char == '?':
+            (part, index) = ('[^/]', index + 1)
+        elif end > 0:
+            chars = pattern[index + 1:end]
+            chars = '^' + chars[1:] if chars.startswith('!') else chars
+            (part, index) = ('[' + chars.replace('\\', '\\\\') + ']', end + 1)
+        else:
+            (part, index) = (re.escape(char), index + 1)
+        parts.append(part)
+    return re.compile(''.join(parts) + r'\Z', re.DOTALL)
+
+
+def wildcard_match(matcher, name, recursive=False):
+    """Return the part of an object name that a compiled wildcard matches, or None
+
+    That's the name itself or, if recursive, the shortest "directory" above it that matches,
+    which is how a matched directory is copied whole.
+
+    Keyword arguments:
+    matcher -- regex from compile_wildcard
+    name -- string object name
+    recursive -- also match the object through its parent "directories"
+    """
+    if recursive:
+        position = name.find('/')
+        while position >= 0:
+            if matcher.match(name, 0, position):
+                return name[:position]
+            position = name.find('/', position + 1)
+    return name if matcher.match(name) else None
+
+
+def parse_size(value):
+    """Parse a byte size such as 1024, 150M or 2GiB into a number of bytes
+
+    Keyword arguments:
+    value -- int, or string number with an optional K/M/G/T suffix (powers of 1024)
+    """
+    if isinstance(value, int):
+        return value
+    match = re.match(r'^\s*(\d+)\s*([KMGT]?)(i?B)?\s*$', str(value), re.I)
+    if not match:
+        raise ValueError('invalid size {}'.format(value))
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+def parse_byte_range(value):
+    """Parse a gsutil-style byte range into (start, end), with end exclusive or None for the end of the object
+
+    START-END includes both ends, START- runs to the end, and -N is the last N bytes (as a
+    negative start).
+
+    Keyword arguments:
+    value -- string range
+    """
+    match = re.match(r'^\s*(\d*)\s*-\s*(\d*)\s*$', value)
+    if not match or not (match.group(1) or match.group(2)):
+        raise ValueError('invalid range {}'.format(value))
+    (start, end) = match.groups()
+    if not start:
+        return (-int(end), None)
+    if end and int(end) < int(start):
+        raise ValueError('invalid range {}'.format(value))
+    return (int(start), int(end) + 1 if end else None)
+
+
 def mkdir_p(path):
     """Helper method to mkdir recursively (similar to `mkdir -p`
 
@@ -26,3 +142,17 @@ def mkdir_p(path):
     except OSError as exc:
         if not exc.errno == errno.EEXIST and not os.path.isdir(path):
             raise
+
+
+def write_pages(pages, stream=None):
+    """Write pages of lines to a stream with a single write per page
+
+    Keyword arguments:
+    pages -- iterable of lists of lines (without newlines)
+    stream -- file-like object to write to. Defaults to stdout
+    """
+    stream = stream or sys.stdout
+    for lines in pages:
+        if lines:
+            stream.write(''.join(line + '\n' for line in lines))
+            stream.flush()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import deque
+from functools import partial
+from itertools import chain
+
+from myutil.client import configure, get_settings
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+# A listing is a chain of page requests, each needing the previous page's token, so one prefix
+# can't be listed any faster than a page per round trip. Listing the "directories" under it as
+# separate chains, at the same time, can.
+
+# Pages a shard may list ahead of the one being consumed (and units the delimiter listing may find ahead)
+SHARD_BUFFER_PAGES = 4
+
+_settings = {
+    'jobs': 1,
+    'depth': 1,
+}
+
+
+def configure_listing(**settings):
+    """Change how listings are sharded
+
+    Keyword arguments:
+    jobs -- number of shards to list at once. 1 lists in a single chain of pages
+    depth -- how many levels of "directories" to split the listing into shards by
+    """
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise TypeError('unknown listing settings: {}'.format(', '.join(sorted(unknown))))
+    _settings.update(settings)
+
+
+def list_pages(bucket, prefix='', **kwargs):
+    """Drop-in for bucket.list_blobs(prefix=prefix, **kwargs).pages that shards the listing if configured
+
+    Keyword arguments:
+    bucket -- bucket to list
+    prefix -- string prefix to list under
+    kwargs -- passed on to list_blobs (ex: fields). A delimiter listing is a single level, so it's never sharded
+    """
+    if _settings['jobs'] <= 1 or kwargs.get('delimiter'):
+        return bucket.list_blobs(prefix=prefix, **kwargs).pages
+    kwargs.pop('delimiter', None)
+    return sharded_pages(bucket, prefix, jobs=_settings['jobs'], depth=_settings['depth'], **kwargs)
+
+
+def sharded_pages(bucket, prefix='', jobs=8, depth=1, **kwargs):
+    """Yield pages of every GCP blob object under a prefix, in name order, listing shards of it concurrently
+
+    A delimiter listing finds the "directories" `depth` levels down, and each is listed as a
+    shard of its own while the one before it is consumed. Objects above the shards come in
+    pages of their own, in their place in name order. A prefix whose objects aren't in
+    directories gains nothing from this.
+
+    Everything streams: the delimiter listing runs on a thread of its own, at most `jobs`
+    shards list at once, and each of those and the delimiter listing keep a few pages ahead.
+
+    Keyword arguments:
+    bucket -- bucket to list
+    prefix -- string prefix to list under
+    jobs -- number of shards to list at once
+    depth -- levels of directories to split into shards
+    kwargs -- passed on to list_blobs (ex: fields)
+    """
+    if get_settings()['workers'] < jobs * depth:
+        configure(workers=jobs * depth)
+    cancelled = threading.Event()
+    units = _Prefetch(lambda: _discover(bucket, prefix, jobs, depth, kwargs, cancelled), cancelled,
+                      jobs + SHARD_BUFFER_PAGES)
+    try:
+        for page in _run_ahead(units.items(), partial(_start_shard, bucket, kwargs=kwargs, cancelled=cancelled), jobs):
+            yield page
+    finally:
+        cancelled.set()
+
+
+def discover_shards(bucket, prefix='', jobs=8, depth=1, **kwargs):
+    """Split a prefix into name-ordered units: lists of the objects between "directories", and the directories
+
+    Units are yielded as the delimiter listings arrive. Objects come a page (or less) at a time,
+    so a level with many objects isn't held in memory.
+
+    Keyword arguments:
+    bucket -- bucket to list
+    prefix -- string prefix to split
+    jobs -- number of delimiter listings to run at once below the first level
+    depth -- levels of directories to split into
+    kwargs -- passed on to list_blobs (ex: fields)
+    """
+    cancelled = threading.Event()
+    try:
+        for unit in _discover(bucket, prefix, jobs, depth, kwargs, cancelled):
+            yield unit
+    finally:
+        cancelled.set()
+
+
+def _discover(bucket, prefix, jobs, depth, kwargs, cancelled):
+    if kwargs.get('fields'):
+        kwargs = dict(kwargs, fields=kwargs['fields'] + ',prefixes')
+    levels = _level_pages(bucket, prefix, kwargs)
+    first = next(levels, [])
+    # A prefix such as gs://foo/data splits into just data/, which is no split at all
+    while len(first) == 1 and not isinstance(first[0], list):
+        second = next(levels, None)
+        if second is not None:
+            levels = chain([second], levels)
+            break
+        levels = _level_pages(bucket, first[0], kwargs)
+        first = next(levels, [])
+    units = (unit for units in chain([first], levels) for unit in units)
+    for unit in _expand(bucket, units, jobs, depth, kwargs, cancelled):
+        yield unit
+
+
+def _expand(bucket, units, jobs, depth, kwargs, cancelled):
+    """Replace the directories among units with the units of their own level, depth - 1 times over"""
+    if depth <= 1:
+        return units
+
+    def start(prefix):
+        levels = _level_pages(bucket, prefix, kwargs)
+        below = (unit for units in levels for unit in units)
+        return _Prefetch(lambda: _expand(bucket, below, jobs, depth - 1, kwargs, cancelled), cancelled,
+                         jobs + SHARD_BUFFER_PAGES)
+    # Directories are listed `jobs` at a time, ahead of the one whose units are being yielded
+    return _run_ahead(units, start, jobs)
+
+
+def _run_ahead(units, start, jobs):
+    """Yield the items units stand for, in order, with up to `jobs` of them produced ahead on threads of their own
+
+    Keyword arguments:
+    units -- iterable of lists (yielded as they are), and units that start() turns into a _Prefetch of items
+    start -- called with a unit to start producing its items
+    jobs -- units to have started ahead of the one being yielded
+    """
+    lookahead = jobs + SHARD_BUFFER_PAGES
+    ahead = deque()
+    running = 0
+    for unit in chain(units, [None]):
+        if isinstance(unit, list):
+            ahead.append(unit)
+        elif unit is not None:
+            ahead.append(start(unit))
+            running += 1
+        # Keep the next units producing while this one is consumed, and no more than that
+        while ahead and (unit is None or running >= jobs or len(ahead) > lookahead):
+            head = ahead.popleft()
+            if isinstance(head, list):
+                yield head
+                continue
+            running -= 1
+            for item in head.items():
+                yield item
+
+
+def _level_pages(bucket, prefix, kwargs):
+    """Delimiter-list one level, yielding each page as name-ordered units: runs of objects, and prefixes
+
+    Pages come in name order, so only the objects and prefixes within a page need merging.
+    """
+    for page in bucket.list_blobs(prefix=prefix, delimiter='/', **kwargs).pages:
+        items = [(blob.name, blob) for blob in page] + [(name, None) for name in page.prefixes]
+        units = []
+        for (name, blob) in sorted(items, key=lambda item: item[0]):
+            if blob is None:
+                units.append(name)
+            elif units and isinstance(units[-1], list):
+                units[-1].append(blob)
+            else:
+                units.append([blob])
+        yield units
+
+
+def _start_shard(bucket, prefix, kwargs, cancelled):
+    """Start listing everything under a prefix, SHARD_BUFFER_PAGES pages ahead"""
+    pages = bucket.list_blobs(prefix=prefix, **kwargs).pages
+    return _Prefetch(lambda: (list(page) for page in pages), cancelled)
+
+
+class _Prefetch(object):
+    """Runs a generator on a thread of its own, buffering up to `size` of its items for items()"""
+
+    _DONE = object()
+
+    def __init__(self, function, cancelled, size=SHARD_BUFFER_PAGES):
+        self.queue = queue.Queue(size)
+        self.cancelled = cancelled
+        self.thread = threading.Thread(target=self._run, args=(function,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, function):
+        try:
+            for item in function():
+                if not self._put(item):
+                    return
+        except Exception as exc:
+            self._put(_Failure(exc))
+            return
+        self._put(self._DONE)
+
+    def _put(self, item):
+        # Give up once nobody is consuming the listing any more
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def items(self):
+        while True:
+            item = self.queue.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+
+
+class _Failure(object):
+    """An exception raised while producing items, to re-raise in the consumer"""
+
+    def __init__(self, exc):
+        self.exc = exc
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+from collections import OrderedDict
+from itertools import islice
+
+import myutil.exceptions
+from myutil.batch import run_batches
+from myutil.client import get_bucket
+from myutil.gcp import download_tasks, report_copied
+from myutil.helpers import bucket_path_from_url, has_wildcard, mkdir_p
+
+# A manifest is read and copied this many URLs at a time. What's kept across batches is the
+# destinations already claimed (see copy_manifest), which grows with the number of distinct URLs
+MANIFEST_BATCH_SIZE = 10000
+
+
+def read_manifest(lines):
+    """Yield (bucket name, object name) for each gs:// URL in a manifest, as it's read
+
+    Blank lines are skipped.
+
+    Keyword arguments:
+    lines -- iterable of lines, each a gs://bucket/name URL of an object (ex: a file, or stdin)
+    """
+    for (number, line) in enumerate(lines, 1):
+        url = line.strip()
+        if not url:
+            continue
+        try:
+            (bucket_name, name) = bucket_path_from_url(url)
+        except Exception:
+            raise myutil.exceptions.CommandException('Invalid URL on line {} of the manifest: {}'.format(number, url))
+        if not name or name.endswith('/') or has_wildcard(name):
+            raise myutil.exceptions.CommandException(
+                'Manifest URLs must name objects, not prefixes or wildcards (line {}): {}'.format(number, url))
+        yield (bucket_name, name)
+
+
+def copy_manifest(lines, dir, jobs=1, processes=False, **options):
+    """Download the objects a manifest lists into a directory, in one run with the shared client
+
+    Each object lands at its name under dir (gs://b/x/1.txt in dir/x/1.txt). URLs are taken
+    MANIFEST_BATCH_SIZE at a time and grouped by bucket, each group's metadata is fetched
+    in batch requests, and the objects are downloaded like any multi-object copy.
+
+    A repeated URL is copied once. Destinations are remembered for the whole run, as a
+    16-byte digest and the (shared) bucket name, about 100 bytes per distinct URL, so a URL
+    whose destination was already taken by another bucket's object fails instead of
+    overwriting it. So do names with . or .. segments. Failures, including missing objects,
+    are reported once every URL has been attempted.
+
+    Keyword arguments:
+    lines -- iterable of gs://bucket/name URLs, one per line (see read_manifest)
+    dir -- string directory to download into
+    jobs -- number of objects (and metadata batches) to fetch concurrently
+    processes -- use worker processes instead of threads for downloads when jobs > 1
+    options -- passed on to download_tasks (ex: small_threshold, slice_threshold, checksum)
+    """
+    if not os.path.isdir(dir):
+        raise myutil.exceptions.CommandException('Destination URL must name a directory for cp -I.')
+    urls = read_manifest(lines)
+    (claimed, buckets) = ({}, {})
+    (total, errors) = (0, [])
+    while True:
+        batch = list(islice(urls, MANIFEST_BATCH_SIZE))
+        if not batch:
+            break
+        groups = OrderedDict()
+        for (bucket_name, name) in batch:
+            parts = name.split('/')
+            path = '/'.join(part for part in parts if part)
+            key = hashlib.md5(path.encode('utf-8')).digest()
+            # The bucket name is shared by its URLs, and only an unusual name (ex: a//b) is kept whole
+            owner = buckets.setdefault(bucket_name, bucket_name)
+            owner = owner if name == path else (owner, name)
+            previous = claimed.get(key)
+            if previous == owner:
+                continue
+            total += 1
+            url = 'gs://{}/{}'.format(bucket_name, name)
+            if '.' in parts or '..' in parts:
+                errors.append((url, 'Object name has . or .. segments, so it would land outside the destination'))
+            elif previous is not None:
+                errors.append((url, 'Destination {} is taken by gs://{}/{}'.format(
+                    os.path.join(dir, *path.split('/')),
+                    *(previous if isinstance(previous, tuple) else (previous, path)))))
+            else:
+                claimed[key] = owner
+                groups.setdefault(bucket_name, []).append(name)
+        for (bucket_name, names) in groups.items():
+            errors.extend(_copy_group(get_bucket(bucket_name), names, dir, jobs, processes, options))
+    if not total:
+        raise myutil.exceptions.CommandException('No URLs matched: the manifest is empty')
+    report_copied(total, errors)
+
+
+def _copy_group(bucket, names, dir, jobs, processes, options):
+    """Fetch the metadata of objects of one bucket and download them, returning [(URL, error)] for failures"""
+    blobs = [bucket.blob(name) for name in names]
+    (tasks, errors, created) = ([], [], set())
+    for (blob, error) in run_batches(lambda blob: blob.reload(), blobs, jobs=jobs):
+        if error is not None:
+            errors.append(('gs://{}/{}'.format(bucket.name, blob.name), error))
+            continue
+        filename = os.path.join(dir, *[part for part in blob.name.split('/') if part])
+        dirname = os.path.dirname(filename)
+        if dirname not in created:
+            mkdir_p(dirname)
+            created.add(dirname)
+        tasks.append((blob, filename))
+    if tasks:
+        errors.extend(download_tasks(tasks, bucket, jobs=jobs, processes=processes, **options))
+    return errors
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from contextlib import closing
+from functools import partial
+
+import myutil.exceptions
+from myutil import stats
+from myutil.gcp import map_tasks, match_blobs, report_copied
+from myutil.helpers import has_wildcard
+
+# Bucket-to-bucket copies use the rewrite API, so the bytes never leave GCS. A rewrite that can't
+# finish in one call (large objects, or a change of location or storage class) hands back a token
+# to carry on from.
+
+
+def copy_blobs(blobs, destination_bucket, prefix, destination='', recursive=False, jobs=1, processes=False):
+    """Copy listed GCP blob objects to another bucket (or name) server-side
+
+    Keyword arguments:
+    blobs -- GCP blob objects returned by the listing
+    destination_bucket -- bucket to copy into (it may be the blobs' own)
+    prefix -- string prefix that was listed, or wildcard pattern the blobs were listed for
+    destination -- string destination. A single object is copied as this name unless it's empty or ends
+                   with '/'. Otherwise the last part of the prefix is kept under it (see plan_copies)
+    recursive -- copy everything under the prefix
+    jobs -- number of objects to rewrite concurrently
+    processes -- use worker processes instead of threads when jobs > 1
+    """
+    bucket = blobs[0].bucket
+    if not recursive and len(blobs) == 1:
+        blob = blobs[0]
+        name = destination if destination and not destination.endswith('/') else \
+            destination + blob.name.rsplit('/', 1)[-1]
+        print('Copying gs://{}/{}...'.format(bucket.name, blob.name))
+        (error, transfer) = (None, stats.begin(blob.name))
+        try:
+            return copy_blob(blob, destination_bucket, name)
+        except Exception as exc:
+            error = '{}: {}'.format(type(exc).__name__, exc)
+            raise
+        finally:
+            stats.record_transfer(bucket.name, stats.end(transfer, blob.size, error))
+
+    tasks = list(plan_copies(blobs, prefix, destination, recursive=recursive))
+    if not tasks:
+        raise myutil.exceptions.CommandException('No URLs matched: gs://{}/{}'.format(bucket.name, prefix))
+    run_copies(tasks, bucket, destination_bucket, jobs=jobs, processes=processes)
+
+
+def plan_copies(blobs, prefix, destination='', recursive=False):
+    """Map listed GCP blob objects to their destination object names
+
+    Named like downloads: the last part of the prefix is kept, so gs://foo/a/b/1.txt copied
+    from gs://foo/a/b to gs://bar/c lands in gs://bar/c/b/1.txt, and each wildcard match is
+    named as if it had been given on its own.
+
+    Keyword arguments:
+    blobs -- GCP blob objects returned by the listing
+    prefix -- string prefix that was listed, or wildcard pattern the blobs were listed for
+    destination -- string destination prefix
+    recursive -- whether wildcards match whole "directories"
+    """
+    if has_wildcard(prefix):
+        return (task for (name, group) in match_blobs(blobs, prefix, recursive)
+                for task in _plan_prefix(group, name, destination))
+    return _plan_prefix(blobs, prefix, destination)
+
+
+def _plan_prefix(blobs, prefix, destination):
+    prefix = prefix.rstrip('/')
+    base = prefix[:prefix.rfind('/') + 1]
+    destination = destination.rstrip('/') + '/' if destination.rstrip('/') else ''
+    exact = None
+    for blob in blobs:
+        # An object named exactly like the prefix is only copied when nothing is under prefix/
+        if blob.name == prefix:
+            exact = blob
+            continue
+        # A listing of gs://foo/a also returns gs://foo/ab/..., which isn't under a/
+        if prefix and not blob.name.startswith(prefix + '/'):
+            continue
+        exact = False
+        yield (blob, destination + blob.name[len(base):])
+    if exact:
+        yield (exact, destination + prefix[len(base):])
+
+
+def run_copies(tasks, bucket, destination_bucket, jobs=1, processes=False):
+    """Rewrite (blob, destination name) pairs through a bounded worker pool
+
+    Like run_downloads, progress is printed in task order and failures are reported once every
+    task has been attempted.
+
+    Keyword arguments:
+    tasks -- list of (GCP blob object, string destination name) tuples
+    bucket -- bucket the blobs belong to
+    destination_bucket -- bucket to copy into
+    jobs -- number of concurrent workers. 1 copies in the calling thread
+    processes -- use worker processes (each with its own client) instead of threads
+    """
+    # Plain tuples, as worker processes can't be handed blobs
+    items = [(blob.name, blob.generation, blob.size, name) for (blob, name) in tasks]
+    errors = []
+    task = partial(_copy_task, destination_bucket_name=destination_bucket.name)
+    with closing(map_tasks(task, items, bucket, jobs, processes)) as results:
+        for ((name, _, _, _), (error, record)) in zip(items, results):
+            print('Copying gs://{}/{}...'.format(bucket.name, name))
+            stats.record_transfer(bucket.name, record)
+            if error is not None:
+                errors.append(('gs://{}/{}'.format(bucket.name, name), error))
+    report_copied(len(tasks), errors)
+
+
+def _copy_task(item, bucket, destination_bucket_name=None):
+    """Rewrite a single (name, generation, size, destination name) item, returning (error, transfer record)"""
+    (name, generation, size, destination) = item
+    transfer = stats.begin(name)
+    try:
+        copy_blob(bucket.blob(name, generation=generation), bucket.client.bucket(destination_bucket_name), destination)
+    except Exception as exc:
+        error = '{}: {}'.format(type(exc).__name__, exc)
+        return (error, stats.end(transfer, size, error))
+    return (None, stats.end(transfer, size))
+
+
+def copy_blob(blob, destination_bucket, name):
+    """Copy a GCP blob object server-side, following rewrite tokens until it's done
+
+    The listed generation is copied, so an object replaced since the listing fails rather than
+    copying something else.
+
+    Keyword arguments:
+    blob -- GCP blob object to copy
+    destination_bucket -- bucket to copy into
+    name -- string destination object name
+    """
+    destination = destination_bucket.blob(name)
+    token = None
+    while True:
+        (token, _, _) = destination.rewrite(blob, token=token)
+        if token is None:
+            return destination
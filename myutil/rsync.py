@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import myutil.exceptions
+from myutil.checksum import blob_algorithm, blob_checksum, file_checksum
+from myutil.gcp import TEMP_SUFFIX, TRACKER_SUFFIX, run_downloads, set_mtime
+from myutil.helpers import mkdir_p
+
+INDEX_FILENAME = '.myutil-rsync-index.json'
+
+
+def rsync_blobs(blobs, dir, prefix='', jobs=1, processes=False, delete=False, **options):
+    """Make a local directory mirror the GCP blob objects under a prefix
+
+    Only objects that are missing locally or differ in size or checksum are downloaded. A
+    local index of each file's size, mtime and checksums means files that haven't changed
+    since the last run aren't hashed again.
+
+    Keyword arguments:
+    blobs -- GCP blob objects listed under the prefix (any iterable, consumed once)
+    dir -- string directory to mirror into
+    prefix -- string prefix that was listed. Local names are relative to it
+    jobs -- number of objects to download concurrently
+    processes -- use worker processes instead of threads when jobs > 1
+    delete -- delete local files that don't exist under the prefix
+    options -- passed on to run_downloads (ex: small_threshold) and download_blob for every object
+    """
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    index = load_index(dir)
+    remote = set()
+    tasks = []
+    created = set()
+    bucket = None
+    skipped = 0
+    for blob in blobs:
+        bucket = blob.bucket
+        if not blob.name.startswith(prefix) or blob.name.endswith('/'):
+            continue
+        relative = blob.name[len(prefix):]
+        remote.add(relative)
+        filename = os.path.join(dir, *relative.split('/'))
+        if _unchanged(blob, filename, relative, index):
+            skipped += 1
+            continue
+        dirname = os.path.dirname(filename)
+        if dirname not in created:
+            mkdir_p(dirname)
+            created.add(dirname)
+        tasks.append((blob, filename))
+
+    if not remote:
+        raise myutil.exceptions.CommandException('No URLs matched: gs://{}/{}'.format(
+            bucket.name if bucket else '', prefix))
+
+    def _downloaded(blob, filename):
+        # The index entry describes the file as downloaded, so the next run won't hash it
+        set_mtime(blob, filename)
+        stat = os.stat(filename)
+        index[blob.name[len(prefix):]] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                          'crc32c': blob.crc32c, 'md5': blob.md5_hash}
+
+    try:
+        if tasks:
+            run_downloads(tasks, bucket, jobs=jobs, processes=processes, downloaded=_downloaded, **options)
+        print('Skipped {} unchanged objects.'.format(skipped))
+        if delete:
+            print('Deleted {} extra files.'.format(_delete_extras(dir, remote, index)))
+    finally:
+        for relative in [relative for relative in index if relative not in remote]:
+            del index[relative]
+        save_index(dir, index)
+
+
+def _unchanged(blob, filename, relative, index):
+    """Check whether a local file already matches a GCP blob object, hashing it only if the index can't tell"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return False
+    if stat.st_size != blob.size:
+        return False
+    algorithm = blob_algorithm(blob)
+    if algorithm is None:
+        return False
+    entry = index.get(relative)
+    if not entry or entry.get('size') != stat.st_size or entry.get('mtime') != stat.st_mtime or \
+            not entry.get(algorithm):
+        entry = index[relative] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                   algorithm: file_checksum(filename, algorithm)}
+    return entry[algorithm] == blob_checksum(blob, algorithm)
+
+
+def _delete_extras(dir, remote, index):
+    """Delete files under dir whose relative names aren't in remote, returning how many were deleted"""
+    deleted = 0
+    for (root, dirs, files) in os.walk(dir):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, dir).replace(os.sep, '/')
+            if relative == INDEX_FILENAME or relative in remote:
+                continue
+            # Keep partial downloads of objects that still exist, so they can resume
+            if relative.endswith(TEMP_SUFFIX) and relative[:-len(TEMP_SUFFIX)] in remote:
+                continue
+            if relative.endswith(TRACKER_SUFFIX) and relative[:-len(TRACKER_SUFFIX)] in remote:
+                continue
+            os.remove(path)
+            index.pop(relative, None)
+            deleted += 1
+    return deleted
+
+
+def load_index(dir):
+    """Load the rsync index of a directory, or an empty one
+
+    Keyword arguments:
+    dir -- string directory being mirrored
+    """
+    try:
+        with open(os.path.join(dir, INDEX_FILENAME)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_index(dir, index):
+    """Atomically save the rsync index of a directory
+
+    Keyword arguments:
+    dir -- string directory being mirrored
+    index -- dict of relative name to size, mtime and checksums
+    """
+    path = os.path.join(dir, INDEX_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.rename(path + '.tmp', path)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+import array
+import json
+import threading
+import time
+
+# Instrumentation is off unless a command starts recording. Per-object bookkeeping is a couple of
+# clock reads either way, and nothing is kept or written when nobody is recording.
+
+_recorder = None
+_local = threading.local()
+
+
+class Transfer(object):
+    """Timing of one object's transfer, filled in by every HTTP response made for it"""
+
+    __slots__ = ('name', 'start', 'ttfb', 'requests', 'retries')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.ttfb = None
+        self.requests = 0
+        self.retries = 0
+
+    def finish(self, size, error=None):
+        """Return the transfer's record: a dict that can cross back from a worker process"""
+        duration = time.time() - self.start
+        return {'name': self.name, 'bytes': size, 'ttfb': self.ttfb, 'duration': duration,
+                'throughput': size / duration if size and duration else None,
+                'requests': self.requests, 'retries': self.retries, 'error': error}
+
+
+def begin(name):
+    """Start timing the transfer of an object in this thread, returning its Transfer"""
+    transfer = _local.transfer = Transfer(name)
+    return transfer
+
+
+def end(transfer, size, error=None):
+    """Stop timing a transfer started with begin(), returning its record"""
+    _local.transfer = None
+    return transfer.finish(size, error)
+
+
+def bind(function):
+    """Wrap a function so it runs as part of the calling thread's transfer in any other thread"""
+    transfer = getattr(_local, 'transfer', None)
+
+    def _bound(*args, **kwargs):
+        _local.transfer = transfer
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.transfer = None
+    return _bound
+
+
+def on_response(retries=0):
+    """Count an HTTP response against the transfer of this thread, if any
+
+    Keyword arguments:
+    retries -- failed attempts behind this response, including the response itself if it's to be retried
+    """
+    transfer = getattr(_local, 'transfer', None)
+    if transfer is None:
+        return
+    if transfer.ttfb is None:
+        transfer.ttfb = time.time() - transfer.start
+    transfer.requests += 1
+    transfer.retries += retries
+
+
+def timed_pages(pages):
+    """Record how long each page of a listing takes to arrive, passing the pages through
+
+    Keyword arguments:
+    pages -- iterable of pages (ex: HTTPIterator.pages, or pages of output lines)
+    """
+    if _recorder is None:
+        return pages
+    return _timed_pages(_recorder, pages)
+
+
+def _timed_pages(recorder, pages):
+    iterator = iter(pages)
+    while True:
+        start = time.time()
+        try:
+            page = next(iterator)
+        except StopIteration:
+            return
+        # google.api_core Pages are one-shot iterators that know their length
+        recorder.page(time.time() - start, page.num_items if hasattr(page, 'num_items') else len(page))
+        yield page
+
+
+def record_transfer(bucket_name, record):
+    """Record a finished transfer (see Transfer.finish) if recording"""
+    if _recorder is not None:
+        _recorder.transfer(bucket_name, record)
+
+
+def percentiles(values):
+    """Summarize a list of numbers as count, p50, p90, p99 and max (nearest rank)"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    summary = {'count': len(values), 'max': values[-1]}
+    for percentile in (50, 90, 99):
+        summary['p{}'.format(percentile)] = values[max(-(-len(values) * percentile // 100) - 1, 0)]
+    return summary
+
+
+class Recorder(object):
+    """Collects listing pages and transfers, streaming each as a JSON line and summarizing them at the end
+
+    Keyword arguments:
+    trace -- file object to write every event to, or None
+    summary -- file object to write the summary to, or None
+    """
+
+    def __init__(self, trace=None, summary=None):
+        self.trace = trace
+        self.summary = summary
+        self.start = time.time()
+        self.page_latencies = array.array('d')
+        self.items = 0
+        self.ttfbs = array.array('d')
+        self.durations = array.array('d')
+        self.objects = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _emit(self, event):
+        if self.trace is not None:
+            self.trace.write(json.dumps(event, sort_keys=True) + '\n')
+
+    def page(self, latency, items):
+        with self._lock:
+            self.page_latencies.append(latency)
+            self.items += items
+            self._emit({'event': 'page', 'time': time.time() - self.start, 'latency': latency, 'items': items})
+
+    def transfer(self, bucket_name, record):
+        with self._lock:
+            self.objects += 1
+            self.retries += record['retries']
+            if record['error'] is not None:
+                self.failed += 1
+            else:
+                self.bytes += record['bytes'] or 0
+                self.durations.append(record['duration'])
+                if record['ttfb'] is not None:
+                    self.ttfbs.append(record['ttfb'])
+            event = dict(record, event='transfer', time=time.time() - self.start,
+                         name='gs://{}/{}'.format(bucket_name, record['name']))
+            self._emit(event)
+
+    def close(self, command):
+        seconds = time.time() - self.start
+        event = {
+            'event': 'summary', 'command': command, 'seconds': seconds,
+            'pages': percentiles(self.page_latencies), 'items': self.items,
+            'objects': self.objects, 'failed': self.failed, 'bytes': self.bytes, 'retries': self.retries,
+            'throughput': self.bytes / seconds if seconds else None,
+            'ttfb': percentiles(self.ttfbs), 'duration': percentiles(self.durations),
+        }
+        self._emit(event)
+        if self.summary is not None:
+            self.summary.write(json.dumps(event, sort_keys=True) + '\n')
+            self.summary.flush()
+
+
+class recording(object):
+    """Context manager recording a command's listing and transfers (does nothing if neither output is wanted)
+
+    Keyword arguments:
+    command -- string command name for the summary
+    trace -- string filename to write every event to as JSON lines, or None
+    summary -- file object to write the summary to as a JSON line (ex: sys.stderr), or None
+    """
+
+    def __init__(self, command, trace=None, summary=None):
+        self.command = command
+        self.trace_path = trace
+        self.summary = summary
+        self.trace = None
+
+    def __enter__(self):
+        global _recorder
+        if self.trace_path is None and self.summary is None:
+            return None
+        if self.trace_path is not None:
+            self.trace = open(self.trace_path, 'w')
+        _recorder = Recorder(trace=self.trace, summary=self.summary)
+        return _recorder
+
+    def __exit__(self, *exc_info):
+        global _recorder
+        if _recorder is None:
+            return
+        try:
+            _recorder.close(self.command)
+        finally:
+            _recorder = None
+            if self.trace is not None:
+                self.trace.close()
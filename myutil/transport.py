@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+
+from requests.adapters import HTTPAdapter
+from requests.utils import get_environ_proxies
+from urllib3.util.retry import Retry
+
+from myutil.stats import on_response
+
+# Responses worth another attempt: timeouts, rate limiting and server errors
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class TransportAdapter(HTTPAdapter):
+    """HTTPAdapter with a fixed timeout for every request and retries with exponential backoff
+
+    Keyword arguments:
+    pool_size -- connections kept alive per host. Concurrent requests beyond it open (and throw away)
+                 new connections, so it should cover every worker
+    timeout -- seconds to wait to connect, and between bytes of a response
+    retries -- attempts after the first for connection errors and RETRY_STATUSES. Only idempotent
+               methods are retried
+    backoff -- exponential backoff factor: consecutive retries sleep backoff * 2 ** (n - 1) seconds
+    """
+
+    def __init__(self, pool_size, timeout, retries, backoff):
+        self.timeout = timeout
+        max_retries = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                            raise_on_status=False)
+        super(TransportAdapter, self).__init__(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries)
+
+    def send(self, request, **kwargs):
+        kwargs['timeout'] = self.timeout
+        response = super(TransportAdapter, self).send(request, **kwargs)
+        retries = getattr(response.raw, 'retries', None)
+        on_response(retries=(len(retries.history) if retries is not None else 0) +
+                    (response.status_code in RETRY_STATUSES))
+        return response
+
+
+def mount(session, pool_size, timeout, retries, backoff):
+    """Route a requests session's HTTP(S) traffic through a TransportAdapter
+
+    Sessions set up for mutual TLS keep their own adapter.
+
+    Keyword arguments:
+    session -- requests.Session (ex: the AuthorizedSession of a storage client)
+    pool_size, timeout, retries, backoff -- see TransportAdapter
+    """
+    if getattr(session, 'is_mtls', False):
+        return
+    adapter = TransportAdapter(pool_size, timeout, retries, backoff)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+def resolve_environment(session, url):
+    """Look up a session's proxies and CA bundle in the environment once, for requests to url's host
+
+    requests otherwise reads the whole environment on every request, which costs more CPU than
+    downloading a small object. Every storage request goes to the one host, so resolving it up
+    front gives the same settings.
+
+    Keyword arguments:
+    session -- requests.Session
+    url -- string URL of the host the session talks to (ex: the client's API_BASE_URL)
+    """
+    if session.trust_env is not True:
+        return  # Already resolved, or told not to use the environment
+    for (scheme, proxy) in get_environ_proxies(url).items():
+        session.proxies.setdefault(scheme, proxy)
+    if session.verify is True:
+        session.verify = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE') or True
+    session.trust_env = False
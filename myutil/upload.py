@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import mimetypes
+import os
+import threading
+import uuid
+from contextlib import closing
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+import myutil.exceptions
+from myutil import stats
+from myutil.gcp import (SLICED_DOWNLOAD_COMPONENTS, SLICED_DOWNLOAD_THRESHOLD,
+                        map_tasks, report_copied)
+
+# Component objects of a composite upload live here until they've been composed and deleted
+COMPONENT_PREFIX = '.myutil-composite-uploads/'
+# Most source objects a single compose request takes
+MAX_COMPOSE_COMPONENTS = 32
+
+
+def upload_files(path, bucket, prefix='', recursive=False, jobs=1, processes=False, **options):
+    """Upload a local file, or a directory's files, to a bucket
+
+    Keyword arguments:
+    path -- string filename or directory to upload
+    bucket -- bucket to upload into
+    prefix -- string destination. A file is uploaded as this name unless it's empty or ends with '/'.
+              A directory is uploaded under it, keeping its own name (dir/ becomes <prefix>/dir/...)
+    recursive -- upload a directory's files, in all of its subdirectories
+    jobs -- number of files to upload concurrently
+    processes -- use worker processes instead of threads when jobs > 1
+    options -- passed on to upload_file for every file (ex: slice_threshold, slices)
+    """
+    if os.path.isdir(path) and not recursive:
+        print('Omitting directory "file://{}". (Did you mean to do cp -r?)'.format(path))
+        raise myutil.exceptions.CommandException('No URLs matched')
+    if not os.path.exists(path):
+        raise myutil.exceptions.CommandException('No URLs matched: {}'.format(path))
+
+    tasks = list(plan_uploads(path, prefix))
+    if not tasks:
+        raise myutil.exceptions.CommandException('No URLs matched: {}'.format(path))
+    if not recursive:
+        (filename, name) = tasks[0]
+        print('Copying file://{}...'.format(filename))
+        (error, transfer) = (None, stats.begin(name))
+        try:
+            return upload_file(filename, bucket, name, **options)
+        except Exception as exc:
+            error = '{}: {}'.format(type(exc).__name__, exc)
+            raise
+        finally:
+            stats.record_transfer(bucket.name, stats.end(transfer, os.path.getsize(filename), error))
+    run_uploads(tasks, bucket, jobs=jobs, processes=processes, **options)
+
+
+def plan_uploads(path, prefix=''):
+    """Yield (filename, object name) for each file to upload, in name order
+
+    Keyword arguments:
+    path -- string filename or directory
+    prefix -- string destination (see upload_files)
+    """
+    if os.path.isfile(path):
+        if prefix and not prefix.endswith('/'):
+            yield (path, prefix)
+        else:
+            yield (path, prefix + os.path.basename(path))
+        return
+    base = _join(prefix, os.path.basename(os.path.normpath(path)))
+    for (root, dirs, files) in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            filename = os.path.join(root, name)
+            yield (filename, base + '/' + os.path.relpath(filename, path).replace(os.sep, '/'))
+
+
+def _join(prefix, name):
+    return prefix.rstrip('/') + '/' + name if prefix.rstrip('/') else name
+
+
+def run_uploads(tasks, bucket, jobs=1, processes=False, **options):
+    """Upload (filename, object name) pairs through a bounded worker pool
+
+    Like run_downloads, progress is printed in task order and failures are reported once every
+    task has been attempted.
+
+    Keyword arguments:
+    tasks -- list of (filename, object name) tuples
+    bucket -- bucket to upload into
+    jobs -- number of concurrent workers. 1 uploads in the calling thread
+    processes -- use worker processes (each with its own client) instead of threads
+    options -- passed on to upload_file for every file
+    """
+    errors = []
+    with closing(map_tasks(partial(_upload_task, options=options), tasks, bucket, jobs, processes)) as results:
+        for ((filename, name), (error, record)) in zip(tasks, results):
+            print('Copying file://{}...'.format(filename))
+            stats.record_transfer(bucket.name, record)
+            if error is not None:
+                errors.append(('file://{}'.format(filename), error))
+    report_copied(len(tasks), errors)
+
+
+def _upload_task(task, bucket, options={}):
+    """Upload a single (filename, object name) task, returning (error, transfer record)"""
+    (filename, name) = task
+    transfer = stats.begin(name)
+    size = None
+    try:
+        size = os.path.getsize(filename)
+        upload_file(filename, bucket, name, **options)
+    except Exception as exc:
+        error = '{}: {}'.format(type(exc).__name__, exc)
+        return (error, stats.end(transfer, size, error))
+    return (None, stats.end(transfer, size))
+
+
+def upload_file(filename, bucket, name, slice_threshold=SLICED_DOWNLOAD_THRESHOLD, slices=SLICED_DOWNLOAD_COMPONENTS):
+    """Upload a local file as a GCP blob object
+
+    Keyword arguments:
+    filename -- string filename to upload
+    bucket -- bucket to upload into
+    name -- string object name
+    slice_threshold -- files at least this big are uploaded as `slices` concurrent components (0 disables)
+    slices -- number of components for a composite upload
+    """
+    size = os.path.getsize(filename)
+    if slice_threshold and size >= slice_threshold and slices > 1:
+        return upload_composite(filename, bucket, name, slices=slices)
+    bucket.blob(name).upload_from_filename(filename)
+
+
+def upload_composite(filename, bucket, name, slices=SLICED_DOWNLOAD_COMPONENTS):
+    """Upload a file as concurrent component objects, composed into one object server-side
+
+    The components are deleted once composed, or if the upload fails. Composite objects
+    have a crc32c checksum but no md5.
+
+    Keyword arguments:
+    filename -- string filename to upload
+    bucket -- bucket to upload into
+    name -- string object name
+    slices -- number of components to upload concurrently
+    """
+    size = os.path.getsize(filename)
+    component_size = max(-(-size // slices), 1)
+    ranges = [(start, min(start + component_size, size)) for start in range(0, size, component_size)] or [(0, 0)]
+    component_prefix = '{}{}/'.format(COMPONENT_PREFIX, uuid.uuid4().hex)
+    components = [bucket.blob('{}{}'.format(component_prefix, index)) for index in range(len(ranges))]
+    cancelled = threading.Event()
+
+    def _upload_component(index):
+        with open(filename, 'rb') as f:
+            (start, end) = ranges[index]
+            components[index].upload_from_file(_FileRange(f, start, end, cancelled), size=end - start)
+
+    try:
+        pool = ThreadPool(len(ranges))
+        try:
+            for _ in pool.imap_unordered(stats.bind(_upload_component), range(len(ranges))):
+                pass
+        except BaseException:
+            # Stop the other components rather than waiting for them to finish
+            cancelled.set()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+
+        destination = bucket.blob(name)
+        destination.content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        destination.compose(components[:MAX_COMPOSE_COMPONENTS])
+        for start in range(MAX_COMPOSE_COMPONENTS, len(components), MAX_COMPOSE_COMPONENTS - 1):
+            destination.compose([destination] + components[start:start + MAX_COMPOSE_COMPONENTS - 1])
+    finally:
+        _delete_components(bucket, components, component_prefix)
+
+
+def _delete_components(bucket, components, component_prefix):
+    """Delete the component objects of a composite upload, warning about any left behind"""
+    try:
+        bucket.delete_blobs(components, on_error=lambda blob: None)  # Components that never got uploaded
+    except Exception as exc:
+        print('Failed to delete temporary components gs://{}/{}: {}: {}'.format(
+            bucket.name, component_prefix, type(exc).__name__, exc))
+
+
+class _FileRange(object):
+    """Read-only file-like view of a byte range of a file, positioned from 0 like a file of its own
+
+    Uploads check the stream's position against what they've sent, so the range can't just be
+    a seek into the whole file. Reads fail once `cancelled` is set.
+    """
+
+    def __init__(self, f, start, end, cancelled):
+        self.f = f
+        self.start = start
+        self.end = end
+        self.cancelled = cancelled
+        f.seek(start)
+
+    def read(self, size=-1):
+        if self.cancelled.is_set():
+            raise myutil.exceptions.CommandException('Upload cancelled')
+        remaining = max(self.end - self.f.tell(), 0)
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self.f.read(size)
+
+    def tell(self):
+        return self.f.tell() - self.start
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self.f.seek(self.start + offset)
+        elif whence == os.SEEK_CUR:
+            self.f.seek(offset, os.SEEK_CUR)
+        else:
+            self.f.seek(self.end + offset)
+        return self.tell()
@@ -41,8 +41,7 @@ setup(
         'console_scripts': ['myutil=myutil.cli:cli'],
     },
     install_requires=[
-        'google-cloud-storage',
-        'anytree',
+        'google-cloud-storage>=3',
         'click',
     ],
 
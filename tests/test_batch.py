@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import google.auth.credentials
+import mock
+import pytest
+import requests
+
+import myutil.exceptions
+from myutil.batch import (BATCH_SIZE, format_stat, remove_blobs, run_batches,
+                          select_blobs, stat_blobs)
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+class TestBlob():
+
+    @staticmethod
+    def _make_one(*args, **kw):
+        from google.cloud.storage.blob import Blob
+
+        properties = kw.pop('properties', {})
+        blob = Blob(*args, **kw)
+        blob._properties.update(properties)
+        return blob
+
+
+def _response(status, body=b'{}'):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    return response
+
+
+class FakeBatch(object):
+    """Stands in for a storage Batch, answering each call with the next status"""
+
+    def __init__(self, statuses, sizes):
+        self.statuses = statuses
+        self.sizes = sizes
+        self.calls = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.finish(raise_exception=False)
+
+    def finish(self, raise_exception=True):
+        self.sizes.append(self.calls)
+        return [_response(self.statuses.pop(0), b'{"error": {"message": "No such object"}}')
+                for _ in range(self.calls)]
+
+
+def test_run_batches_groups_calls_and_reports_each_error():
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [TestBlob()._make_one(bucket=bucket, name=str(index)) for index in range(BATCH_SIZE + 5)]
+    (statuses, sizes, batches) = ([204] * (BATCH_SIZE + 4) + [404], [], [])
+
+    def batch(raise_exception=True):
+        batches.append(FakeBatch(statuses, sizes))
+        return batches[-1]
+
+    bucket.client.batch = batch
+
+    def call(blob):
+        batches[-1].calls += 1
+
+    results = list(run_batches(call, blobs))
+    assert sizes == [BATCH_SIZE, 5]
+    assert [blob for (blob, error) in results] == blobs
+    assert [error for (blob, error) in results if error] == ['NotFound: 404 No such object']
+
+
+def test_run_batches_with_a_real_batch():
+    # Per-call outcomes come from what Batch.finish returns, so this fails if that changes
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud.storage import Client
+
+    client = Client(project='project', credentials=AnonymousCredentials())
+    bucket = client.bucket('bucket')
+    blobs = [bucket.blob('1.txt'), bucket.blob('missing.txt')]
+    parts = [
+        '--batch\r\nContent-Type: application/http\r\n\r\nHTTP/1.1 200 OK\r\n'
+        'Content-Type: application/json\r\n\r\n{"name": "1.txt", "size": "5"}\r\n',
+        '--batch\r\nContent-Type: application/http\r\n\r\nHTTP/1.1 404 Not Found\r\n'
+        'Content-Type: application/json\r\n\r\n{"error": {"message": "No such object"}}\r\n',
+    ]
+    response = _response(200, ''.join(parts + ['--batch--\r\n']).encode('utf-8'))
+    response.headers['content-type'] = 'multipart/mixed; boundary=batch'
+    with mock.patch.object(client._base_connection, '_make_request', return_value=response):
+        results = list(run_batches(lambda blob: blob.reload(), blobs))
+    assert results == [(blobs[0], None), (blobs[1], 'NotFound: 404 No such object')]
+    assert blobs[0].size == 5
+
+
+def test_select_blobs():
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [TestBlob()._make_one(bucket=bucket, name=name) for name in ('a', 'a/1.txt', 'ab')]
+    assert [blob.name for blob in select_blobs(blobs, 'a/')] == ['a', 'a/1.txt']
+    assert [blob.name for blob in select_blobs(blobs, '')] == ['a', 'a/1.txt', 'ab']
+
+
+def test_remove_blobs_reports_failures(capsys):
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [TestBlob()._make_one(bucket=bucket, name=name) for name in ('1.txt', '2.txt')]
+    with mock.patch('myutil.batch.run_batches', return_value=[(blobs[0], None), (blobs[1], 'NotFound: 404')]):
+        with pytest.raises(myutil.exceptions.CommandException):
+            remove_blobs(blobs)
+    assert capsys.readouterr().out == ('Removing gs://bucket/1.txt...\nRemoving gs://bucket/2.txt...\n'
+                                       'Removed 1 of 2 objects.\nFailed gs://bucket/2.txt: NotFound: 404\n')
+
+
+def test_format_stat():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='1.txt', properties={
+        'size': '3', 'contentType': 'text/plain', 'crc32c': 'AAAAAA==', 'generation': '7',
+        'updated': datetime.datetime(2019, 1, 2, 3, 4, 5).strftime('%Y-%m-%dT%H:%M:%S.000Z')})
+    assert format_stat(blob) == ('gs://bucket/1.txt:\n'
+                                 '    Update time:            Wed, 02 Jan 2019 03:04:05 GMT\n'
+                                 '    Content-Length:         3\n'
+                                 '    Content-Type:           text/plain\n'
+                                 '    Hash (crc32c):          AAAAAA==\n'
+                                 '    Generation:             7')
+
+
+def test_stat_blobs_in_order(capsys):
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [TestBlob()._make_one(bucket=bucket, name=name) for name in ('1.txt', 'copy/2.txt', '3.txt')]
+    fetched = [(blobs[0], None), (blobs[2], 'NotFound: 404')]
+    with mock.patch('myutil.batch.run_batches', return_value=fetched) as run_batches:
+        with pytest.raises(myutil.exceptions.CommandException):
+            stat_blobs(blobs, listed=[blobs[1]])
+        # Listed objects aren't fetched again
+        assert run_batches.call_args[0][1] == [blobs[0], blobs[2]]
+    assert capsys.readouterr().out.splitlines() == [
+        'gs://bucket/1.txt:', 'gs://bucket/copy/2.txt:', 'Failed gs://bucket/3.txt: NotFound: 404',
+    ]
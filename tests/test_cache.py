@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import google.auth.credentials
+import mock
+
+from myutil.cache import CachedBucket, ListingCache, cached_bucket
+from myutil.gcp import list_level, render_pages
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+class TestBlob():
+
+    @staticmethod
+    def _make_one(*args, **kw):
+        from google.cloud.storage.blob import Blob
+
+        properties = kw.pop('properties', {})
+        blob = Blob(*args, **kw)
+        blob._properties.update(properties)
+        return blob
+
+
+def _blobs(bucket, names, generation=1):
+    return [TestBlob()._make_one(bucket=bucket, name=name, properties={'size': '5', 'generation': str(generation)})
+            for name in names]
+
+
+def test_refresh_and_list(tmpdir):
+    cache = ListingCache(path=str(tmpdir.join('cache.sqlite')))
+    bucket = TestClient()._make_one(name='bucket')
+    pages = [_blobs(bucket, ['a/1.txt', 'a/b/2.txt']), _blobs(bucket, ['a/c.txt', 'x.txt'])]
+    assert cache.refresh(bucket.name, '', pages) == {'added': 4, 'updated': 0, 'removed': 0}
+    assert cache.find('bucket', 'a/') == ''
+    assert cache.find('other', 'a/') is None
+
+    cached = CachedBucket(cache, 'bucket', '')
+    assert [blob.name for blob in cached.list_blobs(prefix='a/')] == ['a/1.txt', 'a/b/2.txt', 'a/c.txt']
+    assert list(list_level(cached, 'a')) == [['gs://bucket/a/1.txt', 'gs://bucket/a/b/', 'gs://bucket/a/c.txt']]
+    assert list(render_pages(cached.list_blobs(prefix='a/').pages, 'a/')) == [['1.txt', 'b/', '    2.txt', 'c.txt']]
+
+
+def test_refresh_is_incremental(tmpdir):
+    cache = ListingCache(path=str(tmpdir.join('cache.sqlite')))
+    bucket = TestClient()._make_one(name='bucket')
+    cache.refresh(bucket.name, 'a/', [_blobs(bucket, ['a/1.txt', 'a/2.txt']), _blobs(bucket, ['a/3.txt', 'a/4.txt'])])
+    pages = [
+        _blobs(bucket, ['a/1.txt']) + _blobs(bucket, ['a/2.txt'], generation=2),
+        _blobs(bucket, ['a/2b.txt', 'a/3.txt']),
+    ]
+    assert cache.refresh(bucket.name, 'a/', pages) == {'added': 1, 'updated': 1, 'removed': 1}
+    blobs = list(CachedBucket(cache, 'bucket', 'a/').list_blobs(prefix='a/'))
+    assert [(blob.name, blob.generation) for blob in blobs] == [
+        ('a/1.txt', 1), ('a/2.txt', 2), ('a/2b.txt', 1), ('a/3.txt', 1)]
+
+
+def test_ttl(tmpdir):
+    cache = ListingCache(path=str(tmpdir.join('cache.sqlite')), ttl=60)
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch('time.time', return_value=1000):
+        cache.refresh(bucket.name, '', [_blobs(bucket, ['1.txt'])])
+    with mock.patch('time.time', return_value=1059):
+        assert cache.find('bucket', '') == ''
+    with mock.patch('time.time', return_value=1061):
+        assert cache.find('bucket', '') is None
+        cache.evict()
+    assert cache.db.execute('SELECT count(*) FROM objects').fetchone() == (0,)
+
+
+def test_evicts_least_recently_used(tmpdir):
+    cache = ListingCache(path=str(tmpdir.join('cache.sqlite')), max_objects=3)
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch('time.time', return_value=1000):
+        cache.refresh(bucket.name, 'a/', [_blobs(bucket, ['a/1.txt', 'a/2.txt'])])
+    with mock.patch('time.time', return_value=1001):
+        cache.refresh(bucket.name, 'b/', [_blobs(bucket, ['b/1.txt'])])
+    with mock.patch('time.time', return_value=1002):
+        cache.find('bucket', 'a/')
+        cache.refresh(bucket.name, 'c/', [_blobs(bucket, ['c/1.txt'])])
+        assert cache.find('bucket', 'a/') == 'a/'
+        assert cache.find('bucket', 'b/') is None
+        assert cache.find('bucket', 'c/') == 'c/'
+
+
+def test_clear(tmpdir):
+    cache = ListingCache(path=str(tmpdir.join('cache.sqlite')))
+    bucket = TestClient()._make_one(name='bucket')
+    cache.refresh(bucket.name, 'a/', [_blobs(bucket, ['a/1.txt'])])
+    cache.refresh(bucket.name, 'b/', [_blobs(bucket, ['b/1.txt'])])
+    cache.clear('bucket', 'a')
+    assert cache.find('bucket', 'a/') is None
+    assert cache.find('bucket', 'b/') == 'b/'
+    cache.clear()
+    assert cache.find('bucket', 'b/') is None
+
+
+def test_cached_bucket_lists_on_miss_only(tmpdir):
+    cache = ListingCache(path=str(tmpdir.join('cache.sqlite')))
+    bucket = TestClient()._make_one(name='bucket')
+    listing = mock.Mock(pages=[_blobs(bucket, ['a/1.txt'])])
+    with mock.patch.object(bucket, 'list_blobs', return_value=listing) as list_blobs, \
+            mock.patch('myutil.cache.get_bucket', return_value=bucket) as get_bucket:
+        cached_bucket(cache, 'bucket', 'a/')
+        cached = cached_bucket(cache, 'bucket', 'a/1')
+        assert list_blobs.call_count == 1
+        cached_bucket(cache, 'bucket', 'a/', refresh=True)
+        assert list_blobs.call_count == 2
+        get_bucket.assert_called_with('bucket')
+    assert [blob.name for blob in cached.list_blobs(prefix='a/1')] == ['a/1.txt']
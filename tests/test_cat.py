@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import io
+from multiprocessing.pool import ThreadPool
+
+import google.auth.credentials
+import mock
+import pytest
+
+import myutil.exceptions
+from myutil.cat import cat_blobs, read_chunks, resolve_range, write_decoded
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+class TestBlob():
+
+    @staticmethod
+    def _make_one(*args, **kw):
+        from google.cloud.storage.blob import Blob
+
+        properties = kw.pop('properties', {})
+        blob = Blob(*args, **kw)
+        blob._properties.update(properties)
+        return blob
+
+
+DATA = b''.join(bytes(bytearray([index % 256])) for index in range(1000))
+
+
+def _download_as_bytes(blob, start=None, end=None, checksum='auto'):
+    return DATA[start:end + 1]
+
+
+def test_resolve_range():
+    assert resolve_range(None, 100) == (0, 100)
+    assert resolve_range((10, 20), 100) == (10, 20)
+    assert resolve_range((10, None), 100) == (10, 100)
+    assert resolve_range((-5, None), 100) == (95, 100)
+    assert resolve_range((-500, None), 100) == (0, 100)
+    assert resolve_range((200, 300), 100) == (100, 100)
+
+
+def test_read_chunks_reads_ahead_in_order():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='1.bin', properties={'size': str(len(DATA))})
+    pool = ThreadPool(2)
+    with mock.patch('google.cloud.storage.blob.Blob.download_as_bytes', autospec=True,
+                    side_effect=_download_as_bytes) as download:
+        chunks = list(read_chunks(blob, (100, 950), chunk_size=128, pool=pool, read_ahead=2))
+    pool.close()
+    pool.join()
+    assert b''.join(chunks) == DATA[100:950]
+    assert [len(chunk) for chunk in chunks] == [128] * 6 + [82]
+    assert sorted(c[1]['start'] for c in download.call_args_list) == list(range(100, 950, 128))
+
+
+def test_cat_blobs_writes_each_object():
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [TestBlob()._make_one(bucket=bucket, name=name, properties={'size': str(len(DATA))})
+             for name in ('1.bin', '2.bin')]
+    stream = io.BytesIO()
+    with mock.patch('google.cloud.storage.blob.Blob.download_as_bytes', autospec=True,
+                    side_effect=_download_as_bytes):
+        cat_blobs(blobs, stream, byte_range=(-10, None), chunk_size=4)
+    assert stream.getvalue() == DATA[-10:] * 2
+
+
+def test_cat_blobs_short_read():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='1.bin', properties={'size': '2000'})
+    with mock.patch('google.cloud.storage.blob.Blob.download_as_bytes', autospec=True,
+                    side_effect=_download_as_bytes):
+        with pytest.raises(myutil.exceptions.CommandException):
+            cat_blobs([blob], io.BytesIO(), chunk_size=512)
+
+
+def _download_decoded(file_obj, checksum='auto'):
+    # Decompressed content arrives in pieces of whatever size
+    for start in range(0, len(DATA), 300):
+        file_obj.write(DATA[start:start + 300])
+
+
+@pytest.mark.parametrize('byte_range,expected', [
+    (None, DATA), ((100, 950), DATA[100:950]), ((250, None), DATA[250:]), ((-10, None), DATA[-10:]),
+    ((0, 300), DATA[:300]),
+])
+def test_write_decoded(byte_range, expected):
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='1.json', properties={'size': '10', 'contentEncoding': 'gzip'})
+    stream = io.BytesIO()
+    with mock.patch.object(blob, 'download_to_file', side_effect=_download_decoded) as download:
+        write_decoded(blob, stream, byte_range)
+        assert download.call_args[1] == {'checksum': None}
+    assert stream.getvalue() == expected
+
+
+def test_cat_blobs_gzip_encoded_is_one_stream():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='1.json', properties={'size': '10', 'contentEncoding': 'gzip'})
+    stream = io.BytesIO()
+    with mock.patch.object(blob, 'download_to_file', side_effect=_download_decoded):
+        with mock.patch('google.cloud.storage.blob.Blob.download_as_bytes') as download_as_bytes:
+            cat_blobs([blob], stream, chunk_size=4)
+            assert not download_as_bytes.called
+    assert stream.getvalue() == DATA
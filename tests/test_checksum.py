@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import google.auth.credentials
+import google_crc32c
+import mock
+import pytest
+
+from myutil.checksum import (blob_algorithm, combine, crc32c_combine,
+                             download_algorithm, file_checksum, new_hasher)
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+class TestBlob():
+
+    @staticmethod
+    def _make_one(*args, **kw):
+        from google.cloud.storage.blob import Blob
+
+        properties = kw.pop('properties', {})
+        blob = Blob(*args, **kw)
+        blob._properties.update(properties)
+        return blob
+
+
+def test_file_checksum(tmpdir):
+    path = tmpdir.join('1.txt')
+    path.write(b'hello', mode='wb')
+    assert file_checksum(str(path), 'md5') == 'XUFAKrxLKna5cZ2REBfFkg=='
+    assert file_checksum(str(path), 'crc32c') == 'mnG7TA=='
+
+
+def test_new_hasher_unknown_algorithm():
+    with pytest.raises(ValueError):
+        new_hasher('sha1')
+
+
+def test_blob_algorithm():
+    bucket = TestClient()._make_one(name='bucket')
+    both = TestBlob()._make_one(bucket=bucket, name='1.txt', properties={'crc32c': 'mnG7TA==', 'md5Hash': 'x'})
+    composite = TestBlob()._make_one(bucket=bucket, name='2.txt', properties={'crc32c': 'mnG7TA=='})
+    neither = TestBlob()._make_one(bucket=bucket, name='3.txt')
+    assert blob_algorithm(both) == 'crc32c'
+    assert blob_algorithm(composite) == 'crc32c'
+    assert blob_algorithm(neither) is None
+    with mock.patch('myutil.checksum.google_crc32c', None):
+        assert blob_algorithm(both) == 'md5'
+        assert blob_algorithm(composite) is None
+
+
+def test_crc32c_combine():
+    for (first, second) in [(b'hello ', b'world'), (b'', b'x' * 70000), (b'abc', b''), (b'\x00' * 5, b'\xff' * 9)]:
+        assert crc32c_combine(google_crc32c.value(first), google_crc32c.value(second), len(second)) == \
+            google_crc32c.value(first + second)
+
+
+def test_combine():
+    parts = []
+    for chunk in (b'hel', b'lo'):
+        hasher = new_hasher('crc32c')
+        hasher.update(chunk)
+        parts.append((hasher, len(chunk)))
+    assert combine(parts, 'crc32c') == 'mnG7TA=='
+    with pytest.raises(ValueError):
+        combine([(new_hasher('md5'), 1), (new_hasher('md5'), 1)], 'md5')
+
+
+def test_download_algorithm():
+    bucket = TestClient()._make_one(name='bucket')
+    both = TestBlob()._make_one(bucket=bucket, name='1.txt', properties={'crc32c': 'mnG7TA==', 'md5Hash': 'x'})
+    composite = TestBlob()._make_one(bucket=bucket, name='2.txt', properties={'crc32c': 'mnG7TA=='})
+    assert download_algorithm(both, 'none') is None
+    assert download_algorithm(both, 'md5') == 'md5'
+    assert download_algorithm(composite, 'md5') == 'crc32c'
+    with mock.patch('myutil.checksum.google_crc32c.implementation', 'c'):
+        assert download_algorithm(both) == 'crc32c'
+    with mock.patch('myutil.checksum.google_crc32c.implementation', 'python'):
+        assert download_algorithm(both) == 'md5'
+        assert download_algorithm(both, sliced=True) == 'crc32c'
+    with mock.patch('myutil.checksum.google_crc32c', None):
+        assert download_algorithm(composite) is None
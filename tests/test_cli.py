@@ -128,3 +128,14 @@ def test_cp_no_blobs_nonrecursive():
         assert str(result.exception) == 'No URLs matched: gs://foo/a/_'
         assert result.output == ''
         assert not download_blobs.called
+
+
+def test_ls_recursive_skips_siblings_of_the_prefix():
+    from myutil.cli import ls
+    bucket = TestClient()._make_one(name='b')
+    blobs = [bucket.blob(name) for name in ['a-x.txt', 'a/1.txt', 'a/c/2.txt', 'ab/4.txt']]
+    with mock.patch('myutil.cli.get_bucket', return_value=bucket):
+        with mock.patch.object(bucket, 'list_blobs', return_value=mock.Mock(pages=iter([blobs]))):
+            result = CliRunner().invoke(ls, ['-r', 'gs://b/a'])
+    assert result.exit_code == 0
+    assert result.output == 'a/\n    1.txt\n    c/\n        2.txt\n'
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+
+import mock
+
+import myutil.client
+
+
+def test_importing_cli_skips_google_cloud_storage():
+    # In a fresh interpreter, as this one has long since imported it
+    code = 'import sys, myutil.cli; print("google.cloud.storage" in sys.modules)'
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'False'
+
+
+def test_get_client_is_shared():
+    with mock.patch.object(myutil.client, '_client', None), \
+            mock.patch('google.cloud.storage.Client') as client:
+        assert myutil.client.get_client() is myutil.client.get_client()
+        assert client.call_count == 1
+        assert myutil.client.get_bucket('bucket') == client.return_value.bucket.return_value
+        client.return_value.bucket.assert_called_with('bucket')
+
+
+def test_new_client_is_not_shared():
+    with mock.patch('google.cloud.storage.Client') as client:
+        myutil.client.new_client()
+        myutil.client.new_client()
+        assert client.call_count == 2
+
+
+def test_new_client_mounts_transport():
+    settings = myutil.client.get_settings()
+    with mock.patch.dict(myutil.client._settings), \
+            mock.patch('google.cloud.storage.Client') as client, \
+            mock.patch('myutil.transport.mount') as mount:
+        myutil.client.configure(workers=64, timeout=5)
+        myutil.client.new_client()
+        mount.assert_called_once_with(client.return_value._http, pool_size=64, timeout=5,
+                                      retries=settings['retries'], backoff=settings['backoff'])
+        myutil.client.configure(pool_size=4, workers=1)
+        myutil.client.new_client()
+        assert mount.call_args[1]['pool_size'] == 4
+        myutil.client.configure(pool_size=None)
+        myutil.client.new_client()
+        assert mount.call_args[1]['pool_size'] == myutil.client.DEFAULT_POOL_SIZE
+    assert myutil.client.get_settings() == settings
+
+
+def test_configure_updates_shared_client():
+    with mock.patch.dict(myutil.client._settings), \
+            mock.patch.object(myutil.client, '_client', mock.Mock()) as shared, \
+            mock.patch('myutil.transport.mount') as mount:
+        myutil.client.configure(workers=32)
+        assert mount.call_args[0] == (shared._http,)
+        assert mount.call_args[1]['pool_size'] == 32
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
+import json
+
 import google.auth.credentials
 import google.cloud.storage.blob
 import mock
 import pytest
 from mock import call
 
+import myutil.checksum
 import myutil.exceptions
-from myutil.gcp import download_blobs, tree_from_list
+import myutil.stats
+from myutil.gcp import (disk_usage, download_blobs, list_level, list_matches,
+                        render_pages, render_tree, tree_from_list)
 
 
 class TestClient:
@@ -35,12 +40,19 @@ class TestBlob():
         return blob
 
 
+class FakePage(list):
+
+    def __init__(self, blobs, prefixes=()):
+        super(FakePage, self).__init__(blobs)
+        self.prefixes = tuple(prefixes)
+
+
 def test_download_blob():
     bucket = TestClient()._make_one(name='bucket')
     blob = TestBlob()._make_one(bucket=bucket, name='1.txt')
     with mock.patch.object(blob, 'download_to_filename') as download_to_filename:
         myutil.gcp.download_blob(blob, '1.txt')
-        download_to_filename.assert_has_calls([call('1.txt')])
+        download_to_filename.assert_has_calls([call('1.txt', checksum=None)])
 
 
 def test_download_blob_to_dir_exists():
@@ -49,7 +61,7 @@ def test_download_blob_to_dir_exists():
     with mock.patch('os.path.isdir', return_value=True):
         with mock.patch.object(blob, 'download_to_filename') as download_to_filename:
             myutil.gcp.download_blob(blob, 'asdf/')
-            download_to_filename.assert_has_calls([call('asdf/1.txt')])
+            download_to_filename.assert_has_calls([call('asdf/1.txt', checksum=None)])
 
 
 def test_download_blob_to_dir_dne():
@@ -122,6 +134,136 @@ def test_download_blobs_single_blob_dir_exists():
                     assert not mkdir_p.called
 
 
+def test_download_blobs_multiple_blobs_parallel():
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch('myutil.gcp.mkdir_p'):
+        with mock.patch('os.path.isdir', return_value=True):
+            with mock.patch('myutil.gcp.download_blob', return_value=None) as download_blob:
+                blobs = [
+                    TestBlob()._make_one(bucket=bucket, name='a/1.txt'),
+                    TestBlob()._make_one(bucket=bucket, name='a/b/2.txt'),
+                ]
+                download_blobs(blobs=blobs, dir='localdir', prefix='a', recursive=True, jobs=4)
+                download_blob.assert_has_calls([
+                    call(blobs[0], 'localdir/a/1.txt', quiet=True),
+                    call(blobs[1], 'localdir/a/b/2.txt', quiet=True),
+                ], any_order=True)
+
+
+def test_download_blobs_sibling_directories():
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch('myutil.gcp.mkdir_p') as mkdir_p:
+        with mock.patch('os.path.isdir', return_value=True):
+            with mock.patch('myutil.gcp.download_blob', return_value=None) as download_blob:
+                blobs = [
+                    TestBlob()._make_one(bucket=bucket, name='x/a/b/1.txt'),
+                    TestBlob()._make_one(bucket=bucket, name='x/a/b/2.txt'),
+                    TestBlob()._make_one(bucket=bucket, name='x/a/c/'),
+                    TestBlob()._make_one(bucket=bucket, name='x/a/c/3.txt'),
+                    TestBlob()._make_one(bucket=bucket, name='x/ab/4.txt'),
+                ]
+                download_blobs(blobs=blobs, dir='./localdir', prefix='x/a/', recursive=True)
+                assert download_blob.call_args_list == [
+                    call(blobs[0], './localdir/a/b/1.txt', quiet=True),
+                    call(blobs[1], './localdir/a/b/2.txt', quiet=True),
+                    call(blobs[3], './localdir/a/c/3.txt', quiet=True),
+                ]
+                assert mkdir_p.call_args_list == [call('./localdir/a/b'), call('./localdir/a/c')]
+
+
+def test_download_blobs_wildcard():
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch('myutil.gcp.mkdir_p'):
+        with mock.patch('os.path.isdir', return_value=True):
+            with mock.patch('myutil.gcp.download_blob', return_value=None) as download_blob:
+                blobs = [
+                    TestBlob()._make_one(bucket=bucket, name='logs/01/1.gz'),
+                    TestBlob()._make_one(bucket=bucket, name='logs/01/a/2.gz'),
+                    TestBlob()._make_one(bucket=bucket, name='logs/02.gz'),
+                ]
+                download_blobs(blobs=blobs, dir='localdir', prefix='logs/0*', recursive=True)
+                assert download_blob.call_args_list == [
+                    call(blobs[0], 'localdir/01/1.gz', quiet=True),
+                    call(blobs[1], 'localdir/01/a/2.gz', quiet=True),
+                    call(blobs[2], 'localdir/02.gz', quiet=True),
+                ]
+
+
+def test_download_blobs_no_blobs_under_prefix():
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch('myutil.gcp.mkdir_p'):
+        with mock.patch('os.path.isdir', return_value=True):
+            with mock.patch('myutil.gcp.download_blob', return_value=None) as download_blob:
+                blobs = [
+                    TestBlob()._make_one(bucket=bucket, name='ab/1.txt'),
+                    TestBlob()._make_one(bucket=bucket, name='ab/2.txt'),
+                ]
+                with pytest.raises(myutil.exceptions.CommandException):
+                    download_blobs(blobs=blobs, dir='localdir', prefix='a', recursive=True)
+                assert not download_blob.called
+
+
+def test_run_downloads_collects_errors(capsys):
+    bucket = TestClient()._make_one(name='bucket')
+    tasks = [
+        (TestBlob()._make_one(bucket=bucket, name='a/{}.txt'.format(index)), 'localdir/a/{}.txt'.format(index))
+        for index in range(1, 4)
+    ]
+
+    def _fail_second(blob, filename, quiet):
+        if blob.name == 'a/2.txt':
+            raise Exception('connection reset')
+
+    with mock.patch('myutil.gcp.download_blob', side_effect=_fail_second) as download_blob:
+        with pytest.raises(myutil.exceptions.CommandException) as excinfo:
+            myutil.gcp.run_downloads(tasks, bucket, jobs=2)
+        assert download_blob.call_count == 3
+    assert str(excinfo.value) == '1 object(s) failed to copy'
+    out = capsys.readouterr().out
+    assert out.splitlines() == [
+        'Copying gs://bucket/a/1.txt...',
+        'Copying gs://bucket/a/2.txt...',
+        'Copying gs://bucket/a/3.txt...',
+        'Copied 2 of 3 objects.',
+        'Failed gs://bucket/a/2.txt: Exception: connection reset',
+    ]
+
+
+def test_run_downloads_records_transfers(tmpdir):
+    bucket = TestClient()._make_one(name='bucket')
+    tasks = [(TestBlob()._make_one(bucket=bucket, name=name, properties={'size': '10'}), name)
+             for name in ['1.txt', '2.txt']]
+
+    def _download(blob, filename, quiet):
+        myutil.stats.on_response(retries=1 if blob.name == '2.txt' else 0)
+        if blob.name == '2.txt':
+            raise Exception('connection reset')
+
+    trace = str(tmpdir.join('trace.jsonl'))
+    with myutil.stats.recording('cp', trace=trace):
+        with mock.patch('myutil.gcp.download_blob', side_effect=_download):
+            with pytest.raises(myutil.exceptions.CommandException):
+                myutil.gcp.run_downloads(tasks, bucket, jobs=2)
+    events = [json.loads(line) for line in open(trace)]
+    assert [(event['event'], event.get('name'), event.get('retries')) for event in events] == [
+        ('transfer', 'gs://bucket/1.txt', 0),
+        ('transfer', 'gs://bucket/2.txt', 1),
+        ('summary', None, 1),
+    ]
+    assert events[0]['bytes'] == 10 and events[0]['requests'] == 1 and events[0]['error'] is None
+    assert events[1]['error'] == 'Exception: connection reset'
+    assert (events[2]['objects'], events[2]['failed'], events[2]['bytes']) == (2, 1, 10)
+
+
+def test_download_from_bucket_pins_generation():
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch('myutil.gcp.download_blob', return_value=None) as download_blob:
+        myutil.gcp.download_from_bucket(name='a/1.txt', bucket=bucket, filename='1.txt', generation=7)
+        blob = download_blob.call_args[1]['blob']
+        assert blob.name == 'a/1.txt'
+        assert blob.generation == 7
+
+
 def test_tree_from_list():
     bucket = TestClient()._make_one(name='bucket')
     blob = TestBlob()._make_one(bucket=bucket, name='1.txt')
@@ -130,3 +272,379 @@ def test_tree_from_list():
     assert root_node.children[0].name == '1.txt'
     assert len(root_node.children) == 1
     assert root_node.depth == 0
+
+
+def test_tree_from_list_sibling_directories():
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [
+        TestBlob()._make_one(bucket=bucket, name='a/1.txt'),
+        TestBlob()._make_one(bucket=bucket, name='b/2.txt'),
+        TestBlob()._make_one(bucket=bucket, name='a/c/3.txt'),
+    ]
+    root_node = tree_from_list(blobs=blobs)
+    assert [child.name for child in root_node.children] == ['a', 'b']
+    (a, b) = root_node.children
+    assert [(child.name, child.is_leaf) for child in a.children] == [('1.txt', True), ('c', False)]
+    assert [(child.name, child.depth, child.is_leaf) for child in a.children[1].children] == [('3.txt', 3, True)]
+    assert [(child.name, child.is_leaf) for child in b.children] == [('2.txt', True)]
+
+
+def test_tree_from_list_strips_prefix():
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [
+        TestBlob()._make_one(bucket=bucket, name='a/b/1.txt'),
+        TestBlob()._make_one(bucket=bucket, name='a/b/c/2.txt'),
+    ]
+    root_node = tree_from_list(blobs=blobs, prefix='a/')
+    assert root_node.name == 'a/'
+    assert [child.name for child in root_node.children] == ['b']
+
+
+def test_render_tree(capsys):
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [
+        TestBlob()._make_one(bucket=bucket, name='mydir/a/1.txt'),
+        TestBlob()._make_one(bucket=bucket, name='mydir/a/b/2.txt'),
+        TestBlob()._make_one(bucket=bucket, name='other.txt'),
+    ]
+    render_tree(tree_from_list(blobs=blobs, prefix=''))
+    assert capsys.readouterr().out.splitlines() == [
+        u'',
+        u'\u251c\u2500\u2500 mydir',
+        u'\u2502   \u2514\u2500\u2500 a',
+        u'\u2502       \u251c\u2500\u2500 1.txt',
+        u'\u2502       \u2514\u2500\u2500 b',
+        u'\u2502           \u2514\u2500\u2500 2.txt',
+        u'\u2514\u2500\u2500 other.txt',
+    ]
+
+
+def test_list_level():
+    bucket = TestClient()._make_one(name='bucket')
+    pages = [
+        FakePage([TestBlob()._make_one(bucket=bucket, name='a/1.txt')], prefixes=['a/b/']),
+        FakePage([TestBlob()._make_one(bucket=bucket, name='a/c.txt')]),
+    ]
+    with mock.patch.object(bucket, 'list_blobs', return_value=mock.Mock(pages=pages)) as list_blobs:
+        assert list(list_level(bucket, 'a/')) == [
+            ['gs://bucket/a/1.txt', 'gs://bucket/a/b/'],
+            ['gs://bucket/a/c.txt'],
+        ]
+        list_blobs.assert_has_calls([call(prefix='a/', delimiter='/')])
+
+
+def test_list_level_directory_without_slash():
+    bucket = TestClient()._make_one(name='bucket')
+    listings = {
+        'a': [FakePage([TestBlob()._make_one(bucket=bucket, name='ab.txt')], prefixes=['a/', 'ab/'])],
+        'a/': [FakePage([TestBlob()._make_one(bucket=bucket, name='a/1.txt')])],
+    }
+    with mock.patch.object(bucket, 'list_blobs', side_effect=lambda prefix, delimiter: mock.Mock(
+            pages=listings[prefix])):
+        assert list(list_level(bucket, 'a')) == [['gs://bucket/a/1.txt']]
+
+
+def test_list_level_object():
+    bucket = TestClient()._make_one(name='bucket')
+    pages = [FakePage([TestBlob()._make_one(bucket=bucket, name='a.txt')])]
+    with mock.patch.object(bucket, 'list_blobs', return_value=mock.Mock(pages=pages)) as list_blobs:
+        assert list(list_level(bucket, 'a.txt')) == [['gs://bucket/a.txt']]
+        assert list_blobs.call_count == 1
+
+
+def test_list_matches():
+    bucket = TestClient()._make_one(name='bucket')
+    pages = [
+        FakePage([TestBlob()._make_one(bucket=bucket, name=name) for name in ('a/01/1.txt', 'a/01/2.txt')]),
+        FakePage([TestBlob()._make_one(bucket=bucket, name=name) for name in ('a/01/3.txt', 'a/02', 'a/1x')],
+                 prefixes=['a/03/']),
+    ]
+    assert list(list_matches(pages, 'bucket', 'a/0?')) == [
+        ['gs://bucket/a/01/'],
+        ['gs://bucket/a/02', 'gs://bucket/a/03/'],
+    ]
+
+
+def test_disk_usage():
+    bucket = TestClient()._make_one(name='bucket')
+    sizes = [('d/a/1', 1), ('d/a/b/2', 2), ('d/a/b/3', 3), ('d/a/c/', 0), ('d/a/c/4', 4), ('d/e.txt', 5), ('d/f/6', 6)]
+    blobs = [TestBlob()._make_one(bucket=bucket, name=name, properties={'size': str(size)}) for (name, size) in sizes]
+    assert list(disk_usage([blobs[:3], blobs[3:]], 'd/')) == [
+        [],
+        [(5, 2, 'd/a/b/'), (4, 2, 'd/a/c/'), (10, 5, 'd/a/')],
+        [(6, 1, 'd/f/'), (21, 7, 'd/')],
+    ]
+    assert list(disk_usage([blobs], 'd', summarize=True)) == [[], [(21, 7, 'd')]]
+
+
+def test_render_pages():
+    bucket = TestClient()._make_one(name='bucket')
+    pages = [
+        [
+            TestBlob()._make_one(bucket=bucket, name='mydir/a'),
+            TestBlob()._make_one(bucket=bucket, name='mydir/a/1.txt'),
+        ],
+        [
+            TestBlob()._make_one(bucket=bucket, name='mydir/a/b/2.txt'),
+            TestBlob()._make_one(bucket=bucket, name='mydir/c.txt'),
+        ],
+    ]
+    assert list(render_pages(pages, 'mydir/')) == [
+        ['a', 'a/', '    1.txt'],
+        ['    b/', '        2.txt', 'c.txt'],
+    ]
+
+
+def _fake_range_download(content):
+    def download_to_file(file_obj, start=None, end=None, checksum='auto'):
+        file_obj.write(content[start:end + 1])
+    return download_to_file
+
+
+def test_download_blob_sliced_above_threshold():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties={'size': '100', 'generation': '3'})
+    with mock.patch('myutil.gcp.download_sliced') as download_sliced:
+        with mock.patch.object(blob, 'download_to_filename') as download_to_filename:
+            myutil.gcp.download_blob(blob, 'big.bin', slice_threshold=100, slices=4)
+            download_sliced.assert_has_calls([call(blob, 'big.bin', slices=4, checksum='auto')])
+            assert not download_to_filename.called
+
+
+def test_download_blob_not_sliced_below_threshold():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='small.bin', properties={'size': '99', 'generation': '3'})
+    with mock.patch('myutil.gcp.download_sliced') as download_sliced:
+        with mock.patch.object(blob, 'download_to_filename') as download_to_filename:
+            myutil.gcp.download_blob(blob, 'small.bin', slice_threshold=100, slices=4, resumable_threshold=0)
+            download_to_filename.assert_has_calls([call('small.bin', checksum=None)])
+            assert not download_sliced.called
+
+
+def test_download_blob_gzip_encoded_is_one_stream():
+    bucket = TestClient()._make_one(name='bucket')
+    properties = {'size': '100', 'generation': '3', 'contentEncoding': 'gzip'}
+    blob = TestBlob()._make_one(bucket=bucket, name='big.json', properties=properties)
+    with mock.patch('myutil.gcp.download_sliced') as download_sliced:
+        with mock.patch.object(blob, 'download_to_filename') as download_to_filename:
+            myutil.gcp.download_blob(blob, 'big.json', slice_threshold=10, slices=4, resumable_threshold=10)
+            download_to_filename.assert_has_calls([call('big.json', checksum=None)])
+            assert not download_sliced.called
+    assert myutil.gcp._listed_properties(blob)['contentEncoding'] == 'gzip'
+
+
+def test_download_blob_falls_back_to_the_checksum_the_object_has():
+    bucket = TestClient()._make_one(name='bucket')
+    # Composite objects have a crc32c but no md5
+    blob = TestBlob()._make_one(bucket=bucket, name='composite.bin', properties={'crc32c': 'AAAAAA=='})
+    with mock.patch.object(blob, 'download_to_filename') as download_to_filename:
+        myutil.gcp.download_blob(blob, 'composite.bin', checksum='md5')
+        download_to_filename.assert_has_calls([call('composite.bin', checksum='crc32c')])
+
+
+def test_download_sliced(tmpdir):
+    content = bytes(bytearray(range(256))) * 40
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin',
+                                properties={'size': str(len(content)), 'generation': '3'})
+    filename = str(tmpdir.join('big.bin'))
+    with mock.patch.object(blob, 'download_to_file', side_effect=_fake_range_download(content)) as download_to_file:
+        myutil.gcp.download_sliced(blob, filename, slices=3)
+        assert sorted((kwargs['start'], kwargs['end']) for (args, kwargs) in download_to_file.call_args_list) == [
+            (0, 3413), (3414, 6827), (6828, 10239),
+        ]
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+    assert tmpdir.listdir() == [tmpdir.join('big.bin')]
+
+
+def test_download_blob_resumable_above_threshold():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties={'size': '100', 'generation': '3'})
+    with mock.patch('myutil.gcp.download_sliced') as download_sliced:
+        myutil.gcp.download_blob(blob, 'big.bin', slice_threshold=0, resumable_threshold=100)
+        download_sliced.assert_has_calls([call(blob, 'big.bin', slices=1, checksum='auto')])
+
+
+def test_download_sliced_resumes(tmpdir):
+    content = bytes(bytearray(range(200)))
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties={'size': '200', 'generation': '3'})
+    filename = str(tmpdir.join('big.bin'))
+
+    # First attempt: the second slice drops after 30 bytes
+    def _interrupted(file_obj, start=None, end=None, checksum='auto'):
+        if start == 0:
+            file_obj.write(content[start:end + 1])
+        else:
+            file_obj.write(content[start:start + 30])
+            raise IOError('connection reset')
+
+    with mock.patch.object(blob, 'download_to_file', side_effect=_interrupted):
+        with pytest.raises(IOError):
+            myutil.gcp.download_sliced(blob, filename, slices=2)
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['big.bin.part', 'big.bin.part.tracker']
+    with open(filename + '.part.tracker') as f:
+        assert json.load(f) == {'generation': 3, 'size': 200, 'ranges': [[0, 100, 100], [100, 200, 30]]}
+
+    # Second attempt only fetches the rest of the second slice
+    with mock.patch.object(blob, 'download_to_file', side_effect=_fake_range_download(content)) as download_to_file:
+        myutil.gcp.download_sliced(blob, filename, slices=2)
+        assert download_to_file.call_count == 1
+        assert download_to_file.call_args[1] == {'start': 130, 'end': 199, 'checksum': None}
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+    assert tmpdir.listdir() == [tmpdir.join('big.bin')]
+
+
+def test_download_sliced_discards_stale_partial(tmpdir):
+    content = b'y' * 100
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties={'size': '100', 'generation': '4'})
+    filename = str(tmpdir.join('big.bin'))
+    tmpdir.join('big.bin.part').write(b'x' * 100, mode='wb')
+    tmpdir.join('big.bin.part.tracker').write(json.dumps(
+        {'generation': 3, 'size': 100, 'ranges': [[0, 100, 50]]}))
+    with mock.patch.object(blob, 'download_to_file', side_effect=_fake_range_download(content)) as download_to_file:
+        myutil.gcp.download_sliced(blob, filename, slices=1)
+        assert download_to_file.call_args[1] == {'start': 0, 'end': 99, 'checksum': None}
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+
+
+def test_download_sliced_short_read(tmpdir):
+    content = b'x' * 100
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties={'size': '200', 'generation': '3'})
+    filename = str(tmpdir.join('big.bin'))
+    with mock.patch.object(blob, 'download_to_file', side_effect=_fake_range_download(content)):
+        with pytest.raises(myutil.exceptions.CommandException):
+            myutil.gcp.download_sliced(blob, filename, slices=2)
+    assert not tmpdir.join('big.bin').exists()
+
+
+def _checksums(content):
+    crc32c = myutil.checksum.new_hasher('crc32c')
+    crc32c.update(content)
+    md5 = myutil.checksum.new_hasher('md5')
+    md5.update(content)
+    return {'crc32c': myutil.checksum.encode(crc32c), 'md5Hash': myutil.checksum.encode(md5)}
+
+
+@pytest.mark.parametrize('checksum', ['auto', 'crc32c', 'md5'])
+def test_download_sliced_validates_while_writing(tmpdir, checksum):
+    content = bytes(bytearray(range(256))) * 40
+    bucket = TestClient()._make_one(name='bucket')
+    properties = dict(_checksums(content), size=str(len(content)), generation='3')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties=properties)
+    filename = str(tmpdir.join('big.bin'))
+    with mock.patch.object(blob, 'download_to_file', side_effect=_fake_range_download(content)) as download_to_file:
+        with mock.patch('myutil.gcp.file_checksum') as file_checksum:
+            myutil.gcp.download_sliced(blob, filename, slices=3, checksum=checksum)
+            assert not file_checksum.called
+        # md5s of slices can't be combined, so md5 is a single stream
+        assert download_to_file.call_count == (1 if checksum == 'md5' else 3)
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+
+
+def test_download_sliced_validates_resumed_ranges(tmpdir):
+    content = bytes(bytearray(range(200)))
+    bucket = TestClient()._make_one(name='bucket')
+    properties = dict(_checksums(content), size='200', generation='3')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties=properties)
+    filename = str(tmpdir.join('big.bin'))
+    part = bytearray(200)
+    part[:130] = content[:130]
+    tmpdir.join('big.bin.part').write(bytes(part), mode='wb')
+    tmpdir.join('big.bin.part.tracker').write(json.dumps(
+        {'generation': 3, 'size': 200, 'ranges': [[0, 100, 100], [100, 200, 30]]}))
+    with mock.patch.object(blob, 'download_to_file', side_effect=_fake_range_download(content)) as download_to_file:
+        myutil.gcp.download_sliced(blob, filename, slices=2, checksum='crc32c')
+        assert download_to_file.call_args[1] == {'start': 130, 'end': 199, 'checksum': None}
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+
+
+def test_download_blob_retries_checksum_mismatch(tmpdir):
+    content = b'x' * 100
+    bucket = TestClient()._make_one(name='bucket')
+    properties = dict(_checksums(content), size='100', generation='3')
+    blob = TestBlob()._make_one(bucket=bucket, name='big.bin', properties=properties)
+    filename = str(tmpdir.join('big.bin'))
+    downloads = [_fake_range_download(b'y' * 100), _fake_range_download(content)]
+    with mock.patch.object(blob, 'download_to_file', side_effect=lambda *args, **kwargs: downloads.pop(0)(
+            *args, **kwargs)):
+        myutil.gcp.download_blob(blob, filename, slice_threshold=0, resumable_threshold=100)
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+
+    # Every attempt corrupt: nothing is left behind
+    with mock.patch.object(blob, 'download_to_file', side_effect=_fake_range_download(b'y' * 100)) as download:
+        with pytest.raises(myutil.exceptions.CommandException) as excinfo:
+            myutil.gcp.download_blob(blob, str(tmpdir.join('bad.bin')), slice_threshold=0, resumable_threshold=100)
+        assert download.call_count == 1 + myutil.gcp.CHECKSUM_RETRIES
+    assert 'checksum' in str(excinfo.value)
+    assert not tmpdir.join('bad.bin').exists() and not tmpdir.join('bad.bin.part').exists()
+    assert not tmpdir.join('bad.bin.part.tracker').exists()
+
+
+def _small_bucket(contents):
+    """A bucket whose client's session answers GETs of gs://bucket/<name> mediaLinks from contents"""
+    bucket = TestClient()._make_one(name='bucket')
+    bucket.client._http = mock.Mock()
+    bucket.client._http.get.side_effect = lambda url: mock.Mock(status_code=200, content=contents[url.split('/')[-1]])
+    return bucket
+
+
+def _small_blob(bucket, name, content, **properties):
+    properties = dict(_checksums(content), size=str(len(content)), mediaLink='https://media/' + name, **properties)
+    return TestBlob()._make_one(bucket=bucket, name=name, properties=properties)
+
+
+def test_is_small():
+    bucket = TestClient()._make_one(name='bucket')
+    assert myutil.gcp._is_small(_small_blob(bucket, '1.txt', b'x' * 10), 100)
+    assert not myutil.gcp._is_small(_small_blob(bucket, '1.txt', b'x' * 10), 0)
+    assert not myutil.gcp._is_small(_small_blob(bucket, '1.txt', b'x' * 100), 100)
+    assert not myutil.gcp._is_small(_small_blob(bucket, '1.txt', b'x' * 10, contentEncoding='gzip'), 100)
+    assert not myutil.gcp._is_small(TestBlob()._make_one(bucket=bucket, name='1.txt', properties={'size': '10'}), 100)
+
+
+def test_run_downloads_small_objects(tmpdir, capsys):
+    contents = {'1.txt': b'one', '2.txt': b'two', 'big.bin': b'x' * 200}
+    bucket = _small_bucket(contents)
+    tasks = [(_small_blob(bucket, name, contents[name]), str(tmpdir.join(name))) for name in sorted(contents)]
+    downloaded = []
+    with mock.patch('myutil.gcp.download_blob') as download_blob:
+        myutil.gcp.run_downloads(tasks, bucket, jobs=2, small_threshold=100,
+                                 downloaded=lambda blob, filename: downloaded.append(blob.name))
+        assert [c[0][0].name for c in download_blob.call_args_list] == ['big.bin']
+    assert sorted(c[0][0] for c in bucket.client._http.get.call_args_list) == \
+        ['https://media/1.txt', 'https://media/2.txt']
+    assert tmpdir.join('1.txt').read() == 'one' and tmpdir.join('2.txt').read() == 'two'
+    assert downloaded == ['1.txt', '2.txt', 'big.bin']
+    lines = capsys.readouterr().out.splitlines()
+    # Small objects get a progress line now and then, not one each
+    assert lines[-3:] == [
+        'Copying gs://bucket/2.txt... (2 of 2 small objects)',
+        'Copying gs://bucket/big.bin...',
+        'Copied 3 of 3 objects.',
+    ]
+
+
+def test_download_small_retries_checksum_mismatch(tmpdir):
+    bucket = _small_bucket({})
+    blob = _small_blob(bucket, '1.txt', b'good')
+    responses = [mock.Mock(status_code=200, content=b'evil'), mock.Mock(status_code=200, content=b'good')]
+    bucket.client._http.get.side_effect = lambda url: responses.pop(0)
+    myutil.gcp.download_small(blob, str(tmpdir.join('1.txt')))
+    assert tmpdir.join('1.txt').read() == 'good'
+
+    # Every attempt corrupt: nothing is written
+    bucket.client._http.get.side_effect = lambda url: mock.Mock(status_code=200, content=b'evil')
+    with pytest.raises(myutil.exceptions.CommandException) as excinfo:
+        myutil.gcp.download_small(blob, str(tmpdir.join('bad.txt')))
+    assert bucket.client._http.get.call_count == 2 + 1 + myutil.gcp.CHECKSUM_RETRIES
+    assert 'checksum' in str(excinfo.value)
+    assert not tmpdir.join('bad.txt').exists()
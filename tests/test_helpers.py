@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+import io
+
 import pytest
 
-from myutil.helpers import bucket_path_from_url
+from myutil.helpers import (bucket_path_from_url, compile_wildcard,
+                            has_wildcard, parse_byte_range, parse_size,
+                            wildcard_listing, wildcard_match, write_pages)
 
 
 def test_bucket_path_from_url_invalid_url():
@@ -17,3 +21,58 @@ def test_bucket_path_from_url_no_url():
 def test_bucket_path_from_url():
     output = bucket_path_from_url('gs://foo/a')
     assert output == ('foo', 'a')
+
+
+def test_write_pages():
+    stream = io.StringIO()
+    write_pages([[u'a', u'b'], [], [u'c']], stream=stream)
+    assert stream.getvalue() == u'a\nb\nc\n'
+
+
+def test_parse_size():
+    assert parse_size(1024) == 1024
+    assert parse_size('1024') == 1024
+    assert parse_size('150M') == 150 * 1024 * 1024
+    assert parse_size('2GiB') == 2 * 1024 * 1024 * 1024
+    assert parse_size('4k') == 4096
+
+
+def test_parse_size_invalid():
+    with pytest.raises(ValueError):
+        parse_size('1X')
+
+
+def test_parse_byte_range():
+    assert parse_byte_range('256-5939') == (256, 5940)
+    assert parse_byte_range('256-') == (256, None)
+    assert parse_byte_range('-5') == (-5, None)
+    for value in ('-', '5-1', 'a-b'):
+        with pytest.raises(ValueError):
+            parse_byte_range(value)
+
+
+def test_wildcard_listing():
+    assert wildcard_listing('logs/2026/**/*.gz') == ('logs/2026/', None)
+    assert wildcard_listing('logs/2026/0*') == ('logs/2026/0', '/')
+    assert wildcard_listing('logs/2026/0*', recursive=True) == ('logs/2026/0', None)
+    assert wildcard_listing('logs/*/01') == ('logs/', None)
+    assert wildcard_listing('logs/a.gz') == ('logs/a.gz', None)
+    assert not has_wildcard('logs/a.gz')
+
+
+def test_compile_wildcard():
+    matcher = compile_wildcard('logs/**/[!b]?.gz')
+    assert matcher.match('logs/a1.gz')
+    assert matcher.match('logs/2026/01/a1.gz')
+    assert not matcher.match('logs/b1.gz')
+    assert not matcher.match('logs/a1.gz.tmp')
+    assert compile_wildcard('a/*.txt').match('a/1.txt')
+    assert not compile_wildcard('a/*.txt').match('a/b/1.txt')
+
+
+def test_wildcard_match():
+    matcher = compile_wildcard('data/2026-*')
+    assert wildcard_match(matcher, 'data/2026-01/a/1.txt', recursive=True) == 'data/2026-01'
+    assert wildcard_match(matcher, 'data/2026-01/a/1.txt') is None
+    assert wildcard_match(matcher, 'data/2026-01.txt') == 'data/2026-01.txt'
+    assert wildcard_match(matcher, 'data/2025-01/1.txt', recursive=True) is None
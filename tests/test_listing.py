@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import time
+
+import google.auth.credentials
+import mock
+import pytest
+
+from myutil.listing import discover_shards, sharded_pages
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+class TestBlob():
+
+    @staticmethod
+    def _make_one(*args, **kw):
+        from google.cloud.storage.blob import Blob
+
+        properties = kw.pop('properties', {})
+        blob = Blob(*args, **kw)
+        blob._properties.update(properties)
+        return blob
+
+
+class FakePage(list):
+
+    def __init__(self, blobs, prefixes=()):
+        super(FakePage, self).__init__(blobs)
+        self.prefixes = set(prefixes)
+
+
+NAMES = sorted(['a/1.txt', 'a/2.txt', 'a/b/3.txt', 'a/b/4.txt', 'a/c/5.txt', 'a/d.txt', 'a/e/6.txt', 'a/e/f/7.txt',
+                'ab/8.txt', 'z.txt'])
+
+
+def _fake_listing(bucket, names, page_size=2):
+    """list_blobs stand-in listing `names` the way GCS does, page_size names or prefixes per page"""
+    def list_blobs(prefix='', delimiter=None, fields=None):
+        entries = []
+        for name in names:
+            if not name.startswith(prefix):
+                continue
+            position = name.find(delimiter, len(prefix)) if delimiter else -1
+            if position < 0:
+                entries.append((TestBlob()._make_one(bucket=bucket, name=name), None))
+            elif not entries or entries[-1][1] != name[:position + 1]:
+                entries.append((None, name[:position + 1]))
+        pages = [FakePage([blob for (blob, _) in chunk if blob is not None],
+                          [each for (_, each) in chunk if each is not None])
+                 for chunk in (entries[index:index + page_size] for index in range(0, len(entries), page_size))]
+        return mock.Mock(pages=iter(pages))
+    return list_blobs
+
+
+def _describe(units):
+    return [[blob.name for blob in unit] if isinstance(unit, list) else unit for unit in units]
+
+
+def test_discover_shards():
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch.object(bucket, 'list_blobs', side_effect=_fake_listing(bucket, NAMES)):
+        assert _describe(discover_shards(bucket, 'a/')) == [['a/1.txt', 'a/2.txt'], 'a/b/', 'a/c/', ['a/d.txt'], 'a/e/']
+        assert _describe(discover_shards(bucket, 'a/', depth=2)) == \
+            [['a/1.txt', 'a/2.txt'], ['a/b/3.txt', 'a/b/4.txt'], ['a/c/5.txt'], ['a/d.txt'], ['a/e/6.txt'], 'a/e/f/']
+        # A prefix that's a single "directory" is split below it
+        assert _describe(discover_shards(bucket, 'a/e')) == [['a/e/6.txt'], 'a/e/f/']
+
+
+@pytest.mark.parametrize('jobs,depth', [(1, 1), (2, 1), (8, 1), (2, 2), (8, 3)])
+def test_sharded_pages_in_name_order(jobs, depth):
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch.object(bucket, 'list_blobs', side_effect=_fake_listing(bucket, NAMES)):
+        for prefix in ('', 'a', 'a/', 'a/e'):
+            names = [blob.name for page in sharded_pages(bucket, prefix, jobs=jobs, depth=depth) for blob in page]
+            assert names == [name for name in NAMES if name.startswith(prefix)]
+
+
+def test_sharded_pages_asks_for_prefixes_when_projecting():
+    bucket = TestClient()._make_one(name='bucket')
+    with mock.patch.object(bucket, 'list_blobs', side_effect=_fake_listing(bucket, NAMES)) as list_blobs:
+        list(sharded_pages(bucket, 'a/', jobs=2, fields='items(name),nextPageToken'))
+    fields = set((call[1]['delimiter'] if 'delimiter' in call[1] else None, call[1]['fields'])
+                 for call in list_blobs.call_args_list)
+    assert fields == set([('/', 'items(name),nextPageToken,prefixes'), (None, 'items(name),nextPageToken')])
+
+
+def test_sharded_pages_shard_error():
+    bucket = TestClient()._make_one(name='bucket')
+    listing = _fake_listing(bucket, NAMES)
+
+    def list_blobs(prefix='', delimiter=None, fields=None):
+        if prefix == 'a/c/':
+            raise ValueError('boom')
+        return listing(prefix, delimiter, fields)
+
+    with mock.patch.object(bucket, 'list_blobs', side_effect=list_blobs):
+        with pytest.raises(ValueError):
+            list(sharded_pages(bucket, 'a/', jobs=4))
+
+
+def test_sharded_pages_streams_a_flat_prefix():
+    bucket = TestClient()._make_one(name='bucket')
+    names = ['flat/{:03d}.txt'.format(index) for index in range(200)] + ['flat/z/1.txt']
+    listing = _fake_listing(bucket, names)
+    fetched = []
+
+    def list_blobs(prefix='', delimiter=None, fields=None):
+        def pages():
+            for page in listing(prefix, delimiter, fields).pages:
+                fetched.append(page)
+                yield page
+        return mock.Mock(pages=pages())
+
+    with mock.patch.object(bucket, 'list_blobs', side_effect=list_blobs):
+        pages = sharded_pages(bucket, 'flat/', jobs=2)
+        assert [blob.name for blob in next(pages)] == names[:2]
+        time.sleep(0.2)
+        # Only a few pages are listed ahead of the one being consumed, not the whole level
+        assert len(fetched) < 20
+        assert [blob.name for page in pages for blob in page] == names[2:]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import google.auth.credentials
+import mock
+import pytest
+
+import myutil.exceptions
+from myutil.manifest import copy_manifest, read_manifest
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+MANIFEST = [
+    'gs://a/x/1.txt\n',
+    '\n',
+    'gs://b/2.txt\n',
+    'gs://a/x/1.txt\n',
+    'gs://a/y/3.txt',
+]
+
+
+def test_read_manifest():
+    assert list(read_manifest(MANIFEST)) == [('a', 'x/1.txt'), ('b', '2.txt'), ('a', 'x/1.txt'), ('a', 'y/3.txt')]
+
+
+@pytest.mark.parametrize('line', ['/tmp/1.txt', 'gs://a/x/', 'gs://a/x/*.txt'])
+def test_read_manifest_rejects_non_objects(line):
+    with pytest.raises(myutil.exceptions.CommandException) as excinfo:
+        list(read_manifest(['gs://a/1.txt', line]))
+    assert 'line 2' in str(excinfo.value)
+
+
+def _reload_missing(function, blobs, jobs=1):
+    for blob in blobs:
+        yield (blob, 'NotFound: 404' if blob.name == 'missing.txt' else None)
+
+
+def _copy_manifest(lines, dir, **options):
+    """Run copy_manifest in batches of 3 URLs, returning the download_tasks calls and the exception raised"""
+    buckets = {}
+
+    def get_bucket(name):
+        return buckets.setdefault(name, TestClient()._make_one(name=name))
+
+    (calls, error) = ([], None)
+    with mock.patch('myutil.manifest.MANIFEST_BATCH_SIZE', 3), \
+            mock.patch('myutil.manifest.get_bucket', side_effect=get_bucket), \
+            mock.patch('myutil.manifest.run_batches', side_effect=_reload_missing), \
+            mock.patch('myutil.manifest.download_tasks', return_value=[]) as download_tasks:
+        try:
+            copy_manifest(lines, dir, **options)
+        except myutil.exceptions.CommandException as exc:
+            error = exc
+        for c in download_tasks.call_args_list:
+            calls.append((c[0][1].name, [(blob.name, filename) for (blob, filename) in c[0][0]], c[1]))
+    return (calls, error)
+
+
+def test_copy_manifest(tmpdir, capsys):
+    lines = MANIFEST + ['gs://b/missing.txt', 'gs://a/4.txt', 'gs://b/2.txt']
+    (calls, error) = _copy_manifest(lines, str(tmpdir), jobs=4, checksum='md5')
+    # Batches of 3 URLs, each grouped by bucket. Repeats, even in a later batch, are copied once
+    options = {'jobs': 4, 'processes': False, 'checksum': 'md5'}
+    assert calls == [
+        ('a', [('x/1.txt', str(tmpdir.join('x', '1.txt')))], options),
+        ('b', [('2.txt', str(tmpdir.join('2.txt')))], options),
+        ('a', [('y/3.txt', str(tmpdir.join('y', '3.txt'))), ('4.txt', str(tmpdir.join('4.txt')))], options),
+    ]
+    assert tmpdir.join('x').isdir() and tmpdir.join('y').isdir()
+    assert str(error) == '1 object(s) failed to copy'
+    assert capsys.readouterr().out.splitlines() == [
+        'Copied 4 of 5 objects.',
+        'Failed gs://b/missing.txt: NotFound: 404',
+    ]
+
+
+def test_copy_manifest_same_destination(tmpdir, capsys):
+    lines = ['gs://a/d/x/1.txt', 'gs://a/d/y/1.txt', 'gs://b/d/x/1.txt', 'gs://a/d//x/1.txt', 'gs://a/../1.txt']
+    (calls, error) = _copy_manifest(lines, str(tmpdir))
+    assert [(bucket, tasks) for (bucket, tasks, _) in calls] == [
+        ('a', [('d/x/1.txt', str(tmpdir.join('d', 'x', '1.txt'))), ('d/y/1.txt', str(tmpdir.join('d', 'y', '1.txt')))]),
+    ]
+    assert str(error) == '3 object(s) failed to copy'
+    destination = tmpdir.join('d', 'x', '1.txt')
+    assert capsys.readouterr().out.splitlines() == [
+        'Copied 2 of 5 objects.',
+        'Failed gs://b/d/x/1.txt: Destination {} is taken by gs://a/d/x/1.txt'.format(destination),
+        'Failed gs://a/d//x/1.txt: Destination {} is taken by gs://a/d/x/1.txt'.format(destination),
+        'Failed gs://a/../1.txt: Object name has . or .. segments, so it would land outside the destination',
+    ]
+
+
+def test_copy_manifest_needs_a_directory(tmpdir):
+    with pytest.raises(myutil.exceptions.CommandException):
+        copy_manifest(['gs://a/1.txt'], str(tmpdir.join('missing')))
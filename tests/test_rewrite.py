@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import google.auth.credentials
+import mock
+import pytest
+
+import myutil.exceptions
+from myutil.rewrite import copy_blob, copy_blobs, plan_copies
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+class TestBlob():
+
+    @staticmethod
+    def _make_one(*args, **kw):
+        from google.cloud.storage.blob import Blob
+
+        properties = kw.pop('properties', {})
+        blob = Blob(*args, **kw)
+        blob._properties.update(properties)
+        return blob
+
+
+def test_plan_copies_keeps_last_prefix_part():
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [TestBlob()._make_one(bucket=bucket, name=name) for name in ('a/b', 'a/b/1.txt', 'a/b/c/2.txt', 'a/bc')]
+    assert [(blob.name, name) for (blob, name) in plan_copies(blobs, 'a/b', 'x/')] == \
+        [('a/b/1.txt', 'x/b/1.txt'), ('a/b/c/2.txt', 'x/b/c/2.txt')]
+    assert [name for (blob, name) in plan_copies(blobs[:1], 'a/b', '')] == ['b']
+
+
+def test_copy_blob_follows_rewrite_tokens():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='1.txt')
+    with mock.patch('google.cloud.storage.blob.Blob.rewrite', autospec=True,
+                    side_effect=[('t1', 10, 30), ('t2', 20, 30), (None, 30, 30)]) as rewrite:
+        destination = copy_blob(blob, bucket, 'copy.txt')
+    assert destination.name == 'copy.txt'
+    assert [c[1]['token'] for c in rewrite.call_args_list] == [None, 't1', 't2']
+
+
+def test_copy_blobs_single_object_name():
+    bucket = TestClient()._make_one(name='bucket')
+    blob = TestBlob()._make_one(bucket=bucket, name='a/1.txt')
+    with mock.patch('myutil.rewrite.copy_blob') as copy:
+        copy_blobs([blob], bucket, 'a/1.txt', destination='b/')
+        copy_blobs([blob], bucket, 'a/1.txt', destination='b/2.txt')
+    assert [c[0][2] for c in copy.call_args_list] == ['b/1.txt', 'b/2.txt']
+
+
+def test_copy_blobs_reports_failures(capsys):
+    bucket = TestClient()._make_one(name='bucket')
+    bucket.client.bucket = mock.Mock(return_value=bucket)
+    blobs = [TestBlob()._make_one(bucket=bucket, name=name) for name in ('a/1.txt', 'a/2.txt')]
+    with mock.patch('myutil.rewrite.copy_blob', side_effect=[None, ValueError('gone')]) as copy:
+        with pytest.raises(myutil.exceptions.CommandException):
+            copy_blobs(blobs, bucket, 'a', destination='b', recursive=True)
+    out = capsys.readouterr().out
+    assert 'Copied 1 of 2 objects.' in out
+    assert 'Failed gs://bucket/a/2.txt: ValueError: gone' in out
+    assert [c[0][2] for c in copy.call_args_list] == ['b/a/1.txt', 'b/a/2.txt']
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import json
+
+import google.auth.credentials
+import mock
+import pytest
+
+import myutil.exceptions
+from myutil.rsync import INDEX_FILENAME, rsync_blobs
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+class TestBlob():
+
+    @staticmethod
+    def _make_one(*args, **kw):
+        from google.cloud.storage.blob import Blob
+
+        properties = kw.pop('properties', {})
+        blob = Blob(*args, **kw)
+        blob._properties.update(properties)
+        return blob
+
+
+def _blob(bucket, name, data):
+    # md5/crc32c of b'hello' and b'world'
+    checksums = {
+        b'hello': ('mnG7TA==', 'XUFAKrxLKna5cZ2REBfFkg=='),
+        b'world': ('MaqBTg==', 'fXkwN6B2AYZXSwKC8vQ15w=='),
+    }
+    (crc32c, md5) = checksums[data]
+    return TestBlob()._make_one(bucket=bucket, name=name, properties={
+        'size': str(len(data)), 'crc32c': crc32c, 'md5Hash': md5, 'updated': '2018-01-01T00:00:00.000Z'})
+
+
+def _fake_run_downloads(contents):
+    def run_downloads(tasks, bucket, jobs=1, processes=False, downloaded=None, **options):
+        for (blob, filename) in tasks:
+            with open(filename, 'wb') as f:
+                f.write(contents[blob.name])
+            downloaded(blob, filename)
+    return run_downloads
+
+
+def test_rsync_blobs_copies_missing_and_changed(tmpdir):
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [
+        _blob(bucket, 'a/1.txt', b'hello'),
+        _blob(bucket, 'a/b/2.txt', b'world'),
+        _blob(bucket, 'a/3.txt', b'hello'),
+    ]
+    tmpdir.join('1.txt').write(b'hello', mode='wb')
+    tmpdir.join('3.txt').write(b'HELLO', mode='wb')
+    contents = {'a/b/2.txt': b'world', 'a/3.txt': b'hello'}
+    with mock.patch('myutil.rsync.run_downloads', side_effect=_fake_run_downloads(contents)) as run_downloads:
+        rsync_blobs(blobs, str(tmpdir), prefix='a')
+        tasks = run_downloads.call_args[0][0]
+        assert [(blob.name, filename) for (blob, filename) in tasks] == [
+            ('a/b/2.txt', str(tmpdir.join('b', '2.txt'))),
+            ('a/3.txt', str(tmpdir.join('3.txt'))),
+        ]
+    assert tmpdir.join('3.txt').read() == 'hello'
+    assert tmpdir.join('b', '2.txt').mtime() == 1514764800
+    index = json.loads(tmpdir.join(INDEX_FILENAME).read())
+    assert sorted(index) == ['1.txt', '3.txt', 'b/2.txt']
+    assert index['b/2.txt']['crc32c'] == 'MaqBTg=='
+
+
+def test_rsync_blobs_uses_index_instead_of_hashing(tmpdir):
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [_blob(bucket, 'a/1.txt', b'hello')]
+    tmpdir.join('1.txt').write(b'hello', mode='wb')
+    with mock.patch('myutil.rsync.run_downloads') as run_downloads:
+        rsync_blobs(blobs, str(tmpdir), prefix='a/')
+        with mock.patch('myutil.rsync.file_checksum') as file_checksum:
+            rsync_blobs(blobs, str(tmpdir), prefix='a/')
+            assert not file_checksum.called
+        assert not run_downloads.called
+
+
+def test_rsync_blobs_delete(tmpdir, capsys):
+    bucket = TestClient()._make_one(name='bucket')
+    blobs = [_blob(bucket, 'a/1.txt', b'hello'), _blob(bucket, 'a/2.txt', b'world')]
+    tmpdir.join('1.txt').write(b'hello', mode='wb')
+    tmpdir.join('2.txt.part').write(b'wor', mode='wb')
+    tmpdir.join('extra.txt').write(b'extra', mode='wb')
+    tmpdir.mkdir('sub').join('extra.txt').write(b'extra', mode='wb')
+    with mock.patch('myutil.rsync.run_downloads'):
+        rsync_blobs(blobs, str(tmpdir), prefix='a', delete=True)
+    assert sorted(path.basename for path in tmpdir.visit() if path.isfile()) == [
+        INDEX_FILENAME, '1.txt', '2.txt.part']
+    assert capsys.readouterr().out.splitlines() == ['Skipped 1 unchanged objects.', 'Deleted 2 extra files.']
+
+
+def test_rsync_blobs_no_matches(tmpdir):
+    bucket = TestClient()._make_one(name='bucket')
+    tmpdir.join('1.txt').write(b'hello', mode='wb')
+    with pytest.raises(myutil.exceptions.CommandException):
+        rsync_blobs([_blob(bucket, 'ab/1.txt', b'hello')], str(tmpdir), prefix='a', delete=True)
+    assert tmpdir.join('1.txt').exists()
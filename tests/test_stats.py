@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import threading
+
+import mock
+
+from myutil import stats
+
+
+def test_percentiles():
+    assert stats.percentiles([]) == {'count': 0}
+    assert stats.percentiles([float(n) for n in range(100, 0, -1)]) == {
+        'count': 100, 'p50': 50.0, 'p90': 90.0, 'p99': 99.0, 'max': 100.0}
+    assert stats.percentiles([3.0]) == {'count': 1, 'p50': 3.0, 'p90': 3.0, 'p99': 3.0, 'max': 3.0}
+
+
+def test_disabled_records_nothing():
+    pages = [[1, 2], [3]]
+    assert stats.timed_pages(pages) is pages
+    with stats.recording('ls') as recorder:
+        assert recorder is None
+        assert stats.timed_pages(pages) is pages
+        stats.record_transfer('bucket', stats.end(stats.begin('a'), 1))
+
+
+def test_transfer_counts_responses():
+    with mock.patch('time.time', side_effect=[10.0, 10.5, 12.0]):
+        transfer = stats.begin('a.txt')
+        stats.on_response(retries=2)
+        stats.on_response()
+        record = stats.end(transfer, 300)
+    assert record == {'name': 'a.txt', 'bytes': 300, 'ttfb': 0.5, 'duration': 2.0, 'throughput': 150.0,
+                      'requests': 2, 'retries': 2, 'error': None}
+    stats.on_response()  # Outside a transfer, nothing to count against
+
+
+def test_bind_carries_transfer_to_other_threads():
+    transfer = stats.begin('a.txt')
+    thread = threading.Thread(target=stats.bind(stats.on_response))
+    thread.start()
+    thread.join()
+    stats.end(transfer, 1)
+    assert transfer.requests == 1
+
+
+def test_recording(tmpdir):
+    trace = str(tmpdir.join('trace.jsonl'))
+    summary = io.StringIO()
+    with stats.recording('cp', trace=trace, summary=summary):
+        assert list(stats.timed_pages([[1, 2], [3]])) == [[1, 2], [3]]
+        stats.record_transfer('bucket', {'name': 'a.txt', 'bytes': 100, 'ttfb': 0.25, 'duration': 1.0,
+                                         'throughput': 100.0, 'requests': 1, 'retries': 1, 'error': None})
+        stats.record_transfer('bucket', {'name': 'b.txt', 'bytes': 5, 'ttfb': None, 'duration': 0.5,
+                                         'throughput': None, 'requests': 0, 'retries': 0, 'error': 'IOError: x'})
+    assert stats._recorder is None
+
+    events = [json.loads(line) for line in open(trace)]
+    assert [event['event'] for event in events] == ['page', 'page', 'transfer', 'transfer', 'summary']
+    assert [event['items'] for event in events[:2]] == [2, 1]
+    assert events[2]['name'] == 'gs://bucket/a.txt'
+    assert events[3]['error'] == 'IOError: x'
+    result = json.loads(summary.getvalue())
+    assert result == events[-1]
+    assert result['command'] == 'cp'
+    assert [result[key] for key in ('items', 'objects', 'failed', 'bytes', 'retries')] == [3, 2, 1, 100, 1]
+    assert result['pages']['count'] == 2
+    assert result['ttfb'] == {'count': 1, 'p50': 0.25, 'p90': 0.25, 'p99': 0.25, 'max': 0.25}
+    assert result['duration']['count'] == 1
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import mock
+import requests
+from requests.adapters import HTTPAdapter
+
+from myutil.transport import TransportAdapter, mount, resolve_environment
+
+
+def test_adapter_settings():
+    adapter = TransportAdapter(pool_size=32, timeout=5, retries=4, backoff=0.25)
+    assert adapter._pool_maxsize == 32
+    assert adapter.max_retries.total == 4
+    assert adapter.max_retries.backoff_factor == 0.25
+    assert 503 in adapter.max_retries.status_forcelist
+    assert 429 in adapter.max_retries.status_forcelist
+    assert not adapter.max_retries.is_retry('POST', 503)
+
+
+def test_adapter_timeout_overrides_callers():
+    adapter = TransportAdapter(pool_size=1, timeout=5, retries=0, backoff=0)
+    with mock.patch.object(HTTPAdapter, 'send') as send:
+        adapter.send('request', timeout=(61, 60), stream=True)
+        send.assert_called_once_with('request', timeout=5, stream=True)
+
+
+def test_mount():
+    session = requests.Session()
+    mount(session, pool_size=8, timeout=5, retries=2, backoff=1)
+    assert isinstance(session.get_adapter('https://storage.googleapis.com/'), TransportAdapter)
+    assert session.get_adapter('http://localhost/') is session.get_adapter('https://storage.googleapis.com/')
+
+
+def test_mount_keeps_mtls_adapter():
+    session = requests.Session()
+    session.is_mtls = True
+    mount(session, pool_size=8, timeout=5, retries=2, backoff=1)
+    assert not isinstance(session.get_adapter('https://storage.googleapis.com/'), TransportAdapter)
+
+
+def test_adapter_reports_responses():
+    adapter = TransportAdapter(pool_size=1, timeout=5, retries=3, backoff=0)
+    response = mock.Mock(status_code=503)
+    response.raw.retries.history = ('first', 'second')
+    with mock.patch.object(HTTPAdapter, 'send', return_value=response), \
+            mock.patch('myutil.transport.on_response') as on_response:
+        assert adapter.send('request') is response
+        on_response.assert_called_once_with(retries=3)
+
+
+def test_resolve_environment():
+    session = requests.Session()
+    with mock.patch.dict('os.environ', {'HTTPS_PROXY': 'http://proxy:3128', 'REQUESTS_CA_BUNDLE': '/etc/ca.pem'},
+                         clear=True):
+        resolve_environment(session, 'https://storage.googleapis.com')
+    assert session.proxies == {'https': 'http://proxy:3128'}
+    assert session.verify == '/etc/ca.pem'
+    assert session.trust_env is False
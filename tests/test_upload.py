@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import io
+import threading
+
+import google.auth.credentials
+import mock
+import pytest
+
+import myutil.exceptions
+from myutil.upload import (COMPONENT_PREFIX, _FileRange, plan_uploads,
+                           upload_composite, upload_files)
+
+
+class TestClient:
+    @staticmethod
+    def _get_target_class():
+        from google.cloud.storage.bucket import Bucket
+        return Bucket
+
+    def _make_credentials(self):
+        return mock.Mock(spec=google.auth.credentials.Credentials)
+
+    def _make_one(self, name=None):
+        client = self._make_credentials()
+        return self._get_target_class()(client, name=name)
+
+
+def test_plan_uploads_keeps_dir_name(tmpdir):
+    tmpdir.mkdir('src').mkdir('sub').join('2.txt').write('2')
+    tmpdir.join('src', '1.txt').write('1')
+    source = str(tmpdir.join('src'))
+    assert [name for (filename, name) in plan_uploads(source, 'up/')] == ['up/src/1.txt', 'up/src/sub/2.txt']
+    assert [name for (filename, name) in plan_uploads(source + '/', '')] == ['src/1.txt', 'src/sub/2.txt']
+
+
+def test_plan_uploads_single_file(tmpdir):
+    tmpdir.join('1.txt').write('1')
+    filename = str(tmpdir.join('1.txt'))
+    assert list(plan_uploads(filename, 'a/b.txt')) == [(filename, 'a/b.txt')]
+    assert list(plan_uploads(filename, 'a/')) == [(filename, 'a/1.txt')]
+    assert list(plan_uploads(filename, '')) == [(filename, '1.txt')]
+
+
+def test_upload_files_dir_not_recursive(tmpdir, capsys):
+    bucket = TestClient()._make_one(name='bucket')
+    with pytest.raises(myutil.exceptions.CommandException):
+        upload_files(str(tmpdir), bucket, prefix='up/')
+    assert 'Did you mean to do cp -r?' in capsys.readouterr().out
+
+
+def test_upload_composite_composes_and_deletes_components(tmpdir):
+    bucket = TestClient()._make_one(name='bucket')
+    filename = str(tmpdir.join('big.bin'))
+    with open(filename, 'wb') as f:
+        f.write(b'x' * 100)
+    uploaded = {}
+
+    def upload_from_file(blob, stream, size=None):
+        uploaded[blob.name] = (stream.tell(), stream.read())
+
+    with mock.patch('google.cloud.storage.blob.Blob.upload_from_file', autospec=True,
+                    side_effect=upload_from_file), \
+            mock.patch('google.cloud.storage.blob.Blob.compose', autospec=True) as compose, \
+            mock.patch.object(bucket, 'delete_blobs') as delete_blobs:
+        upload_composite(filename, bucket, 'big.bin', slices=40)
+
+    assert len(uploaded) == 34  # 3 bytes per component
+    assert all(name.startswith(COMPONENT_PREFIX) for name in uploaded)
+    assert all(tell == 0 for (tell, data) in uploaded.values())
+    assert sum(len(data) for (tell, data) in uploaded.values()) == 100
+    # 32 components, then the result so far and the remaining 2
+    assert [len(c[0][1]) for c in compose.call_args_list] == [32, 3]
+    assert compose.call_args_list[1][0][1][0].name == 'big.bin'
+    assert compose.call_args_list[0][0][0].content_type == 'application/octet-stream'
+    assert sorted(blob.name for blob in delete_blobs.call_args[0][0]) == sorted(uploaded)
+
+
+def test_file_range():
+    cancelled = threading.Event()
+    view = _FileRange(io.BytesIO(b'0123456789'), 3, 7, cancelled)
+    assert view.tell() == 0
+    assert view.read(2) == b'34'
+    assert view.tell() == 2
+    assert view.read() == b'56'
+    assert view.read() == b''
+    view.seek(1)
+    assert view.read(10) == b'456'
+    cancelled.set()
+    with pytest.raises(myutil.exceptions.CommandException):
+        view.read()